@@ -1,6 +1,14 @@
 # coding: utf-8
 
+from .adjust import rescale_pre
 from .analyze import KlineAnalyze
+from .builder import BarBuilder
+from .export import batch_export, render_html, render_image
+from .journal import SignalJournal
+from .registry import AnalyzerRegistry
+from .scanner import Scanner
+from .store import BarStore, analyze_universe
+from .sweep import expand_grid, sweep
 from .utils import *
 
 __version__ = "v20201119.1"
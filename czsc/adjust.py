@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+复权：原始K线只保存一份，每个标的一张复权因子表，读取时按复权方式向量化地计算价格，
+复权方式见 README 中的复权字典：None 不复权，pre 前复权，post 后复权
+
+复权因子表为按时间升序的 (dts, factors)，factors 为后复权因子，从对应的 dt（含）开始生效，第一个 dt 之前为 1：
+    后复权价格 = 原始价格 * factor
+    前复权价格 = 原始价格 * factor / 最新的 factor
+新增除权除息只改变最新的 factor，已有K线的前复权价格整体按同一比例变化，
+已经计算好的分析器用 rescale_pre 按比例缩放即可，不需要重新获取K线、重新计算
+"""
+
+import numpy as np
+
+from czsc.utils import dt_to_i8
+
+modes = (None, "pre", "post")
+
+# 需要复权的价格字段，成交量不调整
+price_fields = ("open", "close", "high", "low")
+
+
+def factor_table(dts, factors):
+    """整理复权因子表
+    :param dts: 因子生效时间，datetime 或 int64 纳秒时间戳
+    :param factors: 后复权因子
+    :return: (np.array of int64, np.array of double)
+    """
+    dts = np.asarray(dts)
+    dts = dts.astype(np.int64) if dts.dtype.kind in "iu" else dt_to_i8(dts)
+    factors = np.asarray(factors, dtype=np.double)
+    if len(dts) != len(factors):
+        raise ValueError("复权因子表的时间与因子数量不一致")
+    if np.any(factors <= 0):
+        raise ValueError("复权因子必须大于 0")
+    order = np.argsort(dts, kind="stable")
+    return dts[order], factors[order]
+
+
+def factor_at(dts, table):
+    """每根K线的后复权因子
+    :param dts: np.array of int64
+        K线时间
+    :param table: tuple
+        复权因子表，见 factor_table；None 表示没有除权除息
+    :return: np.array of double
+    """
+    if table is None or len(table[1]) == 0:
+        return np.ones(len(dts))
+    f_dts, factors = table
+    i = np.searchsorted(f_dts, dts, side="right") - 1
+    return np.where(i >= 0, factors[np.maximum(i, 0)], 1.0)
+
+
+def latest_factor(table):
+    """最新的后复权因子，前复权以它为基准"""
+    return 1.0 if table is None or len(table[1]) == 0 else float(table[1][-1])
+
+
+def adjust_columns(columns, table, mode):
+    """按复权方式计算价格列
+    :param columns: dict of np.array
+        包含 dt 及价格列，比如 BarStore.view 的结果
+    :param table: tuple
+        复权因子表，见 factor_table
+    :param mode: str
+        复权方式，None / pre / post
+    :return: dict of np.array
+        价格列为新数组，其他列原样返回；不复权时返回 columns 本身
+    """
+    if mode not in modes:
+        raise ValueError("复权方式可选值为 None / pre / post")
+    if mode is None or table is None:
+        return columns
+    f = factor_at(columns['dt'], table)
+    if mode == "pre":
+        f = f / latest_factor(table)
+    out = dict(columns)
+    for k in price_fields:
+        out[k] = columns[k] * f
+    return out
+
+
+def rescale_pre(ka, old, new):
+    """前复权下，复权因子表从 old 更新为 new 之后，按比例缩放分析器已有的结构（包括高级别），不需要重新计算
+    新的除权除息在已有K线之后时，所有K线按同一比例缩放；因子表修正了已有K线之间的因子时，
+    各段分别缩放，变化位置之后的结构回退重新计算，见 KlineAnalyze.rescale
+    :param ka: KlineAnalyze
+        用 old 前复权的K线计算的分析器
+    :param old: tuple
+        原来的复权因子表，见 factor_table；None 表示原来没有除权除息
+    :param new: tuple
+        新的复权因子表
+    :return: KlineAnalyze
+    """
+    if not ka._kline_raw:
+        return ka
+    dts = np.array([x['dt'] for x in ka._kline_raw], dtype=np.int64)
+    # 因子没有变化的K线比例完全相同，只差最新因子的比值
+    ratio = factor_at(dts, new) / factor_at(dts, old) * (latest_factor(old) / latest_factor(new))
+
+    # 比例相同的连续K线为一段，从最后一段开始，每次缩放之前所有K线，比例相对已经缩放的部分计算
+    ends = (np.flatnonzero(ratio[1:] != ratio[:-1]) + 1).tolist() + [len(dts)]
+    applied = 1.0
+    for end in reversed(ends):
+        r = float(ratio[end - 1])
+        if r != applied:
+            ka.rescale(r / applied, None if end == len(dts) else int(dts[end]))
+            applied = r
+    return ka
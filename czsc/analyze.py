@@ -1,12 +1,19 @@
 # coding: utf-8
 
 import warnings
+from bisect import bisect_left
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 import talib as ta
 
+from czsc import engine as _engine
+from czsc.adjust import adjust_columns
 from czsc.plot import *
+from czsc.snapshot import Snapshot, empty as _empty_seq
+from czsc.store import BarStore
 from czsc.utils import *
 
 ######################## compare method ###############################
@@ -21,6 +28,177 @@ def has_gap(k1, k2, min_gap=0.002):
         return False
 
 
+def _bisect_dt(points, dt, right=False):
+    """points 按 dt 升序，返回第一个 dt 大于等于（right=True 时大于）给定时间的元素位置"""
+    if isinstance(points, _ColumnRows):
+        return int(np.searchsorted(points.column('dt'), dt, side='right' if right else 'left'))
+    lo, hi = 0, len(points)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if points[mid]['dt'] < dt or (right and points[mid]['dt'] == dt):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _range_dt(points, start_dt, end_dt):
+    """points 按 dt 升序，返回 dt 在 [start_dt, end_dt] 内的元素"""
+    return points[_bisect_dt(points, start_dt): _bisect_dt(points, end_dt, right=True)]
+
+
+def _first_diff(old, new, keys=None):
+    """比较更新前后的序列，返回第一个不同元素的时间，完全相同时返回 None
+    :param keys: 只比较这些字段，默认比较整个元素
+    """
+    for a, b in zip(old, new):
+        if (a != b) if keys is None else any(a[k] != b[k] for k in keys):
+            return min(a['dt'], b['dt'])
+    if len(old) != len(new):
+        return old[len(new)]['dt'] if len(old) > len(new) else new[len(old)]['dt']
+    return None
+
+
+def _keep_unchanged(old, new):
+    """整体重新计算的序列 new 中与 old 相同的前缀换回 old 中的对象，
+    对外序列、快照按对象是否相同判断变化，只需转换变化的部分，见 KlineAnalyze._view"""
+    n = 0
+    for a, b in zip(old, new):
+        if a is not b and a != b:
+            break
+        n += 1
+    new[:n] = old[:n]
+
+
+# 笔、线段标记的全部字段（不含笔标记上的 xd），前三个决定标记的位置。下游的线段、中枢直接引用这些标记，
+# 只有 end_dt、fx_high 等字段变化时也要更新下游，否则下游持有的是过期的标记
+_bi_keys = ('dt', 'fx_mark', 'bi', 'start_dt', 'end_dt', 'fx_high', 'fx_low')
+_xd_keys = ('dt', 'fx_mark', 'xd', 'start_dt', 'end_dt', 'fx_high', 'fx_low')
+
+# 逐根计算 MACD 时使用的K线窗口
+_macd_window = 200
+
+
+######################## time conversion ###############################
+# 分析器内部的时间字段都是 int64 纳秒时间戳（不带时区），比较和查找都是整数运算；
+# 只在输入K线、对外提供的序列和查询结果中转换为 pd.Timestamp。输入带时区的时间时报错，见 check_naive
+
+_dt_keys = ('dt', 'start_dt', 'end_dt')
+
+
+def _dt_i8(dt):
+    """时间转成 int64 纳秒时间戳，可以是 datetime、pd.Timestamp、字符串或整数；不接受带时区的时间，见 check_naive"""
+    if isinstance(dt, (int, np.integer)):
+        return int(dt)
+    dt = pd.Timestamp(dt)
+    check_naive(dt)
+    return dt.value
+
+
+def _to_public(x):
+    """内部结构的副本，时间字段转成 pd.Timestamp，嵌套的 dict、list 一并转换"""
+    if isinstance(x, dict):
+        return {k: pd.Timestamp(v) if k in _dt_keys and isinstance(v, int) else _to_public(v)
+                for k, v in x.items()}
+    if isinstance(x, list):
+        return [_to_public(v) for v in x]
+    return x
+
+
+def _to_internal(x):
+    """_to_public 的逆转换：时间字段转成 int64 纳秒时间戳，嵌套的 dict、list 一并转换"""
+    if isinstance(x, dict):
+        return {k: _dt_i8(v) if k in _dt_keys and v is not None and not isinstance(v, (dict, list))
+                else _to_internal(v) for k, v in x.items()}
+    if isinstance(x, Sequence) and not isinstance(x, str):
+        return [_to_internal(v) for v in x]
+    return x
+
+
+def _public_list(items):
+    """批量转换同一序列中的元素，没有嵌套结构时按列转换时间字段；元素很少时（比如增量更新）逐个转换更快"""
+    if len(items) < 16 or any(isinstance(v, (dict, list)) for v in items[0].values()):
+        return [_to_public(x) for x in items]
+    out = [dict(x) for x in items]
+    for key in _dt_keys:
+        if key in items[0] and all(key in x for x in items):
+            for x, ts in zip(out, pd.DatetimeIndex([x[key] for x in items])):
+                x[key] = ts
+    return out
+
+
+class _ColumnRows(Sequence):
+    """按列存放的序列，比如整体计算的指标、从K线库读取的原始K线。元素在第一次访问时生成 dict
+    （与逐根生成的元素相同，键的顺序也相同）并缓存，同一位置总是返回同一对象。整体计算时不必为每根K线生成 dict，
+    只读取尾部（比如判断背驰）时只生成尾部的元素。只读，修改之前先用 list() 转成普通列表
+    """
+
+    __slots__ = ('_keys', '_columns', '_rows')
+
+    def __init__(self, keys, columns):
+        """
+        :param keys: list of str
+        :param columns: list of np.array，与 keys 一一对应，等长；元素中的值为对应的 Python 标量
+        """
+        self._keys = keys
+        self._columns = columns
+        self._rows = [None] * len(columns[0])
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self._rows)))]
+        row = self._rows[i]
+        if row is None:
+            row = self._rows[i] = dict(zip(self._keys, [c.item(i) for c in self._columns]))
+        return row
+
+    def __iter__(self):
+        rows = self._rows
+        if None in rows:
+            for i, values in enumerate(zip(*[c.tolist() for c in self._columns])):
+                if rows[i] is None:
+                    rows[i] = dict(zip(self._keys, values))
+        return iter(rows)
+
+    def __eq__(self, other):
+        if isinstance(other, (_ColumnRows, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def peek(self, i):
+        """与 self[i] 相同，但还没有生成的元素只生成新的 dict，不写入缓存，见 _PublicSeq"""
+        if isinstance(i, slice):
+            values = zip(*[c[i].tolist() for c in self._columns])
+            return [row or dict(zip(self._keys, v)) for row, v in zip(self._rows[i], values)]
+        return self._rows[i] or dict(zip(self._keys, [c.item(i) for c in self._columns]))
+
+    def keys(self):
+        """元素的键，与列一一对应"""
+        return list(self._keys)
+
+    def column(self, key):
+        """某一列，np.array"""
+        return self._columns[self._keys.index(key)]
+
+
+def _tail_column(rows, key, dtype, count=None):
+    """取出 rows 最后 count 个元素（默认全部）的一列，_ColumnRows 直接读取按列存放的数据，不生成 dict
+    :return: np.array
+    """
+    if isinstance(rows, _ColumnRows):
+        column = rows.column(key)
+    else:
+        column = [x[key] for x in (rows if count is None else rows[-count:])]
+        count = None
+    return np.array(column if count is None else column[-count:], dtype=dtype)
+
+
 def seq_standardized(bi_seq):
     """计算标准特征序列
     :param bi_seq: list of dict
@@ -80,26 +258,42 @@ def is_valid_xd(bi_seq1, bi_seq2, bi_seq3):
     assert bi_seq2[0]['dt'] == bi_seq1[-1]['dt'] and bi_seq3[0]['dt'] == bi_seq2[-1]['dt']
 
     standard_bi_seq1 = seq_standardized(bi_seq1)
-    if len(standard_bi_seq1) == 0 or len(bi_seq2) < 4:
+    seq1 = (len(standard_bi_seq1),
+            min([x['low'] for x in standard_bi_seq1], default=None),
+            max([x['high'] for x in standard_bi_seq1], default=None))
+    return _check_xd(seq1, bi_seq2, lambda: seq_standardized(bi_seq2 + bi_seq3[1:]))
+
+
+def _check_xd(seq1, bi_seq2, get_standard_bi_seq2):
+    """is_valid_xd 的判断逻辑
+    :param seq1: tuple
+        第一段笔的标准特征序列的 (长度, 最低价, 最高价)
+    :param bi_seq2: list of dict
+        第二个线段标记到第三个线段标记之间的笔序列
+    :param get_standard_bi_seq2: callable
+        返回第二段与第三段笔序列连起来的标准特征序列，只在第二种情况下调用
+    :return: bool
+    """
+    seq1_len, seq1_low, seq1_high = seq1
+    if seq1_len == 0 or len(bi_seq2) < 4:
         return False
 
     # 第一种情况（向下线段）
     # if bi_seq2[0]['fx_mark'] == 'd' and bi_seq2[1]['bi'] >= standard_bi_seq1[-1]['low']:
-    if bi_seq2[0]['fx_mark'] == 'd' and bi_seq2[1]['bi'] >= min([x['low'] for x in standard_bi_seq1]):
+    if bi_seq2[0]['fx_mark'] == 'd' and bi_seq2[1]['bi'] >= seq1_low:
         if bi_seq2[-1]['bi'] < bi_seq2[1]['bi']:
             return False
 
     # 第一种情况（向上线段）
     # if bi_seq2[0]['fx_mark'] == 'g' and bi_seq2[1]['bi'] <= standard_bi_seq1[-1]['high']:
-    if bi_seq2[0]['fx_mark'] == 'g' and bi_seq2[1]['bi'] <= max([x['high'] for x in standard_bi_seq1]):
+    if bi_seq2[0]['fx_mark'] == 'g' and bi_seq2[1]['bi'] <= seq1_high:
         if bi_seq2[-1]['bi'] > bi_seq2[1]['bi']:
             return False
 
     # 第二种情况（向下线段）
     # if bi_seq2[0]['fx_mark'] == 'd' and bi_seq2[1]['bi'] < standard_bi_seq1[-1]['low']:
-    if bi_seq2[0]['fx_mark'] == 'd' and bi_seq2[1]['bi'] < min([x['low'] for x in standard_bi_seq1]):
-        bi_seq2.extend(bi_seq3[1:])
-        standard_bi_seq2 = seq_standardized(bi_seq2)
+    if bi_seq2[0]['fx_mark'] == 'd' and bi_seq2[1]['bi'] < seq1_low:
+        standard_bi_seq2 = get_standard_bi_seq2()
         if len(standard_bi_seq2) < 3:
             return False
 
@@ -118,9 +312,8 @@ def is_valid_xd(bi_seq1, bi_seq2, bi_seq3):
 
     # 第二种情况（向上线段）
     # if bi_seq2[0]['fx_mark'] == 'g' and bi_seq2[1]['bi'] > standard_bi_seq1[-1]['high']:
-    if bi_seq2[0]['fx_mark'] == 'g' and bi_seq2[1]['bi'] > max([x['high'] for x in standard_bi_seq1]):
-        bi_seq2.extend(bi_seq3[1:])
-        standard_bi_seq2 = seq_standardized(bi_seq2)
+    if bi_seq2[0]['fx_mark'] == 'g' and bi_seq2[1]['bi'] > seq1_high:
+        standard_bi_seq2 = get_standard_bi_seq2()
         if len(standard_bi_seq2) < 3:
             return False
 
@@ -139,6 +332,79 @@ def is_valid_xd(bi_seq1, bi_seq2, bi_seq3):
     return True
 
 
+class _FeatureSeq:
+    """从某个笔标记开始的标准特征序列，与 seq_standardized 的结果相同
+    笔标记逐个追加，每个特征元素对应一个节点，节点指向包含处理之后的上一个元素，
+    因此以任意笔标记结束时的标准特征序列都可以直接查询，不需要重新计算
+    """
+
+    def __init__(self, first):
+        if first['fx_mark'] == 'd':
+            self.direction = "up"
+        elif first['fx_mark'] == 'g':
+            self.direction = "down"
+        else:
+            raise ValueError
+        self.dts = [first['dt']]        # 已处理的笔标记
+        self.values = [first['bi']]
+        self._nodes = []                # 第 k 个特征元素处理完后的 (最后一个元素, 上一个节点, 长度, 最低价, 最高价)
+
+    def append(self, point):
+        self.dts.append(point['dt'])
+        self.values.append(point['bi'])
+        n = len(self.dts)
+        if n < 3 or n % 2 == 0:
+            return
+
+        # 第 n-2、n-1 个笔标记构成一个特征元素
+        b1, b2 = self.values[-2:]
+        row = {"start_dt": self.dts[-2], "end_dt": self.dts[-1], "high": max(b1, b2), "low": min(b1, b2)}
+        last = len(self._nodes) - 1
+        if last >= 0:
+            last_row, parent = self._nodes[last][:2]
+            cur_h, cur_l = row['high'], row['low']
+            last_h, last_l = last_row['high'], last_row['low']
+            # 左包含 or 右包含
+            if (cur_h <= last_h and cur_l >= last_l) or (cur_h >= last_h and cur_l <= last_l):
+                if self.direction == "up":
+                    last_h = max(last_h, cur_h)
+                    last_l = max(last_l, cur_l)
+                else:
+                    last_h = min(last_h, cur_h)
+                    last_l = min(last_l, cur_l)
+                row = {"start_dt": last_row['start_dt'], "end_dt": row['end_dt'], "high": last_h, "low": last_l}
+                last = parent
+
+        if last >= 0:
+            _, _, size, low, high = self._nodes[last]
+            self._nodes.append((row, last, size + 1, min(low, row['low']), max(high, row['high'])))
+        else:
+            self._nodes.append((row, -1, 1, row['low'], row['high']))
+
+    def truncate(self, dt):
+        """删除时间不早于 dt 的笔标记，起点总是保留"""
+        n = max(bisect_left(self.dts, dt), 1)
+        del self.dts[n:]
+        del self.values[n:]
+        del self._nodes[(n - 1) // 2:]
+
+    def summary(self, n):
+        """前 n 个笔标记的标准特征序列的 (长度, 最低价, 最高价)"""
+        node = (n - 1) // 2 - 1
+        if node < 0:
+            return 0, None, None
+        return self._nodes[node][2:]
+
+    def to_list(self, n):
+        """前 n 个笔标记的标准特征序列"""
+        seq = []
+        node = (n - 1) // 2 - 1
+        while node >= 0:
+            row, node = self._nodes[node][:2]
+            seq.append(row)
+        return seq[::-1]
+
+
 def get_potential_xd(bi_points):
     """获取潜在线段标记点
     :param bi_points: list of dict
@@ -161,8 +427,69 @@ def get_potential_xd(bi_points):
     xd_p = sorted(xd_p, key=lambda x: x['dt'], reverse=False)
     return xd_p
 
+
+class _PublicSeq(Sequence):
+    """对外序列：内部序列的只读视图，读取时才把元素转换成时间为 pd.Timestamp 的副本。
+    不缓存转换结果，读取不修改分析器的任何状态，多个线程可以同时读取；每次读取得到新的副本，修改副本不影响分析器。
+    视图跟随内部序列变化，更新过程中读取可能读到更新到一半的序列，需要一致的结果时读取快照，见 KlineAnalyze.snapshot
+    """
+
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        self._items = items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __raw(self, i):
+        """内部元素；_ColumnRows 中还没有生成的元素直接从列中读取，不写入它的缓存"""
+        items = self._items
+        return items.peek(i) if isinstance(items, _ColumnRows) else items[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return _public_list(self.__raw(i))
+        return _to_public(self.__raw(i))
+
+    def __iter__(self):
+        return iter(_public_list(self.__raw(slice(None))))
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def _public_seq(name, doc):
+    """对外序列的属性：读取时返回 _PublicSeq；赋值时把时间字段转回 int64 纳秒时间戳，写入内部序列"""
+    def fget(self):
+        return _PublicSeq(getattr(self, '_' + name))
+
+    def fset(self, items):
+        setattr(self, '_' + name, [_to_internal(x) for x in items])
+        self._views.pop(name, None)
+
+    return property(fget, fset, doc=doc)
+
+
 class KlineAnalyze:
-    def __init__(self, symbol:str, freq:str, bi_mode="new", max_xd_len=20, zs_mode='xd', ma_params=(5, 34, 120), verbose=False):
+    # 对外提供的序列，是内部序列（self._kline_raw 等）的只读视图，元素是时间转成 pd.Timestamp 的副本，见 _PublicSeq；
+    # 可以整体赋值，比如 ka.bi_list = [...]，赋值的序列写回内部序列，快照在下一次更新完成后发布
+    kline_raw = _public_seq("kline_raw", "原始K线序列")
+    kline_new = _public_seq("kline_new", "去除包含关系的K线序列")
+    ma = _public_seq("ma", "均线")
+    macd = _public_seq("macd", "MACD")
+    fx_list = _public_seq("fx_list", "分型序列")
+    bi_list = _public_seq("bi_list", "笔标记序列")
+    xd_list = _public_seq("xd_list", "线段标记序列")
+    zs_list = _public_seq("zs_list", "中枢序列")
+
+    def __init__(self, symbol:str, freq:str, bi_mode="new", max_xd_len=20, zs_mode='xd', ma_params=(5, 34, 120), verbose=False,
+                 engine="python", min_gap=0.002, rec_levels=0):
         """
         :param symbol: str
         :param freq: str
@@ -176,7 +503,16 @@ class KlineAnalyze:
         :param ma_params: tuple of int
             均线系统参数
         :param verbose: bool
+        :param engine: str
+            reset_kline 整体计算时去除包含关系、分型、笔的实现方式：python 逐个字典计算；
+            array 使用数组内核，安装了 numba 时编译执行，结果与 python 一致。add_kline 的增量计算不受影响
+        :param min_gap: float
+            识别分型时判断相邻K线之间是否有缺口的阈值，见 has_gap
+        :param rec_levels: int
+            递归计算的高级别数量，见 rec_list
         """
+        if engine not in ("python", "array"):
+            raise ValueError("engine 可选值为 python / array")
         self.symbol = symbol
         self.freq = freq
         self.verbose = verbose
@@ -184,104 +520,207 @@ class KlineAnalyze:
         self.max_xd_len = max_xd_len
         self.zs_mode = zs_mode
         self.ma_params = ma_params
-        self.kline_raw = []  # 原始K线序列
-        self.kline_new = []  # 去除包含关系的K线序列
+        self.engine = engine
+        self.min_gap = min_gap
+        self.rec_levels = rec_levels
+        self._kline_raw = []  # 原始K线序列
+        self._kline_new = []  # 去除包含关系的K线序列
 
         # 辅助技术指标
-        self.ma = []
-        self.macd = []
+        self._ma = []
+        self._macd = []
 
         # 分型、笔、线段
-        self.fx_list = []
-        self.bi_list = []
-        self.xd_list = []
-        self.zs_list = []
+        self._fx_list = []
+        self._bi_list = []
+        self._xd_list = []
+        self._zs_list = []
         self.bs_list = []
+        self._bi_removed = None     # 最后一次被判定无效而移除的笔标记
+        self._last_unfinished = False   # 最后一根原始K线是否以 is_final=False 输入
+        self._feature_seqs = {}         # 笔标记 dt -> 从该笔标记开始的标准特征序列，见 _xd_after_process
+        self._views = {}                # 序列名称 -> (已转换的内部元素, 快照中的元素)，见 _view
+        self._snapshot = None           # 最近一次发布的只读快照，见 snapshot
 
         # 下一高分时级别，用于计算多级别聚合
         self.ka_list = []
 
-    def _update_ta(self):
-        """更新辅助技术指标"""
-        if not self.ma:
-            ma_temp = dict()
-            close_ = np.array([x["close"] for x in self.kline_raw], dtype=np.double)
-            for p in self.ma_params:
-                ma_temp['ma%i' % p] = ta.SMA(close_, p)
-
-            for i in range(len(self.kline_raw)):
-                ma_ = {'ma%i' % p: ma_temp['ma%i' % p][i] for p in self.ma_params}
-                ma_.update({"dt": self.kline_raw[i]['dt']})
-                self.ma.append(ma_)
-        else:
-            ma_ = {'ma%i' % p: sum([x['close'] for x in self.kline_raw[-p:]]) / p
-                   for p in self.ma_params}
-            ma_.update({"dt": self.kline_raw[-1]['dt']})
-            if self.verbose:
-                print("ma new: %s" % str(ma_))
-
-            if self.kline_raw[-2]['dt'] == self.ma[-1]['dt']:
-                self.ma.append(ma_)
+        # 递归的高级别：第 k 个的笔标记是上一级别（第 0 个的上一级别为本级别）的线段标记，
+        # 在此之上计算线段、中枢，随本级别的线段同步更新，不重新聚合K线，见 _update_rec
+        self.rec_list = self.__new_rec_list()
+
+        # 每次 reset_kline / add_kline 计算完成后依次调用 callback(self)，比如截面扫描器的更新
+        self.callbacks = []
+
+    def __getstate__(self):
+        # 对外序列、快照可以随时从内部序列重新生成，不序列化；
+        # 回调只在当前进程中有效（比如 SignalJournal 持有线程和队列），不序列化，恢复后为空
+        state = dict(self.__dict__)
+        state['_views'] = {}
+        state['callbacks'] = []
+        if state.get('_snapshot') is not None:
+            state['_snapshot'] = state['_snapshot'].version
+        return state
+
+    def __setstate__(self, state):
+        # 恢复之后按原来的版本号重新发布快照
+        version = state.pop('_snapshot', None)
+        self.__dict__.update(state)
+        self._snapshot = None
+        if version is not None:
+            self._publish(version)
+
+    @property
+    def snapshot(self):
+        """最近一次 reset_kline / add_kline 等更新完成后发布的只读快照，见 czsc.snapshot.Snapshot，还没有计算时为 None
+        更新在一个线程中进行时，其他线程应该读取快照，而不是 bi_list 等对外序列：快照在更新完成后整体替换，
+        读取不需要加锁，同一个快照中的各序列总是同一次更新的结果；对外序列是内部序列的视图，在更新过程中会被截断、重建
+        """
+        return self._snapshot
+
+    def _publish(self, version=None):
+        """发布新版本的快照，各序列与上一版本共享没有变化的部分"""
+        if version is None:
+            # 递归的高级别随本级别更新，恢复时各自按原来的版本号重新发布
+            for ka in self.rec_list:
+                ka.end_dt, ka.latest_price = self.end_dt, self.latest_price
+                ka._publish()
+        prev = self._snapshot
+        seqs = {name: (getattr(prev, name) if prev else _empty_seq).evolve(self._view(name))
+                for name in ('fx_list', 'bi_list', 'xd_list', 'zs_list')}
+        if version is None:
+            version = prev.version + 1 if prev else 1
+        self._snapshot = Snapshot(version=version, symbol=self.symbol, freq=self.freq, end_dt=self.end_dt,
+                                  latest_price=self.latest_price, ka_list=tuple(ka.snapshot for ka in self.ka_list),
+                                  rec_list=tuple(ka.snapshot for ka in self.rec_list), **seqs)
+
+    def _view(self, name):
+        """发布快照时内部序列对应的对外元素，只在 _publish 中调用
+        内部序列只在尾部变化，或者从头部截断、整体重建，变化的元素都是新对象；
+        按对象是否相同找到上次转换之后没有变化的部分，只转换变化的尾部。中间的元素被替换时见 _drop_view
+        """
+        items = getattr(self, '_' + name)
+        src, out = self._views.setdefault(name, ([], []))
+        if src and items and src[0] is not items[0]:
+            first = items[0]
+            n = next((i for i, x in enumerate(src) if x is first), len(src))
+            del src[:n], out[:n]
+        n = min(len(src), len(items))
+        while n > 0 and src[n - 1] is not items[n - 1]:
+            n -= 1
+        del src[n:], out[n:]
+        src.extend(items[n:])
+        out.extend(_public_list(items[n:]))
+        return out
+
+    def _drop_view(self, name, dt):
+        """内部序列中 dt 及之后的元素被替换、而之后的元素可能没有变化时调用，丢弃已转换的对外元素，
+        _view 只从尾部按对象是否相同比较，发现不了中间的变化"""
+        src, out = self._views.get(name, ([], []))
+        n = _bisect_dt(src, dt)
+        del src[n:], out[n:]
+
+    def _update_ta(self, start=None, stop=None, indicators=None):
+        """更新辅助技术指标
+        :param start: int
+            从这个位置开始的原始K线是新增或替换的，默认只有最后一根；指标为空时整体计算
+        :param stop: int
+            只有 [start, stop) 的原始K线变化，默认到最后。之后的K线只需重新计算窗口内包含变化K线的部分，
+            其余的指标按时间保留
+        :param indicators: dict of np.array
+            整体计算时预先算好的指标，见 reset_kline
+        """
+        n = len(self._kline_raw)
+        start = n - 1 if start is None else start
+        # 一根K线的变化最多影响之后窗口长度内的指标
+        window = max(max(self.ma_params, default=0), _macd_window)
+        end = n if stop is None else min(stop + window - 1, n)
+        keep = _bisect_dt(self._ma, self._kline_raw[end - 1]['dt'], right=True)
+        if not self._ma or not self._macd:
+            # 整体计算，结果按列存放，见 _ColumnRows；增量更新时再转成普通列表
+            dts = _tail_column(self._kline_raw, 'dt', np.int64)
+            if indicators is None:
+                indicators = _engine.indicators(_tail_column(self._kline_raw, 'close', np.double),
+                                                ma_params=self.ma_params)
             else:
-                self.ma[-1] = ma_
-
-        assert self.ma[-2]['dt'] == self.kline_raw[-2]['dt']
-
-        if not self.macd:
-            close_ = np.array([x["close"] for x in self.kline_raw], dtype=np.double)
-            # m1 is diff; m2 is dea; m3 is macd
-            m1, m2, m3 = ta.MACD(close_, fastperiod=12, slowperiod=26, signalperiod=9)
-            for i in range(len(self.kline_raw)):
-                self.macd.append({
-                    "dt": self.kline_raw[i]['dt'],
-                    "diff": m1[i],
-                    "dea": m2[i],
-                    "macd": m3[i]
-                })
+                # 可能是共享内存的视图（见 BarStore.ta_view），复制一份，不依赖K线库的生命周期
+                indicators = {k: np.array(v, dtype=np.double) for k, v in indicators.items()}
+        if not self._ma:
+            keys = ['ma%i' % p for p in self.ma_params]
+            self._ma = _ColumnRows(keys + ['dt'], [indicators[k] for k in keys] + [dts])
         else:
-            close_ = np.array([x["close"] for x in self.kline_raw[-200:]], dtype=np.double)
-            # m1 is diff; m2 is dea; m3 is macd
-            m1, m2, m3 = ta.MACD(close_, fastperiod=12, slowperiod=26, signalperiod=9)
-            macd_ = {
-                "dt": self.kline_raw[-1]['dt'],
-                "diff": m1[-1],
-                "dea": m2[-1],
-                "macd": m3[-1]
-            }
-            if self.verbose:
-                print("macd new: %s" % str(macd_))
-
-            if self.kline_raw[-2]['dt'] == self.macd[-1]['dt']:
-                self.macd.append(macd_)
-            else:
-                self.macd[-1] = macd_
-
-        assert self.macd[-2]['dt'] == self.kline_raw[-2]['dt']
-
-    def _update_kline_new(self):
-        """更新去除包含关系的K线序列"""
-        if len(self.kline_new) < 4:
-            for x in self.kline_raw[:4]:
-                self.kline_new.append(dict(x))
-
-        # 新K线只会对最后一个去除包含关系K线的结果产生影响
-        self.kline_new = self.kline_new[:-2]
+            if not isinstance(self._ma, list):
+                self._ma = list(self._ma)
+            # 指标与原始K线一一对应，每根K线按截至该K线的窗口计算，与逐根输入的结果相同
+            rows = []
+            for i in range(start, end):
+                ma_ = {'ma%i' % p: sum([x['close'] for x in self._kline_raw[max(i - p + 1, 0): i + 1]]) / p
+                       for p in self.ma_params}
+                ma_.update({"dt": self._kline_raw[i]['dt']})
+                if self.verbose:
+                    print("ma new: %s" % str(ma_))
+                rows.append(ma_)
+            self._ma[start: keep] = rows
 
-        if len(self.kline_new) == 0:
-            return
+        assert self._ma[-2]['dt'] == self._kline_raw[-2]['dt']
 
-        if len(self.kline_new) <= 4:
-            right_k = [x for x in self.kline_raw if x['dt'] > self.kline_new[-1]['dt']]
+        if not self._macd:
+            keys = ["diff", "dea", "macd"]
+            self._macd = _ColumnRows(["dt"] + keys, [dts] + [indicators[k] for k in keys])
         else:
-            right_k = [x for x in self.kline_raw[-100:] if x['dt'] > self.kline_new[-1]['dt']]
-
-        if len(right_k) == 0:
-            return
+            if not isinstance(self._macd, list):
+                self._macd = list(self._macd)
+            rows = []
+            for i in range(start, end):
+                close_ = np.array([x["close"] for x in self._kline_raw[max(i - _macd_window + 1, 0): i + 1]],
+                                  dtype=np.double)
+                # m1 is diff; m2 is dea; m3 is macd
+                m1, m2, m3 = ta.MACD(close_, fastperiod=12, slowperiod=26, signalperiod=9)
+                macd_ = {
+                    "dt": self._kline_raw[i]['dt'],
+                    "diff": m1[-1],
+                    "dea": m2[-1],
+                    "macd": m3[-1]
+                }
+                if self.verbose:
+                    print("macd new: %s" % str(macd_))
+                rows.append(macd_)
+            self._macd[start: keep] = rows
+
+        assert self._macd[-2]['dt'] == self._kline_raw[-2]['dt']
+
+    def _update_kline_new(self, replaced=False, dirty_dt=None):
+        """更新去除包含关系的K线序列
+        :param replaced: bool
+            最后一根原始K线是否替换了原来的最后一根（未完成K线的更新）
+        :param dirty_dt: 补入或更正的历史原始K线中最早的时间
+        :return: 时间、最高价、最低价发生变化的最早时间，没有变化时返回 None
+        """
+        # 去除包含关系是对原始K线的顺序合并，新增的原始K线最多影响最后一根K线；
+        # 替换时回退包含最后一根原始K线的那根K线重新合并，历史K线变化时回退包含 dirty_dt 的那根K线。
+        # 之前的K线都是合并过程的中间结果，从那里重新合并与整体计算的结果相同
+        if dirty_dt is not None:
+            cut = _bisect_dt(self._kline_new, dirty_dt)
+        else:
+            cut = len(self._kline_new) - 1 if replaced else len(self._kline_new)
+        # 保留的最后一根K线可能与之后的原始K线合并，也参与比较
+        cmp_from = max(cut - 1, 0)
+        old_tail = self._kline_new[cmp_from:]
+        del self._kline_new[cut:]
+
+        if self._kline_new:
+            right_k = self._kline_raw[_bisect_dt(self._kline_raw, self._kline_new[-1]['dt'], right=True):]
+        else:
+            right_k = self._kline_raw
 
         for k in right_k:
             k = dict(k)
-            last_kn = self.kline_new[-1]
-            if self.kline_new[-1]['high'] > self.kline_new[-2]['high']:
+            if len(self._kline_new) < 2:
+                self._kline_new.append(k)
+                continue
+
+            last_kn = self._kline_new[-1]
+            if self._kline_new[-1]['high'] > self._kline_new[-2]['high']:
                 direction = "up"
             else:
                 direction = "down"
@@ -290,7 +729,7 @@ class KlineAnalyze:
             cur_h, cur_l = k['high'], k['low']
             last_h, last_l = last_kn['high'], last_kn['low']
             if (cur_h <= last_h and cur_l >= last_l) or (cur_h >= last_h and cur_l <= last_l):
-                self.kline_new.pop(-1)
+                self._kline_new.pop(-1)
                 # 有包含关系，按方向分别处理
                 if direction == "up":
                     last_h = max(last_h, cur_h)
@@ -307,27 +746,31 @@ class KlineAnalyze:
                     k.update({"open": last_h, "close": last_l})
                 else:
                     k.update({"open": last_l, "close": last_h})
-            self.kline_new.append(k)
+            self._kline_new.append(k)
 
-    def _update_fx_list(self):
-        """更新分型序列"""
-        if len(self.kline_new) < 3:
-            return
+        return _first_diff(old_tail, self._kline_new[cmp_from:], keys=('dt', 'high', 'low'))
 
-        self.fx_list = self.fx_list[:-1]
-        if len(self.fx_list) == 0:
-            kn = self.kline_new
-        else:
-            kn = [x for x in self.kline_new[-100:] if x['dt'] >= self.fx_list[-1]['dt']]
+    def _update_fx_list(self, dirty_dt):
+        """更新分型序列
+        :param dirty_dt: 去除包含关系的K线发生变化的最早时间，None 表示没有变化
+        :return: 分型序列发生变化的最早时间，没有变化时返回 None
+        """
+        if dirty_dt is None or len(self._kline_new) < 3:
+            return None
 
-        i = 1
-        while i <= len(kn) - 2:
-            k1, k2, k3 = kn[i - 1: i + 2]
+        # 中心位置为 i 的分型由 i-1, i, i+1 三根K线决定，从第一根变化的K线的前一根开始重新识别
+        start = max(_bisect_dt(self._kline_new, dirty_dt) - 1, 1)
+        cut = _bisect_dt(self._fx_list, self._kline_new[start]['dt'])
+        old_tail = self._fx_list[cut:]
+        del self._fx_list[cut:]
+
+        for i in range(start, len(self._kline_new) - 1):
+            k1, k2, k3 = self._kline_new[i - 1: i + 2]
             fx_elements = [k1, k2, k3]
-            if has_gap(k1, k2):
+            if has_gap(k1, k2, self.min_gap):
                 fx_elements.pop(0)
 
-            if has_gap(k2, k3):
+            if has_gap(k2, k3, self.min_gap):
                 fx_elements.pop(-1)
 
             if k1['high'] < k2['high'] > k3['high']:
@@ -342,7 +785,7 @@ class KlineAnalyze:
                     "fx_high": k2['high'],
                     "fx_low": min([x['low'] for x in fx_elements]),
                 }
-                self.fx_list.append(fx)
+                self._fx_list.append(fx)
 
             elif k1['low'] > k2['low'] < k3['low']:
                 if self.verbose:
@@ -356,171 +799,277 @@ class KlineAnalyze:
                     "fx_high": max([x['high'] for x in fx_elements]),
                     "fx_low": k2['low'],
                 }
-                self.fx_list.append(fx)
+                self._fx_list.append(fx)
 
             else:
                 if self.verbose:
                     print("无分型：{} - {} - {}".format(k1['dt'], k2['dt'], k3['dt']))
-            i += 1
 
-    def _update_bi_list(self):
-        """更新笔序列"""
-        if len(self.fx_list) < 2:
-            return
+        return _first_diff(old_tail, self._fx_list[cut:])
 
-        self.bi_list = self.bi_list[:-2] 
-        if len(self.bi_list) == 0:
-            for fx in self.fx_list[:1]:
-                bi = dict(fx)
-                bi['bi'] = bi.pop('fx')
-                self.bi_list.append(bi)      
-
-        if len(self.bi_list) <= 1:
-            right_fx = [x for x in self.fx_list if x['dt'] > self.bi_list[-1]['dt']]
-            if self.bi_mode == "old":
-                right_kn = [x for x in self.kline_new if x['dt'] >= self.bi_list[-1]['dt']]
-            elif self.bi_mode == 'new':
-                right_kn = [x for x in self.kline_raw if x['dt'] >= self.bi_list[-1]['dt']]
-            else:
-                raise ValueError
-        else:
-            right_fx = [x for x in self.fx_list[-50:] if x['dt'] > self.bi_list[-1]['dt']]
-            if self.bi_mode == "old":
-                right_kn = [x for x in self.kline_new[-300:] if x['dt'] >= self.bi_list[-1]['dt']]
-            elif self.bi_mode == 'new':
-                right_kn = [x for x in self.kline_raw[-300:] if x['dt'] >= self.bi_list[-1]['dt']]
-            else:
-                raise ValueError
+    def _update_bi_list(self, dirty_dt, kn_dirty_dt=None):
+        """更新笔序列
+        :param dirty_dt: 分型序列发生变化的最早时间，None 表示没有变化
+        :param kn_dirty_dt: 去除包含关系的K线发生变化的最早时间，用于重新检查最后一个笔标记
+        :return: (dirty_dt, moved_dt)
+            笔序列发生变化的最早时间，以及其中笔标记的位置（dt、fx_mark、bi）发生变化的最早时间，没有变化时为 None
+        """
+        if (dirty_dt is None and kn_dirty_dt is None) or len(self._fx_list) < 2:
+            return None, None
 
-        for fx in right_fx:
-            last_bi = self.bi_list[-1]
-            bi = dict(fx)
-            bi['bi'] = bi.pop('fx')
-            if last_bi['fx_mark'] == fx['fx_mark']:
-                if (last_bi['fx_mark'] == 'g' and last_bi['bi'] < bi['bi']) \
-                        or (last_bi['fx_mark'] == 'd' and last_bi['bi'] > bi['bi']):
-                    if self.verbose:
-                        print("笔标记移动：from {} to {}".format(self.bi_list[-1], bi))
-                    self.bi_list[-1] = bi
-            else:
-                kn_inside = [x for x in right_kn if last_bi['end_dt'] < x['dt'] < bi['start_dt']]
-                if len(kn_inside) <= 0:
-                    continue
+        if self.bi_mode == "old":
+            kn = self._kline_new
+        elif self.bi_mode == 'new':
+            kn = self._kline_raw
+        else:
+            raise ValueError
 
-                # 确保相邻两个顶底之间不存在包含关系
-                if (last_bi['fx_mark'] == 'g' and bi['fx_low'] < last_bi['fx_low']
-                    and bi['fx_high'] < last_bi['fx_high']) or \
-                        (last_bi['fx_mark'] == 'd' and bi['fx_high'] > last_bi['fx_high']
-                         and bi['fx_low'] > last_bi['fx_low']):
-                    if self.verbose:
-                        print("新增笔标记：{}".format(bi))
-                    self.bi_list.append(bi)
+        # 笔序列是对分型序列的顺序处理，保留变化之前的部分，从最后一个保留的笔标记之后重新处理；
+        # 分型没有变化时只重新检查最后一个笔标记。保留的最后一个笔标记总是参与比较，
+        # 它可能被之后同向的分型替换，也可能在最后被判定无效
+        cut = len(self._bi_list) if dirty_dt is None else _bisect_dt(self._bi_list, dirty_dt)
+        cmp_from = max(cut - 1, 0)
+        old_tail = self._bi_list[cmp_from:]
+
+        # 上次被判定无效而移除的最后一个笔标记，先放回再重新判断
+        if self._bi_removed:
+            self._bi_list.append(self._bi_removed)
+            self._bi_removed = None
+
+        if dirty_dt is not None:
+            del self._bi_list[cut:]
+            if len(self._bi_list) == 0:
+                bi = dict(self._fx_list[0])
+                bi['bi'] = bi.pop('fx')
+                self._bi_list.append(bi)
 
-        if (self.bi_list[-1]['fx_mark'] == 'd' and self.kline_new[-1]['low'] < self.bi_list[-1]['bi']) \
-                or (self.bi_list[-1]['fx_mark'] == 'g' and self.kline_new[-1]['high'] > self.bi_list[-1]['bi']):
+            right_fx = self._fx_list[_bisect_dt(self._fx_list, self._bi_list[-1]['dt'], right=True):]
+            for fx in right_fx:
+                last_bi = self._bi_list[-1]
+                bi = dict(fx)
+                bi['bi'] = bi.pop('fx')
+                if last_bi['fx_mark'] == fx['fx_mark']:
+                    if (last_bi['fx_mark'] == 'g' and last_bi['bi'] < bi['bi']) \
+                            or (last_bi['fx_mark'] == 'd' and last_bi['bi'] > bi['bi']):
+                        if self.verbose:
+                            print("笔标记移动：from {} to {}".format(self._bi_list[-1], bi))
+                        self._bi_list[-1] = bi
+                else:
+                    # 两个分型之间至少有一根K线
+                    i = _bisect_dt(kn, last_bi['end_dt'], right=True)
+                    if i >= len(kn) or kn[i]['dt'] >= bi['start_dt']:
+                        continue
+
+                    # 确保相邻两个顶底之间不存在包含关系
+                    if (last_bi['fx_mark'] == 'g' and bi['fx_low'] < last_bi['fx_low']
+                        and bi['fx_high'] < last_bi['fx_high']) or \
+                            (last_bi['fx_mark'] == 'd' and bi['fx_high'] > last_bi['fx_high']
+                             and bi['fx_low'] > last_bi['fx_low']):
+                        if self.verbose:
+                            print("新增笔标记：{}".format(bi))
+                        self._bi_list.append(bi)
+
+        if (self._bi_list[-1]['fx_mark'] == 'd' and self._kline_new[-1]['low'] < self._bi_list[-1]['bi']) \
+                or (self._bi_list[-1]['fx_mark'] == 'g' and self._kline_new[-1]['high'] > self._bi_list[-1]['bi']):
             if self.verbose:
-                print("最后一个笔标记无效，{}".format(self.bi_list[-1]))
-            self.bi_list.pop(-1)
+                print("最后一个笔标记无效，{}".format(self._bi_list[-1]))
+            self._bi_removed = self._bi_list.pop(-1)
+
+        new_tail = self._bi_list[cmp_from:]
+        return _first_diff(old_tail, new_tail, keys=_bi_keys), _first_diff(old_tail, new_tail, keys=_bi_keys[:3])
 
     def _update_xd_list_v1(self):
         """更新线段序列"""
-        if len(self.bi_list) < 4:
+        if len(self._bi_list) < 4:
             return
 
-        self.xd_list = []
-        if len(self.xd_list) == 0:
+        self._xd_list = []
+        if len(self._xd_list) == 0:
             for i in range(3):
-                xd = dict(self.bi_list[i])
+                xd = dict(self._bi_list[i])
                 xd['xd'] = xd.pop('bi')
-                self.xd_list.append(xd)
+                self._xd_list.append(xd)
 
-        right_bi = [x for x in self.bi_list if x['dt'] >= self.xd_list[-1]['dt']]
+        right_bi = self._bi_list[_bisect_dt(self._bi_list, self._xd_list[-1]['dt']):]
+        # 线段标记都取自笔标记，按时间直接查位置
+        bi_index = {x['dt']: i for i, x in enumerate(self._bi_list)}
 
         xd_p = get_potential_xd(right_bi)
         for xp in xd_p:
             xd = dict(xp)
             xd['xd'] = xd.pop('bi')
-            last_xd = self.xd_list[-1]
+            last_xd = self._xd_list[-1]
             if last_xd['fx_mark'] == xd['fx_mark']:
                 if (last_xd['fx_mark'] == 'd' and last_xd['xd'] > xd['xd']) \
                         or (last_xd['fx_mark'] == 'g' and last_xd['xd'] < xd['xd']):
                     if self.verbose:
                         print("更新线段标记：from {} to {}".format(last_xd, xd))
-                    self.xd_list[-1] = xd
+                    self._xd_list[-1] = xd
             else:
                 if (last_xd['fx_mark'] == 'd' and last_xd['xd'] > xd['xd']) \
                         or (last_xd['fx_mark'] == 'g' and last_xd['xd'] < xd['xd']):
                     continue
 
-                bi_inside = [x for x in right_bi if last_xd['dt'] <= x['dt'] <= xd['dt']]
-                if len(bi_inside) < 4:
+                bi_inside = bi_index[xd['dt']] - bi_index[last_xd['dt']] + 1
+                if bi_inside < 4:
                     if self.verbose:
                         print("{} - {} 之间笔标记数量少于4，跳过".format(last_xd['dt'], xd['dt']))
                     continue
                 else:
-                    self.xd_list.append(xd)
+                    self._xd_list.append(xd)
 
     def _xd_after_process(self):
         """线段标记后处理，使用标准特征序列判断线段标记是否成立"""
-        if not len(self.xd_list) > 4:
+        if not len(self._xd_list) > 4:
             return
 
+        # 线段标记一般都是笔标记，按时间直接查位置，查不到时二分定位
+        bi_index = {x['dt']: i for i, x in enumerate(self._bi_list)}
+
+        def __bi_range(start_dt, end_dt=None):
+            """start_dt 与 end_dt 之间（含两端）的笔标记在 bi_list 中的位置 [i, j)"""
+            i = bi_index.get(start_dt)
+            if i is None:
+                i = _bisect_dt(self._bi_list, start_dt)
+            if end_dt is None:
+                j = len(self._bi_list)
+            elif end_dt in bi_index:
+                j = bi_index[end_dt] + 1
+            else:
+                j = _bisect_dt(self._bi_list, end_dt, right=True)
+            return i, j
+
+        used = {}
+
+        def __feature_seq(i, j):
+            """以 bi_list[i] 开始、至少处理到 bi_list[j - 1] 的标准特征序列，按起点缓存"""
+            start_dt = self._bi_list[i]['dt']
+            fs = self._feature_seqs.get(start_dt)
+            if fs is None:
+                fs = _FeatureSeq(self._bi_list[i])
+            for point in self._bi_list[i + len(fs.dts): j]:
+                fs.append(point)
+            used[start_dt] = fs
+            return fs
+
+        def __is_valid_xd(r1, r2, r3):
+            """等价于 is_valid_xd(bi_list[r1], bi_list[r2], bi_list[r3])，特征序列从缓存中查询"""
+            (i1, j1), (i2, j2), (_, j3) = r1, r2, r3
+            seq1 = __feature_seq(i1, j1).summary(j1 - i1)
+            fs2 = __feature_seq(i2, j3)
+            return _check_xd(seq1, self._bi_list[i2: j2], lambda: fs2.to_list(j3 - i2))
+
         keep_xd_index = []
-        for i in range(1, len(self.xd_list) - 2):
-            xd1, xd2, xd3, xd4 = self.xd_list[i - 1: i + 3]
-            bi_seq1 = [x for x in self.bi_list if xd2['dt'] >= x['dt'] >= xd1['dt']]
-            bi_seq2 = [x for x in self.bi_list if xd3['dt'] >= x['dt'] >= xd2['dt']]
-            bi_seq3 = [x for x in self.bi_list if xd4['dt'] >= x['dt'] >= xd3['dt']]
-            if len(bi_seq1) == 0 or len(bi_seq2) == 0 or len(bi_seq3) == 0:
+        for i in range(1, len(self._xd_list) - 2):
+            xd1, xd2, xd3, xd4 = self._xd_list[i - 1: i + 3]
+            r1 = __bi_range(xd1['dt'], xd2['dt'])
+            r2 = __bi_range(xd2['dt'], xd3['dt'])
+            r3 = __bi_range(xd3['dt'], xd4['dt'])
+            if r1[0] == r1[1] or r2[0] == r2[1] or r3[0] == r3[1]:
                 continue
 
-            if is_valid_xd(bi_seq1, bi_seq2, bi_seq3):
+            if __is_valid_xd(r1, r2, r3):
                 keep_xd_index.append(i)
 
         # 处理最近一个确定的线段标记
-        bi_seq1 = [x for x in self.bi_list if self.xd_list[-2]['dt'] >= x['dt'] >= self.xd_list[-3]['dt']]
-        bi_seq2 = [x for x in self.bi_list if self.xd_list[-1]['dt'] >= x['dt'] >= self.xd_list[-2]['dt']]
-        bi_seq3 = [x for x in self.bi_list if x['dt'] >= self.xd_list[-1]['dt']]
-        if not (len(bi_seq1) == 0 or len(bi_seq2) == 0 or len(bi_seq3) == 0):
-            if is_valid_xd(bi_seq1, bi_seq2, bi_seq3):
-                keep_xd_index.append(len(self.xd_list) - 2)
+        r1 = __bi_range(self._xd_list[-3]['dt'], self._xd_list[-2]['dt'])
+        r2 = __bi_range(self._xd_list[-2]['dt'], self._xd_list[-1]['dt'])
+        r3 = __bi_range(self._xd_list[-1]['dt'])
+        if not (r1[0] == r1[1] or r2[0] == r2[1] or r3[0] == r3[1]):
+            if __is_valid_xd(r1, r2, r3):
+                keep_xd_index.append(len(self._xd_list) - 2)
 
         # 处理最近一个未确定的线段标记
-        if len(bi_seq3) >= 4:
-            keep_xd_index.append(len(self.xd_list) - 1)
+        if r3[1] - r3[0] >= 4:
+            keep_xd_index.append(len(self._xd_list) - 1)
+
+        # 只保留本次用到的特征序列
+        self._feature_seqs = used
 
         new_xd_list = []
         for j in keep_xd_index:
             if not new_xd_list:
-                new_xd_list.append(self.xd_list[j])
+                new_xd_list.append(self._xd_list[j])
             else:
-                if new_xd_list[-1]['fx_mark'] == self.xd_list[j]['fx_mark']:
-                    if (new_xd_list[-1]['fx_mark'] == 'd' and new_xd_list[-1]['xd'] > self.xd_list[j]['xd']) \
-                            or (new_xd_list[-1]['fx_mark'] == 'g' and new_xd_list[-1]['xd'] < self.xd_list[j]['xd']):
-                        new_xd_list[-1] = self.xd_list[j]
+                if new_xd_list[-1]['fx_mark'] == self._xd_list[j]['fx_mark']:
+                    if (new_xd_list[-1]['fx_mark'] == 'd' and new_xd_list[-1]['xd'] > self._xd_list[j]['xd']) \
+                            or (new_xd_list[-1]['fx_mark'] == 'g' and new_xd_list[-1]['xd'] < self._xd_list[j]['xd']):
+                        new_xd_list[-1] = self._xd_list[j]
                 else:
-                    new_xd_list.append(self.xd_list[j])
-        self.xd_list = new_xd_list
+                    new_xd_list.append(self._xd_list[j])
+        self._xd_list = new_xd_list
 
         # 针对最近一个线段标记处理
-        if self.xd_list:
-            if (self.xd_list[-1]['fx_mark'] == 'd' and self.bi_list[-1]['bi'] < self.xd_list[-1]['xd']) \
-                    or (self.xd_list[-1]['fx_mark'] == 'g' and self.bi_list[-1]['bi'] > self.xd_list[-1]['xd']):
-                self.xd_list.pop(-1)
-
-    def _update_xd_list(self):
+        if self._xd_list:
+            if (self._xd_list[-1]['fx_mark'] == 'd' and self._bi_list[-1]['bi'] < self._xd_list[-1]['xd']) \
+                    or (self._xd_list[-1]['fx_mark'] == 'g' and self._bi_list[-1]['bi'] > self._xd_list[-1]['xd']):
+                self._xd_list.pop(-1)
+
+    def _update_xd_list(self, dirty_dt, moved_dt):
+        """更新线段序列
+        :param dirty_dt: 笔序列发生变化的最早时间，None 表示没有变化
+        :param moved_dt: 笔标记的位置发生变化的最早时间，见 _update_bi_list；
+            为 None 时线段标记不变，只需把对应的线段标记换成新的笔标记副本
+        :return: 线段序列发生变化的最早时间，没有变化时返回 None
+        """
+        if dirty_dt is None:
+            return None
+        if moved_dt is None:
+            return self.__refresh_xd(dirty_dt)
+        # 缓存的特征序列从 dirty_dt 之前最后一个保留的线段标记开始截断，该标记之后的笔标记都重新处理，
+        # 不依赖 dirty_dt 恰好落在第一个变化的笔标记上
+        i = _bisect_dt(self._xd_list, dirty_dt)
+        if i == 0:
+            self._feature_seqs = {}
+        else:
+            cut_dt = self._xd_list[i - 1]['dt']
+            for start_dt, fs in list(self._feature_seqs.items()):
+                if start_dt >= cut_dt:
+                    del self._feature_seqs[start_dt]
+                elif fs.dts[-1] >= cut_dt:
+                    fs.truncate(cut_dt)
+        old_xd_list = self._xd_list
         self._update_xd_list_v1()
         self._xd_after_process()
-    
-    def _update_zs_list(self):
-        points = self.xd_list if self.zs_mode=='xd' else self.bi_list
-        if len(points) < 3:
-            return []
-        # 当输入为笔的标记点时，新增 xd 值
+        _keep_unchanged(old_xd_list, self._xd_list)
+        return _first_diff(old_xd_list, self._xd_list, keys=_xd_keys)
+
+    def __refresh_xd(self, dirty_dt):
+        """笔标记只有 end_dt、fx_high 等字段变化时，用新的笔标记替换 dirty_dt 之后的线段标记
+        :return: 第一个被替换的线段标记的时间，没有替换时返回 None
+        """
+        first_dt = None
+        for i in range(_bisect_dt(self._xd_list, dirty_dt), len(self._xd_list)):
+            j = _bisect_dt(self._bi_list, self._xd_list[i]['dt'])
+            if j == len(self._bi_list) or self._bi_list[j]['dt'] != self._xd_list[i]['dt']:
+                continue
+            xd = dict(self._bi_list[j])
+            xd['xd'] = xd.pop('bi')
+            if xd != self._xd_list[i]:
+                self._xd_list[i] = xd
+                first_dt = xd['dt'] if first_dt is None else first_dt
+        if first_dt is not None:
+            self._drop_view('xd_list', first_dt)
+        return first_dt
+
+    def _update_zs_list(self, dirty_dt):
+        """更新中枢序列
+        :param dirty_dt: 中枢所用的线段（或笔）序列发生变化的最早时间，None 表示没有变化
+        """
+        points = self._xd_list if self.zs_mode=='xd' else self._bi_list
+        # 当输入为笔的标记点时，新增 xd 值；重新计算的笔标记都在尾部。替换为新对象，见 _view
         if self.zs_mode=='bi':
-            for j, x in enumerate(points):
-                if x.get("bi", 0):
-                    points[j]['xd'] = x["bi"]
+            for i in range(len(points) - 1, -1, -1):
+                if 'xd' in points[i]:
+                    break
+                if points[i].get("bi", 0):
+                    points[i] = dict(points[i], xd=points[i]["bi"])
+
+        if dirty_dt is None:
+            return
+        old_zs_list, self._zs_list = self._zs_list, []
+        if len(points) < 3:
+            return
         
         def __get_zn(zn_points_):
             """把与中枢方向一致的次级别走势类型称为Z走势段，按中枢中的时间顺序，
@@ -563,77 +1112,142 @@ class KlineAnalyze:
                 "zs_finished": finished
             }
         
-        def __get_zg_zd(zs_xd_):
-            _zs_d_ = max([x['xd'] for x in zs_xd_[:4] if x['fx_mark'] == 'd'])
-            _zs_g_ = min([x['xd'] for x in zs_xd_[:4] if x['fx_mark'] == 'g'])
-            return _zs_d_, _zs_g_
-        
-        def __print_zs(zs_xd_):
-            print("当前线段：{}".format([ x['dt'] for x in zs_xd_ ]))
-        k_xd = points
-        zs_xd = []
-        zs_extend=False
-        zs_finished=False
-        # print("线段列表：{}".format(self.xd_list))
-        for i in range(len(k_xd)):
-            xd_p = k_xd[i]
-            if len(zs_xd) < 4:          # 排除趋势段
-                zs_xd.append(xd_p)
-                continue
-            
-            # __print_zs(zs_xd)
+        # 连续4个标记点构成3段，以每个标记点开始的3段的重叠区间 [ZD, ZG] 一次算出；标记点顶底交替，
+        # 重叠区间的下沿、上沿就是其中底的最大值、顶的最小值。重叠部分的长度大于 0 时构成中枢
+        values = np.array([x['xd'] for x in points], dtype=np.double)
+        is_d = np.array([x['fx_mark'] == 'd' for x in points])
+        seg_low, seg_high = np.minimum(values[:-1], values[1:]), np.maximum(values[:-1], values[1:])
+        low2, high2 = np.maximum(seg_low[:-2], seg_low[1:-1]), np.minimum(seg_high[:-2], seg_high[1:-1])
+        zs_start = np.flatnonzero(is_overlap_array(low2, high2, seg_low[2:], seg_high[2:], closed=False))
+        zs_d_all, zs_g_all = np.maximum(low2, seg_low[2:]), np.minimum(high2, seg_high[2:])
+
+        # 底只要不高于 ZG、顶只要不低于 ZD 就仍属于中枢：底的范围为 [-inf, ZG]，顶的范围为 [ZD, inf]
+        lower = np.where(is_d, -np.inf, 0.0)
+        upper = np.where(is_d, 0.0, np.inf)
+
+        def __inside(index, zs_d_, zs_g_):
+            return is_in_range_array(lower[index] + zs_d_, upper[index] + zs_g_, values[index], tolerance=False)
+
+        # 中枢延伸通常很短，对所有可能的中枢一次检查之后的 window 个标记点，得到第一个离开中枢的位置：
+        # 底高于 ZG（三买）或顶低于 ZD（三卖）；标记点用完时为标记点数量，window 个标记点都没有离开时为 -1
+        window = 8
+        index = zs_start[:, None] + 4 + np.arange(window)
+        inside = __inside(np.minimum(index, len(points) - 1), zs_d_all[zs_start, None], zs_g_all[zs_start, None])
+        inside |= index >= len(points)
+        leave = np.where(inside.all(axis=1), np.where(index[:, -1] >= len(points), len(points), -1),
+                         index[:, 0] + np.argmin(inside, axis=1)).tolist()
+        zs_d_all, zs_g_all = zs_d_all.tolist(), zs_g_all.tolist()
+
+        def __leave(i, zs_d_, zs_g_):
+            """从第 i 个标记点开始，分块查找第一个离开中枢的位置，块的长度逐步增加"""
+            size = window * 4
+            while i < len(points):
+                stop = min(i + size, len(points))
+                inside_ = __inside(slice(i, stop), zs_d_, zs_g_)
+                if not inside_.all():
+                    return i + int(np.argmin(inside_))
+                i, size = stop, size * 4
+            return len(points)
+
+        s = 0
+        while True:
+            # 3段无重叠时后移
+            k = np.searchsorted(zs_start, s)
+            nxt = int(zs_start[k]) if k < len(zs_start) else len(points) - 4
+            if self.verbose:
+                for t in range(s + 1, nxt + 1):
+                    print("无中枢：{} - {} - {}".format(points[t]['dt'], points[t + 1]['dt'], points[t + 2]['dt']))
+            s = nxt
+            if k == len(zs_start) or s + 4 >= len(points):
+                break
+
             # 定义四个指标,GG=max(gn),G=min(gn),D=max(dn),DD=min(dn)，n遍历中枢中所有Zn。
             # 定义ZG=min(g1、g2), ZD=max(d1、d2)，显然，[ZD，ZG]就是缠中说禅走势中枢的区间
-            zs_d, zs_g = __get_zg_zd(zs_xd)
-            if zs_g <= zs_d:# 3段无重叠，后移
-                zs_xd.append(k_xd[i])
-                zs_xd.pop(0)
-                if self.verbose:
-                    print("无中枢：{} - {} - {}".format(zs_xd[0]['dt'], zs_xd[1]['dt'], zs_xd[2]['dt']))
-                continue
-
-            if xd_p['fx_mark'] == "d" and xd_p['xd'] > zs_g:    # 3买
-                zs = __get_zs(zs_xd)
-                zs['ZD']=zs_d
-                zs['ZG']=zs_g
-                zs['zs_extend'] = zs_extend
-                zs['buy3'] = xd_p
-                self.zs_list.append(zs)
-                if self.verbose:
-                    print("中枢完成：{} - {} - {}".format(zs_xd[0]['dt'], zs_xd[-2]['dt'], zs_xd[-1]['dt']))
-                zs_xd = []
-                # zs_xd.append(xd_p)
-                zs_extend = False
-                zs_finished = True
-            elif xd_p['fx_mark'] == "g" and xd_p['xd'] < zs_d:  # 3卖
-                zs = __get_zs(zs_xd)
-                zs['ZD']=zs_d
-                zs['ZG']=zs_g
-                zs['zs_extend'] = zs_extend
-                zs['sell3'] = xd_p
-                self.zs_list.append(zs)
-                if self.verbose:
-                    print("中枢完成：{} - {} - {}".format(zs_xd[0]['dt'], zs_xd[-2]['dt'], zs_xd[-1]['dt']))
-                zs_xd = []
-                #zs_xd.append(xd_p)
-                zs_extend = False
-                zs_finished = True                
-            else:                                               # 中枢延伸
-                zs_xd.append(xd_p)
-                zs_extend = True
-                zs_finished = False
-                if self.verbose:
-                    print("中枢延伸：{} - {} - {} - {}".format(zs_xd[0]['dt'], zs_xd[1]['dt'], zs_xd[2]['dt'], zs_xd[-1]['dt']))            
-            
-        if len(zs_xd) >= 5:            
-            if zs_g > zs_d:                
-                zs = __get_zs(zs_xd, finished=False)
-                zs['ZD']=zs_d
-                zs['ZG']=zs_g
-                zs['zs_extend'] = zs_extend
-                self.zs_list.append(zs)  
-
-    def reset_kline(self, data_from, kline, freqs=None, is_normalized=False):
+            zs_d, zs_g = zs_d_all[s], zs_g_all[s]
+            end = leave[k] if leave[k] >= 0 else __leave(s + 4 + window, zs_d, zs_g)
+            if self.verbose:
+                for i in range(s + 4, end):
+                    print("中枢延伸：{} - {} - {} - {}".format(points[s]['dt'], points[s + 1]['dt'],
+                                                           points[s + 2]['dt'], points[i]['dt']))
+            zs = __get_zs(points[s: end], finished=end < len(points))
+            zs['ZD'] = zs_d
+            zs['ZG'] = zs_g
+            zs['zs_extend'] = end > s + 4
+            if end == len(points):      # 中枢未完成
+                self._zs_list.append(zs)
+                break
+
+            zs['buy3' if is_d[end] else 'sell3'] = points[end]     # 3买 / 3卖
+            self._zs_list.append(zs)
+            if self.verbose:
+                print("中枢完成：{} - {} - {}".format(points[s]['dt'], points[end - 2]['dt'], points[end - 1]['dt']))
+            s = end + 1
+        _keep_unchanged(old_zs_list, self._zs_list)
+
+    def _update(self, replaced=False, start=None, stop=None, indicators=None):
+        """依次更新各级结构，每一级只从上一级发生变化的最早时间开始重新计算，没有变化时跳过
+        :param replaced: bool
+            上次计算时的最后一根原始K线是否被替换了
+        :param start: int
+            从这个位置开始的原始K线是新增或替换的，默认只有最后一根
+        :param stop: int
+            补入或更正历史K线时，只有 [start, stop) 的原始K线变化，之后的不变；默认到最后
+        :param indicators: dict of np.array
+            预先算好的指标，见 reset_kline
+        """
+        self._update_ta(start, stop, indicators)
+        if self.engine == 'array' and not self._kline_new:
+            self._kline_new, self._fx_list, self._bi_list, self._bi_removed = _engine.build(self._kline_raw, self.bi_mode, self.min_gap)
+            bi_dirty_dt = bi_moved_dt = self._bi_list[0]['dt'] if self._bi_list else None
+        else:
+            # 历史K线变化时，分型、笔都从该K线之前重新处理：跨过该K线的分型可能变化，
+            # 笔标记之间的K线数量也可能变化而分型不变
+            raw_dt = self._kline_raw[start]['dt'] if stop is not None and stop < len(self._kline_raw) else None
+            kn_dirty_dt = self._update_kline_new(replaced, raw_dt)
+            if raw_dt is not None:
+                kn_dirty_dt = raw_dt if kn_dirty_dt is None else min(kn_dirty_dt, raw_dt)
+            fx_dirty_dt = self._update_fx_list(kn_dirty_dt)
+            if raw_dt is not None:
+                fx_dirty_dt = raw_dt if fx_dirty_dt is None else min(fx_dirty_dt, raw_dt)
+            bi_dirty_dt, bi_moved_dt = self._update_bi_list(fx_dirty_dt, kn_dirty_dt)
+        xd_dirty_dt = self._update_xd_list(bi_dirty_dt, bi_moved_dt)
+        self._update_zs_list(xd_dirty_dt if self.zs_mode == 'xd' else bi_dirty_dt)
+        self._update_rec(xd_dirty_dt)
+
+    def __new_rec_list(self):
+        return [KlineAnalyze(self.symbol, "{}_r{}".format(self.freq, k + 1), bi_mode=self.bi_mode,
+                             max_xd_len=self.max_xd_len, zs_mode=self.zs_mode, verbose=self.verbose)
+                for k in range(self.rec_levels)]
+
+    def _update_rec(self, dirty_dt):
+        """依次更新递归的高级别：上一级别的线段标记从 dirty_dt 开始变化，对应的笔标记换成新的，之后的线段、中枢
+        按笔序列的变化增量更新，与本级别的 _update_xd_list、_update_zs_list 相同。
+        递归的高级别保留自己的历史，本级别按 max_xd_len 截断的线段标记不影响高级别，高级别按自己的线段数量截断
+        :param dirty_dt: 本级别线段序列发生变化的最早时间，None 表示没有变化
+        """
+        lower = self
+        for ka in self.rec_list:
+            if dirty_dt is None:
+                return
+            points = lower._xd_list[_bisect_dt(lower._xd_list, dirty_dt):]
+            bi_list = ka._bi_list[:_bisect_dt(ka._bi_list, dirty_dt)]
+            for x in points:
+                bi = dict(x)
+                bi['bi'] = bi.pop('xd')
+                bi_list.append(bi)
+            ka._bi_list = bi_list
+
+            xd_dirty_dt = ka._update_xd_list(dirty_dt, dirty_dt)
+            ka._update_zs_list(xd_dirty_dt if ka.zs_mode == 'xd' else dirty_dt)
+            if len(ka._xd_list) > ka.max_xd_len:
+                last_dt = ka._xd_list[-ka.max_xd_len:][0]['dt']
+                ka._bi_list = ka._bi_list[_bisect_dt(ka._bi_list, last_dt, right=True):]
+                ka._xd_list = ka._xd_list[_bisect_dt(ka._xd_list, last_dt, right=True):]
+                ka._feature_seqs = {k: v for k, v in ka._feature_seqs.items() if k > last_dt}
+            dirty_dt, lower = xd_dirty_dt, ka
+
+    def reset_kline(self, data_from, kline, freqs=None, is_normalized=False, parallel=None, max_workers=None,
+                    indicators=None):
         """
         初始化数据，并重新计算
         参数
@@ -641,57 +1255,112 @@ class KlineAnalyze:
         :param freq, 分时级别，比如'1m'
         :param kline, K线数据，可以是list或者pd.Dataframe
         :param freqs, 聚合高级数据，这个跟禅中说禅的区间套有区别
+        :param parallel, 各级别的计算方式：None 依次计算；thread 线程池；process 进程池，高级别K线通过共享内存传给子进程。
+            并行时本级别与各高级别同时计算，ka_list 的顺序与 freqs 一致
+        :param max_workers, 并行计算时的线程数或进程数，默认为高级别的数量
+        :param indicators, 预先算好的本级别均线、MACD，dict of np.array，列见 czsc.engine.indicators，与 kline 一一对应，
+            比如 BarStore.ta_view 的结果；默认逐个标的计算
         返回
         self
         """
         if not is_normalized:
             kline = normalize_kbars(self.symbol, kline, data_from)
 
-        self.kline_raw = []  # 原始K线序列
-        self.kline_new = []  # 去除包含关系的K线序列
+        # 根据输入K线初始化，时间转成 int64 纳秒时间戳，不修改输入的K线
+        if isinstance(kline, pd.DataFrame):
+            columns = kline.columns.to_list()
+            kline = [{k: v for k, v in zip(columns, row)} for row in kline.values]
+        dts = dt_to_i8([x['dt'] for x in kline]).tolist()
+        kline_raw = [dict(x, dt=dt) for x, dt in zip(kline, dts)]
+        return self.__reset(kline_raw, freqs, parallel, max_workers, indicators)
+
+    def __reset(self, kline_raw, freqs=None, parallel=None, max_workers=None, indicators=None):
+        """用内部格式的原始K线初始化，并重新计算，见 reset_kline"""
+        self._kline_raw = kline_raw  # 原始K线序列，从K线库读取时按列存放，见 _ColumnRows
+        self._kline_new = []  # 去除包含关系的K线序列
 
         # 辅助技术指标
-        self.ma = []
-        self.macd = []
+        self._ma = []
+        self._macd = []
 
         # 分型、笔、线段
-        self.fx_list = []
-        self.bi_list = []
-        self.xd_list = []
-        self.zs_list = []
+        self._fx_list = []
+        self._bi_list = []
+        self._xd_list = []
+        self._zs_list = []
         self.bs_list = []
         self.ka_list = []
-
-        # 根据输入K线初始化
-        if isinstance(kline, pd.DataFrame):
-            columns = kline.columns.to_list()
-            self.kline_raw = [{k: v for k, v in zip(columns, row)} for row in kline.values]
+        self.rec_list = self.__new_rec_list()
+        self._bi_removed = None
+        self._last_unfinished = False
+        self._feature_seqs = {}
+
+        self.start_dt = pd.Timestamp(self._kline_raw[0]['dt'])
+        self.end_dt = pd.Timestamp(self._kline_raw[-1]['dt'])
+        self.latest_price = self._kline_raw[-1]['close']
+
+        # 高级别K线只依赖本级别的原始K线，聚合之后各级别可以独立计算
+        levels = [(nxt_freq, get_kbars(self._kline_raw, self.freq, nxt_freq)) for nxt_freq in freqs or []]
+        params = dict(bi_mode=self.bi_mode, max_xd_len=self.max_xd_len, zs_mode=self.zs_mode,
+                      ma_params=self.ma_params, verbose=self.verbose, engine=self.engine,
+                      min_gap=self.min_gap)
+        if levels and parallel:
+            self.ka_list = self.__reset_levels(levels, params, parallel, max_workers, indicators)
         else:
-            self.kline_raw = kline
-
-        self.start_dt = self.kline_raw[0]['dt']
-        self.end_dt = self.kline_raw[-1]['dt']
-        self.latest_price = self.kline_raw[-1]['close']
-
-        self._update_ta()
-        self._update_kline_new()
-        self._update_fx_list()
-        self._update_bi_list()
-        self._update_xd_list()
-        self._update_zs_list()
-
-        if freqs:
-            for nxt_freq in freqs:
-                ka = KlineAnalyze(self.symbol, nxt_freq, self.bi_mode, self.max_xd_len, self.zs_mode, self.ma_params, self.verbose)
-                nxt_klines=get_kbars(self.kline_raw, self.freq, nxt_freq)
-                ka.reset_kline(data_from, nxt_klines, is_normalized=True)
-                self.ka_list.append(ka)
+            self._update(indicators=indicators)
+            self.ka_list = [_reset_level((self.symbol, nxt_freq, params, nxt_klines)) for nxt_freq, nxt_klines in levels]
+        self._publish()
+
+        for callback in self.callbacks:
+            callback(self)
 
         if self.verbose:
             print("计算完毕，接下来可以可视化或者分析背驰")
         return self
 
-    def add_kline(self, k):
+    def __reset_levels(self, levels, params, parallel, max_workers, indicators):
+        """在线程池或进程池中计算各高级别，同时在当前线程计算本级别"""
+        store = None
+        if parallel == 'thread':
+            executor = ThreadPoolExecutor(max_workers=max_workers or len(levels))
+            tasks = [(self.symbol, nxt_freq, params, nxt_klines) for nxt_freq, nxt_klines in levels]
+        elif parallel == 'process':
+            store = BarStore.from_bars(dict(levels))
+            executor = ProcessPoolExecutor(max_workers=max_workers or len(levels))
+            tasks = [(self.symbol, nxt_freq, params, (store.handle,) + store.index[nxt_freq]) for nxt_freq, _ in levels]
+        else:
+            raise ValueError("parallel 可选值为 None / thread / process")
+
+        try:
+            futures = [executor.submit(_reset_level, task) for task in tasks]
+            self._update(indicators=indicators)
+            return [future.result() for future in futures]
+        finally:
+            executor.shutdown()
+            if store is not None:
+                store.close()
+                store.unlink()
+
+    def reset_kline_from_store(self, store, offset, length, freqs=None, adjust=None):
+        """从全市场K线库中读取本标的的K线，并重新计算
+        参数
+        :param store, czsc.store.BarStore
+        :param offset, 本标的在K线库中的起始位置
+        :param length, 本标的的K线数量
+        :param freqs, 聚合高级数据，见 reset_kline
+        :param adjust, 复权方式，None / pre / post，见 BarStore.to_bars
+        返回
+        self
+        """
+        # 原始K线按列存放（见 _ColumnRows），不为每根K线生成 dict；复制一份，不依赖K线库的生命周期
+        view = adjust_columns(store.view(offset, length), store.factors.get(self.symbol), adjust)
+        kline_raw = _ColumnRows(['symbol'] + list(view),
+                                [np.full(length, self.symbol, dtype=object)] + [np.array(v) for v in view.values()])
+        # K线库已经用相同参数算好指标时直接读取，见 BarStore.compute_indicators
+        indicators = store.ta_view(offset, length, self.ma_params, adjust)
+        return self.__reset(kline_raw, freqs=freqs, indicators=indicators)
+
+    def add_kline(self, k, is_final=None):
         """只更新本分时级别更新分析结果
         :param k: dict
             单根K线对象，样例如下
@@ -702,36 +1371,150 @@ class KlineAnalyze:
              'high': 3373.53,
              'low': 3209.76,
              'vol': 486366915.0}
+        :param is_final: bool
+            K线是否已经完成。为 False 时，之后输入的同一时间的K线会替换这一根；
+            为 None 时沿用旧的判断方式，开盘价与最后一根K线相同即视为未完成K线的更新
         """
         if self.verbose:
             print("=" * 100)
             print("输入新K线：{}".format(k))
-        if not self.kline_raw or k['open'] != self.kline_raw[-1]['open']:
-            self.kline_raw.append(k)
+        replaced = self.__merge_raw(k, is_final)
+        self._update(replaced)
+        return self.__finish_update()
+
+    def add_klines(self, kline, is_final=None):
+        """批量输入K线，比如断线重连后补齐缺失的K线。结果与逐根调用 add_kline 相同，
+        但各级结构只从第一根新K线开始计算一次，回调也只调用一次
+        注意：逐根输入时线段数量超过 max_xd_len 会立即截断历史，批量输入时只在最后截断一次
+        :param kline: list of dict
+            按时间升序的K线，格式见 add_kline
+        :param is_final: bool or list of bool
+            K线是否已经完成，见 add_kline；可以是所有K线共用的值，也可以每根K线一个
+        """
+        if len(kline) == 0:
+            return self
+        flags = is_final if isinstance(is_final, (list, tuple)) else [is_final] * len(kline)
+        n = len(self._kline_raw)
+        # 只有第一根K线可能替换已有的最后一根，之后的替换都发生在新K线上
+        replaced = self.__merge_raw(kline[0], flags[0])
+        for k, flag in zip(kline[1:], flags[1:]):
+            self.__merge_raw(k, flag)
+        self._update(replaced, start=n - 1 if replaced else n)
+        return self.__finish_update()
+
+    def upsert_kline(self, k):
+        """按时间插入或更正一根已完成的K线，比如数据商推送的历史K线修正（最高价、最低价、成交量等）、迟到的K线
+        时间相同的K线被替换，否则按时间插入；各级结构回退到这根K线之前的状态，只从这里往后重新计算，
+        指标只重新计算窗口内包含这根K线的部分。K线晚于最后一根时等同于 add_kline(k, is_final=True)
+        :param k: dict
+            单根K线对象，格式见 add_kline
+        """
+        dt = _dt_i8(k['dt'])
+        if not self._kline_raw or dt > self._kline_raw[-1]['dt']:
+            return self.add_kline(k, is_final=True)
+        if dt < self._kline_raw[0]['dt']:
+            raise ValueError("K线时间早于分析器中最早的K线，请使用 reset_kline 重新计算：{}".format(k['dt']))
+
+        if self.verbose:
+            print("=" * 100)
+            print("插入或更正K线：{}".format(k))
+        if not isinstance(self._kline_raw, list):
+            self._kline_raw = list(self._kline_raw)
+        i = _bisect_dt(self._kline_raw, dt)
+        if self._kline_raw[i]['dt'] == dt:
+            self._kline_raw[i] = dict(k, dt=dt)
+        else:
+            self._kline_raw.insert(i, dict(k, dt=dt))
+        if i == len(self._kline_raw) - 1:
+            self._last_unfinished = False
+        self._update(start=i, stop=i + 1)
+        return self.__finish_update()
+
+    def rescale(self, ratio, before=None):
+        """按比例缩放价格，用于前复权价格在除权除息之后的整体变化，见 czsc.adjust
+        去除包含关系、分型、笔、线段、中枢的判断只比较价格的大小，整体缩放不改变结构，各序列直接按比例缩放，
+        不需要重新计算；均线、MACD 是价格的线性函数，同样按比例缩放。成交量不变
+        :param ratio: float
+            缩放比例，大于 0
+        :param before: 只缩放这个时间之前的K线，默认全部。在已有K线之间时，之前的结构按比例缩放，
+            之后的结构从这里开始回退重新计算，见 upsert_kline
+        """
+        if not ratio > 0:
+            raise ValueError("缩放比例必须大于 0：{}".format(ratio))
+        end = len(self._kline_raw) if before is None else _bisect_dt(self._kline_raw, _dt_i8(before))
+        if end == 0 or ratio == 1:
+            return self
+        end_dt = self._kline_raw[end - 1]['dt']
+        for ka in [self] + self.rec_list:
+            ka.__scale(ratio, end_dt)
+        for ka in self.ka_list:
+            ka.rescale(ratio, before)
+
+        if end < len(self._kline_raw):
+            self._update(start=end, stop=end + 1)
+        # 中枢引用笔、线段标记，按缩放后的标记重新生成
+        for ka in [self] + self.rec_list:
+            points = ka._xd_list if ka.zs_mode == 'xd' else ka._bi_list
+            if points:
+                ka._update_zs_list(points[0]['dt'])
+        return self.__finish_update()
+
+    def __scale(self, ratio, end_dt):
+        """按比例缩放 end_dt（含）之前的各序列，见 rescale"""
+        def __scale_seq(seq, keys):
+            # 替换为新对象，见 _view
+            for i in range(_bisect_dt(seq, end_dt, right=True)):
+                seq[i] = dict(seq[i], **{k: seq[i][k] * ratio for k in keys if k in seq[i]})
+
+        bar_keys = ('open', 'close', 'high', 'low')
+        self._kline_raw, self._ma, self._macd = list(self._kline_raw), list(self._ma), list(self._macd)
+        __scale_seq(self._kline_raw, bar_keys)
+        __scale_seq(self._kline_new, bar_keys)
+        __scale_seq(self._ma, ['ma%i' % p for p in self.ma_params])
+        __scale_seq(self._macd, ('diff', 'dea', 'macd'))
+        __scale_seq(self._fx_list, ('fx', 'fx_high', 'fx_low'))
+        __scale_seq(self._bi_list, ('bi', 'xd', 'fx_high', 'fx_low'))
+        __scale_seq(self._xd_list, ('xd', 'fx_high', 'fx_low'))
+        if self._bi_removed and self._bi_removed['dt'] <= end_dt:
+            self._bi_removed = dict(self._bi_removed, **{k: self._bi_removed[k] * ratio
+                                                         for k in ('bi', 'fx_high', 'fx_low')})
+        self._feature_seqs = {}
+
+    def __merge_raw(self, k, is_final):
+        """把一根K线并入原始K线序列
+        :return: bool
+            是否替换了最后一根原始K线
+        """
+        k = dict(k, dt=_dt_i8(k['dt']))
+        if not isinstance(self._kline_raw, list):
+            self._kline_raw = list(self._kline_raw)
+        if is_final is None:
+            replaced = bool(self._kline_raw) and k['open'] == self._kline_raw[-1]['open']
+        else:
+            replaced = bool(self._kline_raw) and self._last_unfinished and k['dt'] == self._kline_raw[-1]['dt']
+            self._last_unfinished = not is_final
+        if not replaced:
+            self._kline_raw.append(k)
         else:
             if self.verbose:
-                print("输入K线处于未完成状态，更新：replace {} with {}".format(self.kline_raw[-1], k))
-            self.kline_raw[-1] = k
-
-        self._update_ta()
-        self._update_kline_new()
-        self._update_fx_list()
-        self._update_bi_list()
-        self._update_xd_list()
-        self._update_zs_list()
-
-        self.end_dt = self.kline_raw[-1]['dt']
-        self.latest_price = self.kline_raw[-1]['close']
-
-        if len(self.xd_list) > self.max_xd_len:
-            last_dt = self.xd_list[-self.max_xd_len:][0]['dt']
-            self.kline_raw = [x for x in self.kline_raw if x['dt'] > last_dt]
-            self.kline_new = [x for x in self.kline_new if x['dt'] > last_dt]
-            self.ma = [x for x in self.ma if x['dt'] > last_dt]
-            self.macd = [x for x in self.macd if x['dt'] > last_dt]
-            self.fx_list = [x for x in self.fx_list if x['dt'] > last_dt]
-            self.bi_list = [x for x in self.bi_list if x['dt'] > last_dt]
-            self.xd_list = [x for x in self.xd_list if x['dt'] > last_dt]
+                print("输入K线处于未完成状态，更新：replace {} with {}".format(self._kline_raw[-1], k))
+            self._kline_raw[-1] = k
+        return replaced
+
+    def __finish_update(self):
+        """add_kline / add_klines 计算完成后更新最新状态、截断历史、发布快照并调用回调"""
+        self.end_dt = pd.Timestamp(self._kline_raw[-1]['dt'])
+        self.latest_price = self._kline_raw[-1]['close']
+
+        if len(self._xd_list) > self.max_xd_len:
+            last_dt = self._xd_list[-self.max_xd_len:][0]['dt']
+            for name in ('_kline_raw', '_kline_new', '_ma', '_macd', '_fx_list', '_bi_list', '_xd_list'):
+                seq = getattr(self, name)
+                setattr(self, name, seq[_bisect_dt(seq, last_dt, right=True):])
+        self._publish()
+
+        for callback in self.callbacks:
+            callback(self)
 
         if self.verbose:
             print("更新结束\n\n")
@@ -748,13 +1531,17 @@ class KlineAnalyze:
               with_macd: bool = False,
               title: str = "ChanLun In Practise",
               width: str = "1440px",
-              height: str = '900px'):
-        return to_grid(self, kline_mode=kline_mode, with_bi=with_bi, with_xd=with_xd, with_zs=with_zs, with_bs=with_bs, with_ma=with_ma, with_vol=with_vol, with_macd=with_macd, title=title, width=width, height=height)
+              height: str = '900px',
+              max_points: int = None,
+              window: int = None,
+              downsample: str = "minmax"):
+        return to_grid(self, kline_mode=kline_mode, with_bi=with_bi, with_xd=with_xd, with_zs=with_zs, with_bs=with_bs, with_ma=with_ma, with_vol=with_vol, with_macd=with_macd, title=title, width=width, height=height,
+                       max_points=max_points, window=window, downsample=downsample)
 
     def to_df(self, ma_params=(5, 20), use_macd=False, max_count=1000, mode="raw"):
-        """整理成 df 输出
+        """整理成 df 输出，按列组装，不修改分析器内部数据
         :param ma_params: tuple of int
-            均线系统参数
+            均线系统参数，已在 self.ma_params 中的均线直接使用缓存结果
         :param use_macd: bool
         :param max_count: int
         :param mode: str
@@ -762,42 +1549,63 @@ class KlineAnalyze:
         :return: pd.DataFrame
         """
         if mode == "raw":
-            bars = self.kline_raw[-max_count:]
+            bars = self._kline_raw[-max_count:]
         elif mode == "new":
-            bars = self.kline_raw[-max_count:]
+            bars = self._kline_new[-max_count:]
         else:
             raise ValueError
 
-        fx_list = {x["dt"]: {"fx_mark": x["fx_mark"], "fx": x['fx']} for x in self.fx_list[-(max_count // 2):]}
-        bi_list = {x["dt"]: {"fx_mark": x["fx_mark"], "bi": x['bi']} for x in self.bi_list[-(max_count // 4):]}
-        xd_list = {x["dt"]: {"fx_mark": x["fx_mark"], "xd": x['xd']} for x in self.xd_list[-(max_count // 8):]}
-        results = []
-        for k in bars:
-            k['fx_mark'], k['fx'], k['bi'], k['xd'] = "o", None, None, None
-            fx_ = fx_list.get(k['dt'], None)
-            bi_ = bi_list.get(k['dt'], None)
-            xd_ = xd_list.get(k['dt'], None)
-            if fx_:
-                k['fx_mark'] = fx_["fx_mark"]
-                k['fx'] = fx_["fx"]
-
-            if bi_:
-                k['bi'] = bi_["bi"]
-
-            if xd_:
-                k['xd'] = xd_["xd"]
-
-            results.append(k)
-        df = pd.DataFrame(results)
+        if not bars:
+            return pd.DataFrame()
+        dts = _tail_column(bars, 'dt', np.int64)
+        df = pd.DataFrame({key: pd.to_datetime(dts) if key == 'dt' else [x[key] for x in bars] for key in bars[0]})
+
+        # 分型、笔、线段按时间对齐到K线上，数量都不会超过K线数量
+        fx_mark = np.full(len(df), "o", dtype=object)
+        for key, points in (("fx", self._fx_list[-max_count:]), ("bi", self._bi_list[-max_count:]),
+                            ("xd", self._xd_list[-max_count:])):
+            values = np.full(len(df), np.nan)
+            if points:
+                pos, matched = align_index(dts, _tail_column(points, 'dt', np.int64))
+                values[pos[matched]] = _tail_column(points, key, np.double)[matched]
+                if key == "fx":
+                    fx_mark[pos[matched]] = _tail_column(points, 'fx_mark', object)[matched]
+            df[key] = values
+        df.insert(len(df.columns) - 3, "fx_mark", fx_mark)
+
+        def __join(rows, columns):
+            pos, matched = align_index(dts, _tail_column(rows, 'dt', np.int64, max_count))
+            for key, arr in columns.items():
+                values = np.full(len(df), np.nan)
+                values[pos[matched]] = arr[matched]
+                df[key] = values
+
+        # 均线、MACD 直接使用 _update_ta 的结果，均线参数不在 self.ma_params 中时用原始K线计算
+        close_ = None
         for p in ma_params:
-            df.loc[:, "ma{}".format(p)] = ta.SMA(df.close.values, p)
+            key = "ma%i" % p
+            if p in self.ma_params:
+                __join(self._ma, {key: _tail_column(self._ma, key, np.double, max_count)})
+            else:
+                if close_ is None:
+                    close_ = _tail_column(self._kline_raw, "close", np.double)
+                __join(self._kline_raw, {key: ta.SMA(close_, p)[-max_count:]})
+
         if use_macd:
-            diff, dea, macd = ta.MACD(df.close.values)
-            df.loc[:, "diff"] = diff
-            df.loc[:, "dea"] = dea
-            df.loc[:, "macd"] = macd
+            __join(self._macd, {key: _tail_column(self._macd, key, np.double, max_count)
+                                for key in ("diff", "dea", "macd")})
         return df
 
+    def to_arrow(self, **kwargs):
+        """整理成 pyarrow.Table 输出，参数同 to_df
+        :return: pyarrow.Table
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("to_arrow 依赖 pyarrow，请先安装：pip install pyarrow")
+        return pa.Table.from_pandas(self.to_df(**kwargs), preserve_index=False)
+
     def is_bei_chi(self, zs1, zs2, mode="bi", adjust=0.9, last_index: int = None):
         """判断 zs1 对 zs2 是否有背驰
         注意：力度的比较，并没有要求两段走势方向一致；但是如果两段走势之间存在包含关系，这样的力度比较是没有意义的。
@@ -818,20 +1626,18 @@ class KlineAnalyze:
             在比较最后一个走势的时候，可以设置这个参数来提升速度，相当于只对 last_index 后面的K线进行力度比较
         :return: bool
         """
+        zs1 = dict(zs1, start_dt=_dt_i8(zs1["start_dt"]), end_dt=_dt_i8(zs1["end_dt"]))
+        zs2 = dict(zs2, start_dt=_dt_i8(zs2["start_dt"]), end_dt=_dt_i8(zs2["end_dt"]))
         assert zs1["start_dt"] > zs2["end_dt"], "zs1 必须是最近的走势，用于比较；zs2 必须是较前的走势，被比较。"
         assert zs1["start_dt"] < zs1["end_dt"], "走势的时间区间定义错误，必须满足 start_dt < end_dt"
         assert zs2["start_dt"] < zs2["end_dt"], "走势的时间区间定义错误，必须满足 start_dt < end_dt"
 
-        min_dt = min(zs1["start_dt"], zs2["start_dt"])
-        max_dt = max(zs1["end_dt"], zs2["end_dt"])
         if last_index:
-            macd = self.macd[-last_index:]
+            macd = self._macd[-last_index:]
         else:
-            macd = self.macd
-        macd_ = [x for x in macd if x['dt'] >= min_dt]
-        macd_ = [x for x in macd_ if max_dt >= x['dt']]
-        k1 = [x for x in macd_ if zs1["end_dt"] >= x['dt'] >= zs1["start_dt"]]
-        k2 = [x for x in macd_ if zs2["end_dt"] >= x['dt'] >= zs2["start_dt"]]
+            macd = self._macd
+        k1 = _range_dt(macd, zs1["start_dt"], zs1["end_dt"])
+        k2 = _range_dt(macd, zs2["start_dt"], zs2["end_dt"])
 
         bc = False
         if mode == 'bi':
@@ -864,6 +1670,75 @@ class KlineAnalyze:
 
         return bc
 
+    def get_fd_bei_chi(self, mode="bi", adjust=0.9, power_mode=None):
+        """批量计算所有走势分段的力度，并判断每个分段相对前一个同向分段是否背驰
+        结果与对相邻同向分段逐一调用 calculate_macd_power、is_bei_chi 一致，但只需要一次向量化计算
+        :param mode: str
+            分段类型，可选值 ['bi', 'xd']
+        :param adjust: float
+            调整前一个同向分段的力度，见 is_bei_chi
+        :param power_mode: str
+            力度计算方式，默认与 mode 相同；bi 累加全部 MACD 柱的绝对值，xd 只累加与分段方向一致的 MACD 柱
+        :return: pd.DataFrame
+            每行一个分段，列为 start_dt, end_dt, direction, high, low, macd_power, vol_power, bei_chi, vol_bei_chi
+        """
+        if mode == 'bi':
+            points = self._bi_list
+        elif mode == 'xd':
+            points = self._xd_list
+        else:
+            raise ValueError
+
+        power_mode = power_mode or mode
+        if power_mode not in ('bi', 'xd'):
+            raise ValueError("power_mode value error")
+
+        columns = ["start_dt", "end_dt", "direction", "high", "low", "macd_power", "vol_power", "bei_chi", "vol_bei_chi"]
+        if len(points) < 2:
+            return pd.DataFrame(columns=columns)
+
+        p_dts = np.array([x['dt'] for x in points], dtype=np.int64)
+        p_val = np.array([x[mode] for x in points], dtype=np.double)
+        is_up = p_val[1:] > p_val[:-1]
+
+        def __range_sum(rows_dts, values):
+            """对每个分段 [start_dt, end_dt]（含两端）求和，区间内有 nan 时结果为 nan"""
+            lo = np.searchsorted(rows_dts, p_dts[:-1], side='left')
+            hi = np.searchsorted(rows_dts, p_dts[1:], side='right')
+            cs = np.r_[0, np.cumsum(np.nan_to_num(values))]
+            nan_cs = np.r_[0, np.cumsum(np.isnan(values))]
+            return np.where(nan_cs[hi] - nan_cs[lo] > 0, np.nan, cs[hi] - cs[lo])
+
+        macd_dts = np.array([x['dt'] for x in self._macd], dtype=np.int64)
+        macd = np.array([x['macd'] for x in self._macd], dtype=np.double)
+        if power_mode == 'bi':
+            macd_power = __range_sum(macd_dts, np.abs(macd))
+        else:
+            up_power = __range_sum(macd_dts, np.where(macd > 0, macd, 0))
+            down_power = __range_sum(macd_dts, np.where(macd < 0, -macd, 0))
+            macd_power = np.where(is_up, up_power, down_power)
+
+        vol_power = __range_sum(np.array([x['dt'] for x in self._kline_raw], dtype=np.int64),
+                                np.array([x['vol'] for x in self._kline_raw], dtype=np.double))
+
+        # 每个分段与前一个同向分段（即前第二个分段）比较
+        bei_chi = np.zeros(len(is_up), dtype=bool)
+        bei_chi[2:] = macd_power[2:] < macd_power[:-2] * adjust
+        vol_bei_chi = np.zeros(len(is_up), dtype=bool)
+        vol_bei_chi[2:] = vol_power[2:] < vol_power[:-2] * adjust
+
+        return pd.DataFrame({
+            "start_dt": pd.to_datetime(p_dts[:-1]),
+            "end_dt": pd.to_datetime(p_dts[1:]),
+            "direction": np.where(is_up, "up", "down"),
+            "high": np.fmax(p_val[:-1], p_val[1:]),
+            "low": np.fmin(p_val[:-1], p_val[1:]),
+            "macd_power": macd_power,
+            "vol_power": vol_power,
+            "bei_chi": bei_chi,
+            "vol_bei_chi": vol_bei_chi,
+        }, columns=columns)
+
     def get_sub_section(self, start_dt, end_dt, mode="bi", is_last=True):
         """获取子区间
         :param start_dt: datetime
@@ -878,28 +1753,77 @@ class KlineAnalyze:
         """
         if mode == "kn":
             if is_last:
-                points = self.kline_new[-200:]
+                points = self._kline_new[-200:]
             else:
-                points = self.kline_new
+                points = self._kline_new
         elif mode == "fx":
             if is_last:
-                points = self.fx_list[-100:]
+                points = self._fx_list[-100:]
             else:
-                points = self.fx_list
+                points = self._fx_list
         elif mode == "bi":
             if is_last:
-                points = self.bi_list[-50:]
+                points = self._bi_list[-50:]
             else:
-                points = self.bi_list
+                points = self._bi_list
         elif mode == "xd":
             if is_last:
-                points = self.xd_list[-30:]
+                points = self._xd_list[-30:]
             else:
-                points = self.xd_list
+                points = self._xd_list
         else:
             raise ValueError
 
-        return [x for x in points if end_dt >= x['dt'] >= start_dt]
+        return _public_list(_range_dt(points, _dt_i8(start_dt), _dt_i8(end_dt)))
+
+    def get_level(self, freq):
+        """本级别或 ka_list 中分时级别为 freq 的分析器"""
+        if freq == self.freq:
+            return self
+        for ka in self.ka_list:
+            if ka.freq == freq:
+                return ka
+        raise ValueError("没有分时级别 {}，可选值为 {}".format(freq, [self.freq] + [ka.freq for ka in self.ka_list]))
+
+    def __nest_range(self, start_dt, end_dt, freq, sub_freq):
+        """freq 级别上 [start_dt, end_dt] 对应的 sub_freq 级别的时间范围
+        高级别K线的时间取聚合的最后一根K线的时间（见 get_kbars），各级别的时间都是升序的整数，
+        起点是 start_dt 所在的高级别K线聚合的第一根低级别K线，即上一根高级别K线之后的第一根，两次二分查找即可定位
+        """
+        start_dt, end_dt = _dt_i8(start_dt), _dt_i8(end_dt)
+        high, low = self.get_level(freq)._kline_raw, self.get_level(sub_freq or self.freq)._kline_raw
+        i = _bisect_dt(high, start_dt)
+        j = _bisect_dt(low, high[i - 1]['dt'], right=True) if i > 0 else 0
+        return (low[j]['dt'] if j < len(low) else start_dt), end_dt
+
+    def get_bar_span(self, dt, freq, sub_freq=None):
+        """区间套：freq 级别上 dt 所在的K线由 sub_freq 级别（默认本级别）的哪些K线聚合而成
+        :return: (start_dt, end_dt)
+            第一根、最后一根低级别K线的时间
+        """
+        start_dt, end_dt = self.__nest_range(dt, dt, freq, sub_freq)
+        bars = _range_dt(self.get_level(sub_freq or self.freq)._kline_raw, start_dt, end_dt)
+        if not bars:
+            return None, None
+        return pd.Timestamp(bars[0]['dt']), pd.Timestamp(bars[-1]['dt'])
+
+    def get_nested_section(self, start_dt, end_dt, freq, sub_freq=None, mode="bi"):
+        """区间套：freq 级别上 [start_dt, end_dt] 的走势（比如一段线段、一个中枢）在 sub_freq 级别（默认本级别）中的子区间
+        可以逐级向下查询，比如 30m 线段 -> 5m 笔 -> 1m 分型；各级别的分时必须是整数倍关系，见 get_kbars
+        :param start_dt: datetime
+            freq 级别上走势开始时间，包含开始时间所在K线聚合的全部低级别K线
+        :param end_dt: datetime
+            freq 级别上走势结束时间
+        :param freq: str
+            走势所在的分时级别，本级别或 ka_list 中的级别
+        :param sub_freq: str
+            需要获取的子区间所在的分时级别
+        :param mode: str
+            需要获取的子区间对象类型，可取值 ['kn', 'fx', 'bi', 'xd']
+        :return: list of dict
+        """
+        start_dt, end_dt = self.__nest_range(start_dt, end_dt, freq, sub_freq)
+        return self.get_level(sub_freq or self.freq).get_sub_section(start_dt, end_dt, mode=mode, is_last=False)
 
     def calculate_macd_power(self, start_dt, end_dt, mode='bi', direction="up"):
         """用 MACD 计算走势段（start_dt ~ end_dt）的力度
@@ -914,7 +1838,7 @@ class KlineAnalyze:
         :return: float
             走势力度
         """
-        fd_macd = [x for x in self.macd if end_dt >= x['dt'] >= start_dt]
+        fd_macd = _range_dt(self._macd, _dt_i8(start_dt), _dt_i8(end_dt))
 
         if mode == 'bi':
             power = sum([abs(x['macd']) for x in fd_macd])
@@ -938,7 +1862,7 @@ class KlineAnalyze:
         :return: float
             走势力度
         """
-        fd_vol = [x for x in self.kline_raw if end_dt >= x['dt'] >= start_dt]
+        fd_vol = _range_dt(self._kline_raw, _dt_i8(start_dt), _dt_i8(end_dt))
         power = sum([x['vol'] for x in fd_vol])
         return int(power)
 
@@ -959,9 +1883,9 @@ class KlineAnalyze:
         :return: list of dict
         """
         if mode == 'bi':
-            points = self.bi_list[-(n + 1):]
+            points = self._bi_list[-(n + 1):]
         elif mode == 'xd':
-            points = self.xd_list[-(n + 1):]
+            points = self._xd_list[-(n + 1):]
         else:
             raise ValueError
 
@@ -972,8 +1896,8 @@ class KlineAnalyze:
             direction = "up" if p1[mode] < p2[mode] else "down"
             power = self.calculate_macd_power(start_dt=p1['dt'], end_dt=p2['dt'], mode=mode, direction=direction)
             res.append({
-                "start_dt": p1['dt'],
-                "end_dt": p2['dt'],
+                "start_dt": pd.Timestamp(p1['dt']),
+                "end_dt": pd.Timestamp(p2['dt']),
                 "power": power,
                 "direction": direction,
                 "high": max(p1[mode], p2[mode]),
@@ -989,8 +1913,8 @@ class KlineAnalyze:
         :return:
         """
         if mode == 'bi':
-            p1 = self.bi_list[-1]
-            points = [x for x in self.fx_list[-60:] if x['dt'] >= p1['dt']]
+            p1 = self._bi_list[-1]
+            points = [x for x in self._fx_list[-60:] if x['dt'] >= p1['dt']]
             if len(points) < 2:
                 return None
 
@@ -1009,11 +1933,11 @@ class KlineAnalyze:
             p2['bi'] = p2.pop('fx')
 
         elif mode == 'xd':
-            if not self.xd_list:
+            if not self._xd_list:
                 return None
 
-            p1 = self.xd_list[-1]
-            points = [x for x in self.bi_list[-60:] if x['dt'] >= p1['dt']]
+            p1 = self._xd_list[-1]
+            points = [x for x in self._bi_list[-60:] if x['dt'] >= p1['dt']]
             if len(points) < 4:
                 return None
 
@@ -1035,11 +1959,28 @@ class KlineAnalyze:
 
         power = self.calculate_macd_power(start_dt=p1['dt'], end_dt=p2['dt'], mode=mode, direction=direction)
         return {
-            "start_dt": p1['dt'],
-            "end_dt": p2['dt'],
+            "start_dt": pd.Timestamp(p1['dt']),
+            "end_dt": pd.Timestamp(p2['dt']),
             "power": power,
             "direction": direction,
             "high": max(p1[mode], p2[mode]),
             "low": min(p1[mode], p2[mode]),
             "mode": mode
         }
+
+
+def _reset_level(args):
+    """计算一个级别，args 为 (symbol, freq, 分析器参数, K线)；
+    K线为 (BarStore.handle, offset, length) 时从共享内存读取，用于子进程"""
+    symbol, freq, params, kline = args
+    ka = KlineAnalyze(symbol, freq, **params)
+    if isinstance(kline, tuple):
+        handle, offset, length = kline
+        store = BarStore.attach(handle)
+        try:
+            ka.reset_kline_from_store(store, offset, length)
+        finally:
+            store.close()
+    else:
+        ka.reset_kline(None, kline, is_normalized=True)
+    return ka
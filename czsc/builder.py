@@ -0,0 +1,188 @@
+# coding: utf-8
+"""
+K线合成器：把逐笔成交（或快照行情的最新价）合成指定级别的K线，按交易时段判断K线是否完成，
+并带上明确的 is_final 标记推送给分析器（KlineAnalyze.add_kline），不再依赖开盘价判断未完成K线
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from czsc.utils import check_naive, dt_to_i8
+
+_ns_minute = 60 * 10 ** 9
+_ns_day = 24 * 60 * _ns_minute
+
+# A股交易时段
+sessions_a = (("09:30", "11:30"), ("13:00", "15:00"))
+
+
+def _dt_i8(dt):
+    """成交时间转成 int64 纳秒时间戳；按天切分K线要求不带时区的本地时间，见 check_naive"""
+    if isinstance(dt, (int, np.integer)):
+        return int(dt)
+    dt = pd.Timestamp(dt)
+    check_naive(dt)
+    return dt.value
+
+
+def _time_of_day(s):
+    """HH:MM 或 HH:MM:SS 转成距零点的纳秒数"""
+    return pd.Timedelta(s if s.count(":") == 2 else s + ":00").value
+
+
+def _bar_ends(freq, sessions):
+    """一天内各根K线的结束时间（距零点的纳秒数）
+    分钟K线从每个时段的开始时间按 freq 切分，时段结束时截断；日线只有一根，结束于最后一个时段
+    """
+    if freq[-1] == 'm':
+        step = int(freq[:-1]) * _ns_minute
+    elif freq == '1d':
+        step = None
+    else:
+        raise ValueError("只支持分钟级别（比如 1m、5m）和日线（1d）：{}".format(freq))
+
+    ends = []
+    for start, end in sessions:
+        start, end = _time_of_day(start), _time_of_day(end)
+        if step:
+            ends.extend(range(start + step, end, step))
+        ends.append(end)
+    if step is None:
+        ends = ends[-1:]
+    return ends
+
+
+class BarBuilder:
+    def __init__(self, freqs=("1m",), sessions=sessions_a, on_bar=None):
+        """
+        :param freqs: list of str
+            合成的K线级别，比如 ['1m', '5m', '30m']
+        :param sessions: tuple
+            交易时段 ((开始, 结束), ...)，时间格式为 HH:MM 或 HH:MM:SS，按时间先后排列，不支持跨零点的夜盘。
+            K线的 dt 为结束时间，每根K线包含 (开始, 结束] 内的成交；开盘前的成交并入第一根K线，
+            午休中的成交并入下一个时段的第一根K线，收盘后的成交并入最后一根K线
+        :param on_bar: callable
+            每次推送K线时调用 on_bar(bar, is_final)，可用于落库等
+        """
+        self.freqs = list(freqs)
+        self._ends = {freq: _bar_ends(freq, sessions) for freq in self.freqs}
+        self._ends_arr = {freq: np.array(ends, dtype=np.int64) for freq, ends in self._ends.items()}
+        self.on_bar = on_bar
+        self.analyzers = {}     # (symbol, freq) -> KlineAnalyze
+        self.bars = {}          # (symbol, freq) -> 当前K线 [end, open, high, low, close, vol, is_final]
+
+    def register(self, ka):
+        """登记分析器，之后合成的 (ka.symbol, ka.freq) K线通过 ka.add_kline(bar, is_final) 推送；
+        分析器需要先用 reset_kline 载入历史K线"""
+        if ka.freq not in self._ends:
+            raise ValueError("合成器不包含级别：{}".format(ka.freq))
+        self.analyzers[(ka.symbol, ka.freq)] = ka
+
+    def _emit(self, key, bar, is_final):
+        symbol, freq = key
+        k = {"symbol": symbol, "dt": pd.Timestamp(bar[0]), "open": bar[1], "close": bar[4],
+             "high": bar[2], "low": bar[3], "vol": bar[5]}
+        ka = self.analyzers.get(key)
+        if ka is not None:
+            ka.add_kline(k, is_final=is_final)
+        if self.on_bar is not None:
+            self.on_bar(k, is_final)
+
+    def __merge(self, key, end, o, h, l, c, v):
+        """把属于同一根K线的一段成交并入当前K线，进入下一根K线时推送已完成的K线
+        :return: bool
+            当前K线是否发生变化，所属K线已经完成的迟到成交会被丢弃
+        """
+        bar = self.bars.get(key)
+        if bar is not None:
+            if end < bar[0] or (end == bar[0] and bar[6]):
+                return False
+            if end == bar[0]:
+                if h > bar[2]:
+                    bar[2] = h
+                if l < bar[3]:
+                    bar[3] = l
+                bar[4] = c
+                bar[5] += v
+                return True
+            if not bar[6]:
+                self._emit(key, bar, True)
+        self.bars[key] = [end, o, h, l, c, v, False]
+        return True
+
+    def update(self, symbol, dt, price, vol=0.0):
+        """输入一笔成交，每个级别的当前K线都推送一次（is_final=False）
+        :param symbol: str
+        :param dt: 成交时间，不带时区的 datetime / pd.Timestamp 或 int64 纳秒时间戳
+        :param price: float
+        :param vol: float
+            这笔成交的成交量（不是累计成交量）
+        """
+        t = _dt_i8(dt)
+        day = t - t % _ns_day
+        for freq in self.freqs:
+            ends = self._ends[freq]
+            end = day + ends[min(bisect_left(ends, t - day), len(ends) - 1)]
+            key = (symbol, freq)
+            if self.__merge(key, end, price, price, price, price, vol):
+                self._emit(key, self.bars[key], False)
+
+    def update_batch(self, symbols, dts, prices, vols=None):
+        """批量输入成交，同一标的的成交需按时间先后排列，不同标的可以交错
+        向量化地把成交归入K线并聚合，每个标的、每个级别在一批中最多推送一次当前K线（is_final=False），
+        期间完成的K线各推送一次（is_final=True）；批量越大，单笔成交的开销越小
+        :param symbols: array-like of str
+        :param dts: array-like，成交时间，不带时区的 datetime 或 int64 纳秒时间戳
+        :param prices: array-like of float
+        :param vols: array-like of float
+            每笔成交的成交量，默认为 0
+        """
+        prices = np.asarray(prices, dtype=np.double)
+        if len(prices) == 0:
+            return
+        # 带时区的 DatetimeIndex 经过 np.asarray 会变成 UTC 时间，由 dt_to_i8 直接转换并检查时区
+        values = np.asarray(dts)
+        dts = values.astype(np.int64) if values.dtype.kind in "iu" else dt_to_i8(dts)
+        vols = np.zeros(len(prices)) if vols is None else np.asarray(vols, dtype=np.double)
+
+        # 按标的排序，同一标的内保持原有的时间顺序
+        codes, uniques = pd.factorize(np.asarray(symbols))
+        order = np.argsort(codes, kind="stable")
+        codes, dts, prices, vols = codes[order], dts[order], prices[order], vols[order]
+        uniques = list(uniques)
+        days = dts - dts % _ns_day
+        tods = dts - days
+
+        for freq in self.freqs:
+            ends = self._ends_arr[freq]
+            bar_ends = days + ends[np.minimum(np.searchsorted(ends, tods), len(ends) - 1)]
+
+            # 标的或K线结束时间变化的位置，把成交切成若干段，每段属于同一根K线
+            starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (bar_ends[1:] != bar_ends[:-1])])
+            lasts = np.r_[starts[1:] - 1, len(prices) - 1]
+            groups = zip(codes[starts].tolist(), bar_ends[starts].tolist(), prices[starts].tolist(),
+                         np.maximum.reduceat(prices, starts).tolist(), np.minimum.reduceat(prices, starts).tolist(),
+                         prices[lasts].tolist(), np.add.reduceat(vols, starts).tolist())
+
+            changed = None
+            for code, end, o, h, l, c, v in groups:
+                key = (uniques[code], freq)
+                if changed is not None and changed != key:
+                    self._emit(changed, self.bars[changed], False)
+                    changed = None
+                if self.__merge(key, end, o, h, l, c, v):
+                    changed = key
+            if changed is not None:
+                self._emit(changed, self.bars[changed], False)
+
+    def flush(self, now=None):
+        """把结束时间不晚于 now 的K线作为已完成K线推送，用于成交稀疏的标的在午休、收盘时及时完成最后一根K线
+        :param now: 当前时间，默认完成所有K线
+        """
+        t = None if now is None else _dt_i8(now)
+        for key, bar in self.bars.items():
+            if not bar[6] and (t is None or bar[0] <= t):
+                bar[6] = True
+                self._emit(key, bar, True)
@@ -0,0 +1,305 @@
+# coding: utf-8
+"""
+数组内核：把去除包含关系、分型识别、笔识别三个步骤改写成基于数组的循环，安装了 numba 时编译执行，
+否则按纯 Python 执行。只用于 reset_kline 的整体计算（KlineAnalyze(engine='array')），
+结果与逐个字典计算的参考实现完全一致，可以用 check_parity 核对。
+
+均线、MACD 一次遍历K线库中所有标的首尾相接的收盘价计算（按 offset、length 分段，段首重置状态），见 indicators
+"""
+
+import numpy as np
+import talib as ta
+
+from czsc.utils import has_gap_array
+
+try:
+    from numba import njit
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+def _as_input(*arrays):
+    """没有 numba 时内核按纯 Python 执行，转成 list 后逐个取值更快"""
+    return arrays if has_numba else tuple(a.tolist() for a in arrays)
+
+
+@njit(cache=True)
+def merge_inclusion(high, low, open_, close):
+    """去除包含关系，对应 KlineAnalyze._update_kline_new
+    :return: (src, high, low, open, close, merged)
+        src 为每根新K线取 dt 等字段的原始K线位置，merged 为是否发生过合并
+    """
+    n = len(high)
+    src = np.empty(n, np.int64)
+    h = np.empty(n)
+    l = np.empty(n)
+    o = np.empty(n)
+    c = np.empty(n)
+    merged = np.zeros(n, np.bool_)
+    m = 0
+    for i in range(n):
+        cur_h, cur_l = high[i], low[i]
+        if m >= 2:
+            last_h, last_l = h[m - 1], l[m - 1]
+            if (cur_h <= last_h and cur_l >= last_l) or (cur_h >= last_h and cur_l <= last_l):
+                if h[m - 1] > h[m - 2]:
+                    new_h, new_l = max(last_h, cur_h), max(last_l, cur_l)
+                else:
+                    new_h, new_l = min(last_h, cur_h), min(last_l, cur_l)
+                m -= 1
+                h[m], l[m] = new_h, new_l
+                # 保留红绿不变
+                if open_[i] >= close[i]:
+                    o[m], c[m] = new_h, new_l
+                else:
+                    o[m], c[m] = new_l, new_h
+                src[m] = i
+                merged[m] = True
+                m += 1
+                continue
+        h[m], l[m], o[m], c[m] = cur_h, cur_l, open_[i], close[i]
+        src[m] = i
+        merged[m] = False
+        m += 1
+    return src[:m], h[:m], l[:m], o[:m], c[:m], merged[:m]
+
+
+@njit(cache=True)
+def find_fx(high, low, gap):
+    """识别分型，对应 KlineAnalyze._update_fx_list
+    :param gap: 相邻K线之间是否有缺口，gap[i] 对应第 i 根与第 i + 1 根K线，见 utils.has_gap_array
+    :return: (pos, mark, fx_high, fx_low)
+        pos 为分型中间K线的位置，mark 为 1 顶分型、-1 底分型
+    """
+    n = len(high)
+    pos = np.empty(n, np.int64)
+    mark = np.empty(n, np.int8)
+    fx_high = np.empty(n)
+    fx_low = np.empty(n)
+    m = 0
+    for i in range(1, n - 1):
+        h1, h2, h3 = high[i - 1], high[i], high[i + 1]
+        l1, l2, l3 = low[i - 1], low[i], low[i + 1]
+        gap1, gap3 = gap[i - 1], gap[i]
+        if h1 < h2 > h3:
+            fl = l2
+            if not gap1:
+                fl = min(fl, l1)
+            if not gap3:
+                fl = min(fl, l3)
+            pos[m], mark[m], fx_high[m], fx_low[m] = i, 1, h2, fl
+            m += 1
+        elif l1 > l2 < l3:
+            fh = h2
+            if not gap1:
+                fh = max(fh, h1)
+            if not gap3:
+                fh = max(fh, h3)
+            pos[m], mark[m], fx_high[m], fx_low[m] = i, -1, fh, l2
+            m += 1
+    return pos[:m], mark[:m], fx_high[:m], fx_low[:m]
+
+
+@njit(cache=True)
+def build_bi(pos, mark, fx_high, fx_low, src, last_high, last_low):
+    """识别笔，对应 KlineAnalyze._update_bi_list
+    :param src: 新K线对应的K线位置，老笔为新K线自身的位置，新笔为原始K线的位置，用于判断两个分型之间是否有K线
+    :param last_high, last_low: 最后一根新K线的最高价、最低价，用于判断最后一个笔标记是否成立
+    :return: (index, removed)
+        index 为笔标记对应的分型序号，removed 为最后被判定无效而移除的分型序号，没有时为 -1
+    """
+    n = len(pos)
+    out = np.empty(n, np.int64)
+    if n < 2:
+        return out[:0], -1
+
+    out[0] = 0
+    m = 1
+    for j in range(1, n):
+        last = out[m - 1]
+        if mark[last] == mark[j]:
+            if (mark[j] == 1 and fx_high[last] < fx_high[j]) or (mark[j] == -1 and fx_low[last] > fx_low[j]):
+                out[m - 1] = j
+        else:
+            # 两个分型之间至少有一根K线
+            if src[pos[j] - 1] - src[pos[last] + 1] < 2:
+                continue
+            # 确保相邻两个顶底之间不存在包含关系
+            if (mark[last] == 1 and fx_low[j] < fx_low[last] and fx_high[j] < fx_high[last]) or \
+                    (mark[last] == -1 and fx_high[j] > fx_high[last] and fx_low[j] > fx_low[last]):
+                out[m] = j
+                m += 1
+
+    removed = -1
+    last = out[m - 1]
+    if (mark[last] == -1 and last_low < fx_low[last]) or (mark[last] == 1 and last_high > fx_high[last]):
+        removed = last
+        m -= 1
+    return out[:m], removed
+
+
+def ta_fields(ma_params):
+    """indicators 的结果列名"""
+    return ['ma%i' % p for p in ma_params] + ['diff', 'dea', 'macd']
+
+
+@njit(cache=True)
+def _ta_pass(close, offsets, lengths, periods, ma, diff, dea, macd):
+    """一次遍历首尾相接的收盘价，计算均线与 MACD(12, 26, 9)，每段开头重置状态，段与段之间互不影响。
+    按 TA-Lib 的 SMA、MACD 的计算顺序实现：均线为滑动求和；EMA 以前 period 根的简单平均为初值，
+    MACD 的快线与慢线对齐到第 26 根、信号线以第 26 至 34 根 diff 的平均为初值。
+    均线、diff 与 TA-Lib 逐位一致；TA-Lib 按 FMA 编译时信号线可能相差最后一位
+    :param ma: tuple of np.array，与 periods 一一对应
+    """
+    nan = np.nan
+    k_fast, k_slow, k_sig = 2.0 / 13, 2.0 / 27, 2.0 / 10
+    total = np.zeros(len(periods))
+    for s in range(len(offsets)):
+        o, n = offsets[s], lengths[s]
+        total[:] = 0.0
+        fast = slow = sig = 0.0
+        for t in range(n):
+            i = o + t
+            x = close[i]
+            for j in range(len(periods)):
+                p = periods[j]
+                total[j] += x
+                if t < p - 1:
+                    ma[j][i] = nan
+                else:
+                    ma[j][i] = total[j] / p
+                    total[j] -= close[i - p + 1]
+
+            if t < 14:
+                slow += x
+            elif t < 25:
+                slow += x
+                fast += x
+            elif t == 25:
+                slow = (slow + x) / 26
+                fast = (fast + x) / 12
+            else:
+                fast = ((x - fast) * k_fast) + fast
+                slow = ((x - slow) * k_slow) + slow
+            if t < 25:
+                diff[i] = dea[i] = macd[i] = nan
+                continue
+            d = fast - slow
+            if t < 33:
+                sig += d
+                diff[i] = dea[i] = macd[i] = nan
+                continue
+            if t == 33:
+                sig = (sig + d) / 9
+            else:
+                sig = ((d - sig) * k_sig) + sig
+            diff[i], dea[i], macd[i] = d, sig, d - sig
+
+
+def indicators(close, offsets=None, lengths=None, ma_params=(5, 34, 120), out=None):
+    """分段计算均线、MACD(12, 26, 9)，对应 KlineAnalyze._update_ta 的整体计算
+    :param close: np.array of double
+        收盘价，多个标的的K线首尾相接，比如 BarStore 的 close 列
+    :param offsets: list of int
+        各段的起始位置，默认整个数组为一段
+    :param lengths: list of int
+        各段的K线数量
+    :param ma_params: tuple of int
+        均线参数
+    :param out: dict of np.array
+        写入结果的数组，比如共享内存的视图，默认新建
+    :return: dict of np.array
+        ma{p}、diff、dea、macd，与 close 等长，不足计算窗口的位置为 nan
+    """
+    close = np.ascontiguousarray(close, dtype=np.double)
+    if offsets is None:
+        offsets, lengths = [0], [len(close)]
+    if out is None:
+        out = {k: np.empty(len(close)) for k in ta_fields(ma_params)}
+    if has_numba:
+        # 整个数组只遍历一次，段的边界在内核中重置，直接写入 out
+        ma = tuple(out['ma%i' % p] for p in ma_params) or (np.empty(0),)
+        _ta_pass(close, np.asarray(offsets, dtype=np.int64), np.asarray(lengths, dtype=np.int64),
+                 np.asarray(ma_params, dtype=np.int64), ma, out['diff'], out['dea'], out['macd'])
+        return out
+    # 没有 numba 时逐段调用 TA-Lib，纯 Python 逐根计算太慢
+    for o, n in zip(offsets, lengths):
+        x = close[o: o + n]
+        for p in ma_params:
+            out['ma%i' % p][o: o + n] = ta.SMA(x, p)
+        if n:
+            out['diff'][o: o + n], out['dea'][o: o + n], out['macd'][o: o + n] = ta.MACD(x, 12, 26, 9)
+    return out
+
+
+def build(kline_raw, bi_mode="new", min_gap=0.002):
+    """用数组内核从原始K线计算去除包含关系的K线、分型、笔
+    :param kline_raw: list of dict
+        按时间升序的原始K线，也可以是按列存放的序列
+    :param bi_mode: str
+        new 新笔；old 老笔
+    :param min_gap: float
+        判断缺口的阈值，见 analyze.has_gap
+    :return: (kline_new, fx_list, bi_list, bi_removed)
+        与 KlineAnalyze 中的同名序列格式相同，bi_removed 为最后被判定无效而移除的笔标记
+    """
+    if bi_mode not in ('new', 'old'):
+        raise ValueError
+    # 按列存放的原始K线（见 analyze._ColumnRows）直接取列，不生成 dict
+    by_column = hasattr(kline_raw, 'column')
+    columns = [np.array(kline_raw.column(k) if by_column else [x[k] for x in kline_raw], dtype=np.double)
+               for k in ('high', 'low', 'open', 'close')]
+    src, high, low, open_, close, merged = merge_inclusion(*_as_input(*columns))
+
+    if by_column:
+        # 按列取出新K线，价格直接用内核的结果（没有合并的K线与原始K线相同），一次生成所有 dict
+        prices = {"high": high, "low": low, "open": open_, "close": close}
+        keys = kline_raw.keys()
+        values = [(prices[k] if k in prices else kline_raw.column(k)[src]).tolist() for k in keys]
+        kline_new = [dict(zip(keys, v)) for v in zip(*values)]
+    else:
+        kline_new = [dict(kline_raw[i]) for i in src.tolist()]
+        for j in np.flatnonzero(merged).tolist():
+            kline_new[j].update({"high": float(high[j]), "low": float(low[j]),
+                                 "open": float(open_[j]), "close": float(close[j])})
+
+    gap = has_gap_array(high[:-1], low[:-1], high[1:], low[1:], min_gap)
+    pos, mark, fx_high, fx_low = find_fx(*_as_input(high, low, gap))
+    dts = [x['dt'] for x in kline_new]
+    fx_list = [{"dt": dts[i], "fx_mark": "g" if mk == 1 else "d", "fx": fh if mk == 1 else fl,
+                "start_dt": dts[i - 1], "end_dt": dts[i + 1], "fx_high": fh, "fx_low": fl}
+               for i, mk, fh, fl in zip(pos.tolist(), mark.tolist(), fx_high.tolist(), fx_low.tolist())]
+
+    if not kline_new:
+        return kline_new, fx_list, [], None
+    kn_pos = src if bi_mode == 'new' else np.arange(len(src))
+    index, removed = build_bi(*_as_input(pos, mark, fx_high, fx_low, kn_pos), high[-1], low[-1])
+
+    def __to_bi(j):
+        bi = dict(fx_list[j])
+        bi['bi'] = bi.pop('fx')
+        return bi
+
+    bi_list = [__to_bi(j) for j in index.tolist()]
+    return kline_new, fx_list, bi_list, __to_bi(removed) if removed >= 0 else None
+
+
+def check_parity(kline, freq="1m", **kwargs):
+    """分别用参考实现和数组内核计算同一组K线，返回结果不一致的序列名称，空列表表示完全一致
+    :param kline: list of dict
+        归一化后的K线
+    :param kwargs: 传给 KlineAnalyze 的其他参数，比如 bi_mode、zs_mode
+    :return: list of str
+    """
+    from czsc.analyze import KlineAnalyze
+
+    kas = [KlineAnalyze("parity", freq, engine=engine, **kwargs).reset_kline(None, kline, is_normalized=True)
+           for engine in ("python", "array")]
+    return [name for name in ("kline_new", "fx_list", "bi_list", "xd_list", "zs_list", "_bi_removed")
+            if getattr(kas[0], name) != getattr(kas[1], name)]
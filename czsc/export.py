@@ -0,0 +1,215 @@
+# coding: utf-8
+"""
+批量导出图表，支持 html 和静态图片（png/svg）。html 默认从 CDN 加载 echarts，
+离线可用需要指定本地 js 依赖目录（本包不附带这些文件），见 render_html
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from czsc.plot import _align_columns, _downsample_columns, _select_index
+from czsc.utils import dt_to_i8
+
+_script_pattern = re.compile(r'<script type="text/javascript" src="([^"]+)"></script>')
+_external_pattern = re.compile(r'<script[^>]*\ssrc=[^>]*>')
+
+
+@lru_cache(maxsize=8)
+def _read_js(js_file):
+    with open(js_file, encoding="utf-8") as f:
+        return f.read()
+
+
+def render_html(ka, path, js_dir=None, offline=False, **kwargs):
+    """把分析结果渲染成 html 文件
+    :param ka: KlineAnalyze
+        已经计算好的分析器，不会重新计算
+    :param path: str
+        输出文件路径
+    :param js_dir: str
+        本地 echarts.min.js 等依赖所在目录，指定后依赖内联到 html 中，离线可用；默认引用 CDN。
+        本包不附带这些 js 文件，需要自行下载
+    :param offline: bool
+        是否要求离线可用，为 True 时必须指定 js_dir，html 中不能留下外部 js 引用
+    :param kwargs: 传给 KlineAnalyze.to_grid 的参数，比如 with_xd、max_points
+    :return: str
+        输出文件路径
+    """
+    if offline and not js_dir:
+        raise ValueError("离线 html 需要指定 js_dir：本包不附带 echarts.min.js 等依赖，请下载到本地目录后传入")
+    html = ka.to_grid(**kwargs).render_embed()
+
+    if js_dir:
+        def __inline(m):
+            js_file = os.path.join(js_dir, os.path.basename(m.group(1)))
+            if not os.path.exists(js_file):
+                raise FileNotFoundError("本地 js 依赖不存在：{}".format(js_file))
+            return '<script type="text/javascript">{}</script>'.format(_read_js(js_file))
+        html = _script_pattern.sub(__inline, html)
+    if offline and _external_pattern.search(html):
+        raise ValueError("html 中仍有无法内联的外部 js 引用：{}".format(_external_pattern.search(html).group(0)))
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return path
+
+
+def render_image(ka, path, kline_mode="new", with_bi=True, with_xd=True, with_zs=True,
+                 max_points=None, figsize=(16, 9), dpi=100):
+    """用 matplotlib 把分析结果渲染成静态图片，适用于没有浏览器的服务器
+    :param ka: KlineAnalyze
+        已经计算好的分析器，不会重新计算
+    :param path: str
+        输出文件路径，根据后缀输出 png 或 svg
+    :param kline_mode: str
+        new 标准化后的K线，raw 原始K线
+    :param with_bi: 是否显示笔
+    :param with_xd: 是否显示线段
+    :param with_zs: 是否显示中枢
+    :param max_points: 绘制K线数量的预算，超出后按 to_grid 的规则降采样
+    :param figsize: 图片尺寸，单位英寸
+    :param dpi: 图片分辨率
+    :return: str
+        输出文件路径
+    """
+    try:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import PatchCollection
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Rectangle
+    except ImportError:
+        raise ImportError("静态图片导出依赖 matplotlib，请先安装：pip install matplotlib")
+
+    bg_color = "#1f212d"
+    up_color = "#F9293E"
+    down_color = "#00aa3b"
+
+    kline = list(ka.kline_new if kline_mode == 'new' else ka.kline_raw)
+    dts = dt_to_i8([x['dt'] for x in kline])
+    columns = {**_align_columns(dts, kline, ['open', 'close', 'low', 'high', 'vol']),
+               **_align_columns(dts, ka.macd, ['diff', 'dea', 'macd'])}
+    if max_points and len(kline) > max_points:
+        keep, _, _ = _select_index(ka, kline, dts, max_points, None, "minmax")
+    else:
+        keep = np.arange(len(kline))
+    columns = _downsample_columns(columns, keep)
+    dts = dts[keep]
+    x = np.arange(len(keep))
+
+    def __to_x(points):
+        """把标记点的时间映射到横坐标，时间落在两个保留点之间时归到后一个点"""
+        p_dts = dt_to_i8([p['dt'] for p in points])
+        return np.minimum(np.searchsorted(dts, p_dts), len(dts) - 1)
+
+    # 直接创建 Figure 并绑定 Agg 画布，不经过 pyplot，不改变全局后端，也不在 pyplot 中登记图表
+    fig = Figure(figsize=figsize, dpi=dpi, facecolor=bg_color)
+    FigureCanvasAgg(fig)
+    ax_k, ax_vol, ax_macd = fig.subplots(3, 1, sharex=True, gridspec_kw={"height_ratios": [6, 1, 1.5]})
+    for ax in (ax_k, ax_vol, ax_macd):
+        ax.set_facecolor(bg_color)
+        ax.tick_params(colors="#c7c7c7", labelsize=8)
+        ax.grid(color="#2f3240", linewidth=0.5)
+
+    # 柱子统一用 vlines 绘制，一个序列只生成一个 LineCollection
+    bar_width = max(figsize[0] * 72 * 0.6 / max(len(x), 1), 0.5)
+    is_up = columns['close'] >= columns['open']
+    colors = np.where(is_up, up_color, down_color)
+    ax_k.vlines(x, columns['low'], columns['high'], colors=colors, linewidth=0.6)
+    ax_k.vlines(x, np.fmin(columns['open'], columns['close']), np.fmax(columns['open'], columns['close']),
+                colors=colors, linewidth=bar_width)
+    ax_k.set_title("{} {}".format(ka.symbol, ka.freq), color=up_color, loc="left")
+
+    bi_list, xd_list = list(ka.bi_list), list(ka.xd_list)
+    if with_bi and bi_list:
+        ax_k.plot(__to_x(bi_list), [p['bi'] for p in bi_list], color="#39afe6", linewidth=1.0, marker="D", markersize=2)
+    if with_xd and xd_list:
+        ax_k.plot(__to_x(xd_list), [p['xd'] for p in xd_list], color="#da6ee8", linewidth=1.5, marker="^", markersize=3)
+    if with_zs:
+        areas = []
+        for _zs in ka.zs_list:
+            if _zs['zs_finished']:
+                end_point = _zs['end_point']
+            elif len(_zs['points']) >= 5:
+                end_point = _zs['points'][-1]
+            else:
+                continue
+            x0, x1 = __to_x([_zs['start_point'], end_point])
+            areas.append(Rectangle((x0, _zs['ZD']), x1 - x0, _zs['ZG'] - _zs['ZD']))
+        ax_k.add_collection(PatchCollection(areas, facecolor="#dcdcdc", alpha=0.15, edgecolor="#dcdcdc"))
+
+    ax_vol.vlines(x, 0, np.nan_to_num(columns['vol']), colors=colors, linewidth=bar_width)
+    macd = np.nan_to_num(columns['macd'])
+    ax_macd.vlines(x, 0, macd, colors=np.where(macd > 0, up_color, down_color), linewidth=bar_width)
+    ax_macd.plot(x, columns['diff'], color="#EDCB89", linewidth=0.8)
+    ax_macd.plot(x, columns['dea'], color="#FFFFFF", linewidth=0.8)
+
+    ticks = np.linspace(0, len(x) - 1, min(len(x), 8)).astype(int)
+    ax_macd.set_xticks(ticks)
+    ax_macd.set_xticklabels([pd.Timestamp(dts[i]).strftime("%Y-%m-%d %H:%M") for i in ticks])
+
+    fig.tight_layout()
+    fig.savefig(path, facecolor=bg_color)
+    return path
+
+
+def _export_one(args):
+    ka, path, fmt, js_dir, offline, kwargs = args
+    if fmt == "html":
+        return render_html(ka, path, js_dir=js_dir, offline=offline, **kwargs)
+    return render_image(ka, path, **kwargs)
+
+
+def batch_export(analyzers, out_dir, fmt="html", js_dir=None, offline=False, max_workers=None, verbose=False,
+                 **kwargs):
+    """多进程批量导出图表，直接使用分析器已有的计算结果
+    :param analyzers: list of KlineAnalyze
+        已经计算好的分析器
+    :param out_dir: str
+        输出目录，文件命名为 symbol_freq.fmt，比如 SH000001_1m.html
+    :param fmt: str
+        输出格式，可选值 html / png / svg
+    :param js_dir: str
+        html 格式下本地 js 依赖目录，见 render_html
+    :param offline: bool
+        html 格式下是否要求离线可用，见 render_html
+    :param max_workers: int
+        进程数，默认为 cpu 核数；为 1 时在当前进程中执行
+    :param verbose: bool
+        是否打印导出速度
+    :param kwargs: 传给 render_html 或 render_image 的参数
+    :return: dict
+        files 输出文件列表，count 数量，seconds 耗时，throughput 每秒导出的图表数
+    """
+    if fmt not in ("html", "png", "svg"):
+        raise ValueError("fmt 可选值为 html / png / svg")
+    if fmt == "html" and offline and not js_dir:
+        raise ValueError("离线 html 需要指定 js_dir：本包不附带 echarts.min.js 等依赖，请下载到本地目录后传入")
+
+    os.makedirs(out_dir, exist_ok=True)
+    # 分析器序列化后传给子进程，回调（比如 SignalJournal）不序列化，见 KlineAnalyze.__getstate__
+    tasks = [(ka, os.path.join(out_dir, "{}_{}.{}".format(ka.symbol, ka.freq, fmt)), fmt, js_dir, offline, kwargs)
+             for ka in analyzers]
+
+    start = time.time()
+    if max_workers == 1:
+        files = [_export_one(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            files = list(executor.map(_export_one, tasks))
+    seconds = time.time() - start
+
+    res = {
+        "files": files,
+        "count": len(files),
+        "seconds": seconds,
+        "throughput": len(files) / seconds if seconds > 0 else float("inf"),
+    }
+    if verbose:
+        print("导出 {} 个图表，耗时 {:.2f} 秒，{:.2f} 个/秒".format(res['count'], seconds, res['throughput']))
+    return res
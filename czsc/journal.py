@@ -0,0 +1,251 @@
+# coding: utf-8
+"""
+信号日志：把分析器产生的信号（三买、三卖、笔和线段的背驰）追加写入本地 SQLite 数据库（WAL 模式），重启后可以查询历史信号。
+分析器更新时只在内存中识别新信号并放入队列，由后台线程批量写入，add_kline 不等待磁盘 I/O
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from czsc.analyze import _bisect_dt
+
+_schema = """
+CREATE TABLE IF NOT EXISTS signals (
+    symbol TEXT NOT NULL,
+    freq TEXT NOT NULL,
+    dt INTEGER NOT NULL,        -- 信号时间，int64 纳秒时间戳
+    kind TEXT NOT NULL,         -- 信号类型，比如 buy3 / sell3 / bi_bei_chi / xd_bei_chi
+    price REAL,
+    created INTEGER NOT NULL,   -- 识别出信号的时间，int64 纳秒时间戳
+    info TEXT                   -- 其他信息，json
+);
+CREATE UNIQUE INDEX IF NOT EXISTS signals_key ON signals (symbol, freq, kind, dt);
+CREATE INDEX IF NOT EXISTS signals_dt ON signals (dt);
+CREATE INDEX IF NOT EXISTS signals_kind ON signals (kind, dt);
+"""
+
+_columns = ("symbol", "freq", "dt", "kind", "price", "created", "info")
+
+
+def _bei_chi(ka, points, mode, adjust):
+    """最后一段与前一个同向段相比是否背驰，见 KlineAnalyze.is_bei_chi"""
+    p0, p1, p2, p3 = points[-4:]
+    direction = "up" if p3['fx_mark'] == 'g' else "down"
+    zs1 = {"start_dt": p2['dt'], "end_dt": p3['dt'], "direction": direction}
+    zs2 = {"start_dt": p0['dt'], "end_dt": p1['dt'], "direction": direction}
+    # 只需要 p0 之后的 MACD
+    last_index = len(ka._macd) - _bisect_dt(ka._macd, p0['dt'])
+    return ka.is_bei_chi(zs1, zs2, mode=mode, adjust=adjust, last_index=last_index)
+
+
+def get_signals(ka, adjust=0.9, since=None, checked=None):
+    """分析器当前的信号，只使用各序列的尾部
+    :param ka: KlineAnalyze
+    :param adjust: float
+        判断背驰时的力度调整系数，见 KlineAnalyze.is_bei_chi
+    :param since: int
+        只返回这个时间之后的三买、三卖，默认全部
+    :param checked: dict
+        mode -> 上次判断背驰时的最后四个标记，标记没有变化时（对象相同，见 KlineAnalyze._view）不再重复判断；
+        判断之后更新
+    :return: list of (dt, kind, price, info)
+        dt 为 int64 纳秒时间戳
+    """
+    # 直接读取分析器内部的序列，时间为 int64 纳秒时间戳，见 KlineAnalyze._view
+    signals = []
+    # 中枢按时间排列，从最后一个往前找，三买、三卖的时间不晚于 since 时停止
+    for zs in reversed(ka._zs_list):
+        kind = 'buy3' if 'buy3' in zs else 'sell3' if 'sell3' in zs else None
+        if kind is None:
+            continue
+        if since is not None and zs[kind]['dt'] <= since:
+            break
+        signals.append((zs[kind]['dt'], kind, zs[kind]['xd'], {"ZG": zs['ZG'], "ZD": zs['ZD']}))
+    signals.reverse()
+
+    # 递归的高级别没有K线和 MACD，不判断背驰
+    if ka._macd:
+        for mode, points in (('bi', ka._bi_list), ('xd', ka._xd_list)):
+            if len(points) < 4:
+                continue
+            if checked is not None:
+                last = checked.get(mode)
+                if last is not None and all(a is b for a, b in zip(last, points[-4:])):
+                    continue
+                checked[mode] = points[-4:]
+            if _bei_chi(ka, points, mode, adjust):
+                signals.append((points[-1]['dt'], mode + "_bei_chi", points[-1][mode], {"fx_mark": points[-1]['fx_mark']}))
+    return signals
+
+
+class SignalJournal:
+    def __init__(self, path, adjust=0.9, batch_size=1000, flush_interval=1.0, max_queue=1000000):
+        """
+        :param path: str
+            SQLite 数据库文件
+        :param adjust: float
+            判断背驰时的力度调整系数
+        :param batch_size: int
+            每个事务最多写入的信号数量
+        :param flush_interval: float
+            队列中的信号最多等待多少秒写入
+        :param max_queue: int
+            队列长度上限，写入跟不上、队列已满时丢弃新的信号并计数（见 stats），不阻塞分析器
+        """
+        self.path = path
+        self.adjust = adjust
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._last = {}     # (symbol, freq, kind) -> 最后一个已记录的信号时间
+        self._checked = {}  # (symbol, freq) -> 上次判断背驰时的标记，见 get_signals
+        self._queue = queue.Queue(maxsize=max_queue)
+        # 记录信号的线程和写入线程都会更新计数，+= 不是原子操作，需要加锁
+        self._stats_lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "dropped": 0}
+
+        # 先在当前线程建表，写入线程启动时数据库已经可以查询
+        conn = self.__connect()
+        conn.executescript(_schema)
+        conn.close()
+        self._writer = threading.Thread(target=self.__write_loop, name="SignalJournal", daemon=True)
+        self._writer.start()
+
+    def __connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def register(self, ka):
+        """登记分析器，之后每次 reset_kline / add_kline 完成时自动记录新信号"""
+        if self.update not in ka.callbacks:
+            ka.callbacks.append(self.update)
+        self.update(ka)
+
+    def update(self, ka):
+        """记录分析器及其高级别、递归的高级别分析器的新信号，只放入队列，不等待写入"""
+        for _ka in [ka] + ka.ka_list + ka.rec_list:
+            since = min(self._last.get((_ka.symbol, _ka.freq, kind), -1) for kind in ('buy3', 'sell3'))
+            checked = self._checked.setdefault((_ka.symbol, _ka.freq), {})
+            for dt, kind, price, info in get_signals(_ka, self.adjust, since, checked):
+                key = (_ka.symbol, _ka.freq, kind)
+                if dt > self._last.get(key, -1):
+                    self._last[key] = dt
+                    self.record(_ka.symbol, _ka.freq, dt, kind, price, **info)
+
+    def record(self, symbol, freq, dt, kind, price=None, **info):
+        """记录一个信号，比如策略自定义的信号；同一 (symbol, freq, kind, dt) 只保留第一次记录
+        :param dt: datetime 或 int64 纳秒时间戳
+        :param info: 其他信息，需要可以转成 json
+        """
+        if not isinstance(dt, int):
+            dt = pd.Timestamp(dt).value
+        row = (symbol, freq, dt, kind, price, time.time_ns(), json.dumps(info) if info else None)
+        try:
+            self._queue.put_nowait(row)
+            self.__count('queued')
+        except queue.Full:
+            self.__count('dropped')
+
+    def __count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def __write_loop(self):
+        """后台写入：批次中第一个信号等待 flush_interval 秒，或者批次已满、flush、close 时，在一个事务中写入"""
+        conn = self.__connect()
+        batch, waiters, closing, deadline = [], [], False, None
+        while not closing:
+            timeout = self.flush_interval if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            # 队列中的 threading.Event 表示 flush，None 表示 close
+            if item is None:
+                closing = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item:
+                batch.append(item)
+                deadline = deadline or time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or waiters or closing or time.monotonic() >= deadline):
+                with conn:
+                    conn.executemany("INSERT OR IGNORE INTO signals VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                self.__count('written', len(batch))
+                batch, deadline = [], None
+            for event in waiters:
+                event.set()
+            waiters = []
+        conn.close()
+
+    def flush(self, timeout=None):
+        """等待已经记录的信号写入数据库
+        :return: bool
+            是否在 timeout 秒内完成
+        """
+        if not self._writer.is_alive():
+            return True
+        event = threading.Event()
+        self._queue.put(event)
+        return event.wait(timeout)
+
+    def close(self):
+        """写入剩余的信号并停止后台线程"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def query(self, symbol=None, freq=None, kind=None, start_dt=None, end_dt=None, limit=None):
+        """查询已经写入的信号，按信号时间升序；还在队列中的信号需要先 flush
+        :param symbol: str or list of str
+        :param freq: str or list of str
+        :param kind: str or list of str
+        :param start_dt: datetime
+            信号时间不早于 start_dt
+        :param end_dt: datetime
+            信号时间不晚于 end_dt
+        :param limit: int
+            最多返回最近的 limit 个信号
+        :return: pd.DataFrame
+            dt、created 为 pd.Timestamp，info 为 dict
+        """
+        where, params = [], []
+        for col, value in (("symbol", symbol), ("freq", freq), ("kind", kind)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            where.append("{} IN ({})".format(col, ", ".join("?" * len(values))))
+            params.extend(values)
+        if start_dt is not None:
+            where.append("dt >= ?")
+            params.append(pd.Timestamp(start_dt).value)
+        if end_dt is not None:
+            where.append("dt <= ?")
+            params.append(pd.Timestamp(end_dt).value)
+        sql = "SELECT {} FROM signals".format(", ".join(_columns))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY dt DESC, rowid DESC"
+        if limit is not None:
+            sql += " LIMIT {:d}".format(limit)
+
+        # 每次查询单独连接，WAL 模式下读取不影响后台写入
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        rows.reverse()
+        df = pd.DataFrame(rows, columns=list(_columns))
+        df['dt'] = pd.to_datetime(df['dt'])
+        df['created'] = pd.to_datetime(df['created'])
+        # 从查询结果直接解析，DataFrame 中缺失的 info 可能变成 NaN
+        df['info'] = [json.loads(row[-1]) if row[-1] else {} for row in rows]
+        return df
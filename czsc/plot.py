@@ -5,10 +5,190 @@
 
 from typing import List
 
+import numpy as np
+import pandas as pd
 from pyecharts import options as opts
 from pyecharts.charts import Bar, EffectScatter, Grid, HeatMap, Kline, Line
 from pyecharts.commons.utils import JsCode
 
+from czsc.utils import align_index, dt_to_i8
+
+
+def _lttb_indices(y, n_out):
+    """Largest-Triangle-Three-Buckets 降采样，返回需要保留的点的索引
+    :param y: np.array
+        待降采样的序列，比如收盘价
+    :param n_out: int
+        降采样后的点数
+    :return: np.array of int
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.double)
+    x = np.arange(n, dtype=np.double)
+    every = (n - 2) / (n_out - 2)
+    index = np.empty(n_out, dtype=np.int64)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        if end < nxt_end:
+            avg_x, avg_y = x[end:nxt_end].mean(), y[end:nxt_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return index
+
+
+def _minmax_indices(high, low, n_out):
+    """最高最低点降采样，每个桶保留最高价和最低价所在K线的索引
+    :param high: np.array
+    :param low: np.array
+    :param n_out: int
+        降采样后最多保留的点数，不少于 4
+    :return: np.array of int
+    """
+    n = len(high)
+    if n_out >= n:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, max((n_out - 2) // 2, 1) + 1).astype(np.int64)
+    index = [0, n - 1]
+    for s, e in zip(edges[:-1], edges[1:]):
+        if e <= s:
+            continue
+        index.append(s + int(np.argmax(high[s:e])))
+        index.append(s + int(np.argmin(low[s:e])))
+    return np.unique(index)
+
+
+def _rows_to_columns(rows, keys):
+    """把 list of dict 转成按列存放的 np.array，缺失值为 nan"""
+    return {key: np.array([x[key] if x and x.get(key) is not None else np.nan for x in rows], dtype=np.double)
+            for key in keys}
+
+
+def _align_columns(dts, rows, keys):
+    """按时间把 rows 对齐到 dts 上，输出按列存放的 np.array，对不上的位置为 nan
+    :param dts: np.array of int64
+        升序的时间序列
+    :param rows: list of dict
+        按 dt 升序的数据，比如K线、均线、MACD
+    :param keys: list of str
+        需要输出的列
+    :return: dict of np.array
+    """
+    columns = {key: np.full(len(dts), np.nan) for key in keys}
+    if not rows or len(dts) == 0:
+        return columns
+
+    pos, matched = align_index(dts, dt_to_i8([x['dt'] for x in rows]))
+    for key, arr in _rows_to_columns(rows, keys).items():
+        columns[key][pos[matched]] = arr[matched]
+    return columns
+
+
+def _vertex_groups(ka):
+    """各级别的笔端点、线段和中枢端点分组，返回 [(级别, 类型, 端点时间), ...]，类型为 bi 或 xd"""
+    groups = []
+    for _ka in [ka] + ka.ka_list:
+        xd_dts = [x['dt'] for x in _ka.xd_list]
+        for _zs in _ka.zs_list:
+            xd_dts.append(_zs['start_point']['dt'])
+            xd_dts.append(_zs['points'][-1]['dt'])
+            if _zs['end_point']:
+                xd_dts.append(_zs['end_point']['dt'])
+            for key in ('buy3', 'sell3'):
+                if key in _zs:
+                    xd_dts.append(_zs[key]['dt'])
+        groups.append((_ka.freq, 'bi', [x['dt'] for x in _ka.bi_list]))
+        groups.append((_ka.freq, 'xd', xd_dts))
+    return groups
+
+
+def _select_index(ka, kline, dts, max_points, window, downsample):
+    """选出需要绘制的K线索引：最近 window 根K线全部保留，之前的K线降采样到预算内。
+    窗口之前的笔、线段、中枢端点按组（级别、类型）从稀到密占用预算，放不下的组在窗口之前不绘制
+    :return: (保留的索引, 窗口开始的索引, {(级别, 类型): 开始绘制的时间})
+    """
+    if downsample not in ("minmax", "lttb"):
+        raise ValueError("downsample 可选值为 minmax 或 lttb")
+    n = len(kline)
+    window = min(n, max_points, window if window is not None else max_points // 2)
+    head = n - window
+    budget = max_points - window
+
+    vertex_index, hidden = np.arange(0), {}
+    groups = []
+    for freq, kind, vertex_dts in _vertex_groups(ka):
+        vertex_dts = dt_to_i8(vertex_dts)
+        index = np.minimum(np.searchsorted(dts, vertex_dts), n - 1)
+        index = index[(dts[index] == vertex_dts) & (index < head)]
+        groups.append((len(index), freq, kind, index))
+    for size, freq, kind, index in sorted(groups, key=lambda x: x[0]):
+        merged = np.union1d(vertex_index, index)
+        if len(merged) <= budget and not hidden:
+            vertex_index = merged
+        else:
+            hidden[(freq, kind)] = kline[head]['dt'] if head < n else pd.Timestamp.max
+
+    budget -= len(vertex_index)
+    if head <= budget:
+        overview = np.arange(head)
+    elif budget < 4:
+        overview = np.arange(0)
+    elif downsample == "minmax":
+        high = np.array([x['high'] for x in kline[:head]], dtype=np.double)
+        low = np.array([x['low'] for x in kline[:head]], dtype=np.double)
+        overview = _minmax_indices(high, low, budget)
+    else:
+        close = np.array([x['close'] for x in kline[:head]], dtype=np.double)
+        overview = _lttb_indices(close, budget)
+
+    keep = np.concatenate([np.union1d(overview, vertex_index), np.arange(head, n)])
+    return keep.astype(np.int64), head, hidden
+
+
+def _downsample_columns(columns, keep):
+    """按保留的索引合并K线：每个点代表 (上一个保留点, 当前保留点] 区间内的K线，
+    开盘价取区间内第一根，最高/最低价取区间极值，成交量累加，其余取区间内最后一根
+    """
+    starts = np.r_[0, keep[:-1] + 1]
+    valid = np.flatnonzero(~np.isnan(columns['close']))
+    if len(valid) == 0:
+        return {key: np.full(len(keep), np.nan) for key in columns}
+
+    first = valid[np.minimum(np.searchsorted(valid, starts), len(valid) - 1)]
+    last = valid[np.maximum(np.searchsorted(valid, keep, side='right') - 1, 0)]
+    ok = (first >= starts) & (first <= keep) & (last >= starts) & (last <= keep)
+
+    res = {}
+    for key, arr in columns.items():
+        if key == 'open':
+            v = arr[first]
+        elif key == 'high':
+            v = np.fmax.reduceat(arr, starts)
+        elif key == 'low':
+            v = np.fmin.reduceat(arr, starts)
+        elif key == 'vol':
+            v = np.add.reduceat(np.nan_to_num(arr), starts)
+        else:
+            v = arr[last]
+        res[key] = np.where(ok, v, np.nan)
+    return res
+
+
+def _to_list(arr, ndigits=None):
+    """np.array 转成图表数据，nan 转成 None"""
+    if ndigits is not None:
+        arr = np.round(arr, ndigits)
+    return [None if np.isnan(x) else float(x) for x in arr]
+
 
 def to_grid(ka,
               kline_mode: str = "new",
@@ -21,7 +201,10 @@ def to_grid(ka,
               with_macd: bool = False,
               title: str = "ChanLun In Practise",
               width: str = "1440px",
-              height: str = '900px') -> Grid:
+              height: str = '900px',
+              max_points: int = None,
+              window: int = None,
+              downsample: str = "minmax") -> Grid:
     """绘制缠中说禅K线分析结果
     :param kline: K线 new / raw，new标识标准化后的k线，raw标识原始k线
     :param with_bi: 是否显示笔识别结果，默认True，不输出False
@@ -34,6 +217,11 @@ def to_grid(ka,
     :param title: 图表标题
     :param width: 图表宽度
     :param height: 图表高度
+    :param max_points: 绘制K线数量的预算，默认None全部绘制；K线数量超出预算时，
+        最近 window 根K线按原始精度绘制，更早的K线降采样后用于缩略图；窗口之前的笔、线段、中枢端点
+        按级别从稀到密保留在预算内，放不下的只绘制窗口内的部分
+    :param window: 按原始精度绘制的最近K线数量，默认为 max_points 的一半；图表初始显示该区间
+    :param downsample: 降采样方式，minmax 每个区间保留最高最低点，lttb 按收盘价使用 LTTB 算法
     :return: 用Grid组合好的图表
     """
     
@@ -63,9 +251,6 @@ def to_grid(ka,
 
     axis_pointer_opts = opts.AxisPointerOpts(is_show=True, link=[{"xAxisIndex": "all"}])
 
-    dz_inside = opts.DataZoomOpts(False, "inside", xaxis_index=[0, 1, 2])
-    dz_slider = opts.DataZoomOpts(True, "slider", xaxis_index=[0, 1, 2], pos_top="96%", pos_bottom="0%")
-
     yaxis_opts = opts.AxisOpts(is_scale=True, axislabel_opts=opts.LabelOpts(color="#c7c7c7", font_size=8, position="inside"))
 
     grid0_xaxis_opts = opts.AxisOpts(type_="category", grid_index=0, axislabel_opts=label_not_show_opts,
@@ -84,59 +269,45 @@ def to_grid(ka,
 
     # 数据预处理
     # ------------------------------------------------------------------------------------------------------------------
-    kline = ka.kline_new if kline_mode == 'new' else ka.kline_raw
+    # 对外序列每次读取都重新转换（见 KlineAnalyze.kline_raw），多次使用的序列先转成 list
+    kline = list(ka.kline_new if kline_mode == 'new' else ka.kline_raw)
     dts = [x['dt'] for x in kline]
-    k_data = [[x['open'], x['close'], x['low'], x['high']] for x in kline]
+    dts_i8 = dt_to_i8(dts)
+    ma_keys = [x for x in ka.ma[0].keys() if "ma" in x] if ka.ma else []
 
     # seriesname
     aggregation = len(ka.ka_list)>0
-    # {'freq': {'kline', 'ma', 'vol', 'macd'}}
-    agg_dict = {}    
-    agg_dict[ka.freq] = {
-        "kline": k_data,
-        "ma": ka.ma,
-        "vol": kline,
-        "macd": ka.macd
-    }
-    if aggregation:
-        for high_ka in ka.ka_list:
-            agg_dict[high_ka.freq] = {}
-            _high_k_data = high_ka.kline_new if kline_mode == 'new' else high_ka.kline_raw
-            high_k_data = []
-            high_ma_data = []
-            high_vol_data = []
-            high_macd_data = []
-            for i in range(len(dts)):
-                high_k_data.append([])
-                high_ma_data.append({})
-                high_vol_data.append(None)
-                high_macd_data.append(None)
-            for ki in range(len(kline)):
-                k = kline[ki]  
-                _start = 0                              
-                for h_ki in range(_start, len(_high_k_data)):
-                    h_k = _high_k_data[h_ki]                    
-                    if (h_k['dt'] == k['dt']):                        
-                        high_k_data[ki] = [h_k['open'], h_k['close'], h_k['low'], h_k['high']]
-                        high_ma_data[ki] = high_ka.ma[h_ki]
-                        high_vol_data[ki] = h_k
-                        high_macd_data[ki] = high_ka.macd[h_ki]
-                        _start = h_ki+1
-                        break
-            agg_dict[high_ka.freq] = {
-                "kline": high_k_data,
-                "ma": high_ma_data,
-                "vol": high_vol_data,
-                "macd": high_macd_data
-            }
-            
+    # {'freq': {'open', 'close', 'low', 'high', 'vol', 'diff', 'dea', 'macd', 'ma*'}}
+    # 各级别的K线、均线、MACD按时间对齐到本级别K线上，高级别K线只出现在时间相同的位置
+    agg_dict = {}
+    for _ka in [ka] + ka.ka_list:
+        _kline = kline if _ka is ka else list(_ka.kline_new if kline_mode == 'new' else _ka.kline_raw)
+        agg_dict[_ka.freq] = {**_align_columns(dts_i8, _kline, ['open', 'close', 'low', 'high', 'vol']),
+                              **_align_columns(dts_i8, list(_ka.macd), ['diff', 'dea', 'macd']),
+                              **_align_columns(dts_i8, list(_ka.ma), ma_keys)}
+
+    # 降采样，K线数量超出预算时只保留窗口内的原始K线和窗口外的缩略K线
+    range_start, range_end = 20, 80
+    if max_points and len(kline) > max_points:
+        keep, head, hidden = _select_index(ka, kline, dts_i8, max_points, window, downsample)
+    else:
+        keep, head, hidden = np.arange(len(kline)), len(kline) - min(window or 0, len(kline)), {}
+    if head < len(kline):
+        range_start, range_end = 100 * np.searchsorted(keep, head) / max(len(keep), 1), 100
+    dts = [dts[i] for i in keep]
+    agg_dict = {k: _downsample_columns(v, keep) for k, v in agg_dict.items()}
+
+    dz_inside = opts.DataZoomOpts(False, "inside", xaxis_index=[0, 1, 2], range_start=range_start, range_end=range_end)
+    dz_slider = opts.DataZoomOpts(True, "slider", xaxis_index=[0, 1, 2], pos_top="96%", pos_bottom="0%",
+                                  range_start=range_start, range_end=range_end)
+
     # K 线主图
     # ------------------------------------------------------------------------------------------------------------------
     chart_k = Kline()
     chart_k.add_xaxis(xaxis_data=dts)
     for k, v in agg_dict.items():
-        chart_k.add_yaxis(series_name=k if aggregation else 'kline', y_axis=v['kline'], itemstyle_opts=k_style_opts)
-        is_selected = False
+        k_data = [[] if np.isnan(c) else [o, c, l, h] for o, c, l, h in zip(v['open'], v['close'], v['low'], v['high'])]
+        chart_k.add_yaxis(series_name=k if aggregation else 'kline', y_axis=k_data, itemstyle_opts=k_style_opts)
 
     chart_k.set_global_opts(
             legend_opts=legend_opts,
@@ -152,15 +323,14 @@ def to_grid(ka,
     if with_ma:
         # 均线图
         # ------------------------------------------------------------------------------------------------------------------
-        ma_keys = [x for x in agg_dict[ka.freq]['ma'][0].keys() if "ma" in x][:3]
         ma_colors = ["#39afe6", "#da6ee8", "#00940b"]
 
         chart_ma = Line()
         chart_ma.add_xaxis(xaxis_data=dts)
 
         for key, vals in agg_dict.items():
-            for i, k in enumerate(ma_keys):
-                y_data = [x[k] if k in x else None for x in v['ma']]
+            for i, k in enumerate(ma_keys[:3]):
+                y_data = _to_list(vals[k])
                 chart_ma.add_yaxis(series_name=key if aggregation else k.upper(), y_axis=y_data, is_smooth=True,
                                 is_selected=True, is_connect_nones=True, symbol_size=0, label_opts=label_not_show_opts,
                                 linestyle_opts=opts.LineStyleOpts(opacity=0.8, width=1.0, color=ma_colors[i]))
@@ -170,9 +340,15 @@ def to_grid(ka,
 
     # 缠论结果
     # ------------------------------------------------------------------------------------------------------------------
+    def __visible(_ka, kind, rows):
+        """降采样时放不下的笔、线段、中枢只绘制窗口内的部分"""
+        since = hidden.get((_ka.freq, kind))
+        return rows if since is None else [x for x in rows if x['dt'] >= since]
+
     def __draw_bi_line(_ka):
-        bi_dts = [x['dt'] for x in _ka.bi_list]
-        bi_val = [x['bi'] for x in _ka.bi_list]
+        bi_list = __visible(_ka, 'bi', _ka.bi_list)
+        bi_dts = [x['dt'] for x in bi_list]
+        bi_val = [x['bi'] for x in bi_list]
         chart_bi = Line()
         chart_bi.add_xaxis(bi_dts)
         chart_bi.add_yaxis(series_name=_ka.freq if aggregation else "BI", y_axis=bi_val, is_selected=True,
@@ -188,8 +364,9 @@ def to_grid(ka,
 
     def __draw_xd_line(_ka):
         
-        xd_dts = [x['dt'] for x in _ka.xd_list]
-        xd_val = [x['xd'] for x in _ka.xd_list]
+        xd_list = __visible(_ka, 'xd', _ka.xd_list)
+        xd_dts = [x['dt'] for x in xd_list]
+        xd_val = [x['xd'] for x in xd_list]
         chart_xd = Line()
         chart_xd.add_xaxis(xd_dts)
         chart_xd.add_yaxis(series_name=_ka.freq if aggregation else "XD", y_axis=xd_val, is_selected=True, symbol="triangle", symbol_size=10,)
@@ -203,47 +380,39 @@ def to_grid(ka,
             chark_k = chart_k.overlap(__draw_xd_line(_ka))
 
     def __draw_zs_area(_ka):
-        lines = []
-        scatters = []
+        """每个级别的中枢合并成一个序列，中枢区域放在同一个 markArea 中；三买、三卖各合并成一个散点序列"""
+        zs_x, zs_y, area_data = [], [], []
+        b3_dts, b3_val, s3_dts, s3_val = [], [], [], []
         for _zs in _ka.zs_list:
+            if not __visible(_ka, 'xd', [_zs['start_point']]):
+                continue
             x_start = _zs['start_point']['dt']
 
             if _zs['zs_finished']:# 中枢完成
                 x_end = _zs['end_point']['dt']
-
-                chart_b = EffectScatter()
-
                 if 'buy3' in _zs:
-                    chart_b.add_xaxis([_zs['buy3']['dt']])
-                    chart_b.add_yaxis(series_name=_ka.freq if aggregation else "B", y_axis=[_zs['buy3']['xd']], is_selected=False, symbol="circle", symbol_size=8,
-                                itemstyle_opts=opts.ItemStyleOpts(color="red",))
-                    chart_b.set_global_opts(xaxis_opts=grid0_xaxis_opts, legend_opts=legend_not_show_opts)
-                    scatters.append(chart_b)
+                    b3_dts.append(_zs['buy3']['dt'])
+                    b3_val.append(_zs['buy3']['xd'])
                 elif 'sell3' in _zs:
-                    chart_b.add_xaxis([_zs['sell3']['dt']])
-                    chart_b.add_yaxis(series_name=_ka.freq if aggregation else "S", y_axis=[_zs['sell3']['xd']], is_selected=False, symbol="circle", symbol_size=8,
-                                itemstyle_opts=opts.ItemStyleOpts(color="green",))
-                    chart_b.set_global_opts(xaxis_opts=grid0_xaxis_opts, legend_opts=legend_not_show_opts)
-                    scatters.append(chart_b)
+                    s3_dts.append(_zs['sell3']['dt'])
+                    s3_val.append(_zs['sell3']['xd'])
             elif len(_zs['points'])>=5:# 中枢成立但未完成，有3笔或段以上
                 x_end = _zs['points'][-1]['dt']
             else:                       # 中枢未完成，且未确定
                 continue
-            
+
             ZD = _zs['ZD']
             ZG = _zs['ZG']
-            area_data=[[ {'xAxis': x_start, 'yAxis': ZD, 'value': ZD }, {'xAxis': x_end, 'yAxis': ZG, 'value': ZG }]]
+            # 相邻中枢之间用 None 断开
+            zs_x.extend([x_start, x_end, x_end])
+            zs_y.extend([ZD, ZG, None])
+            area_data.append([{'xAxis': x_start, 'yAxis': ZD, 'value': ZD}, {'xAxis': x_end, 'yAxis': ZG, 'value': ZG}])
+
+        charts = []
+        if area_data:
             line = (Line()
-            .add_xaxis([x_start, x_end])
-            .add_yaxis(series_name=_ka.freq if aggregation else "ZS", y_axis=[ZD, ZG], symbol='none' 
-            """        
-            , markpoint_opts = opts.MarkPointOpts(
-                data=[
-                    opts.MarkPointItem(type_="max", name="ZG"),
-                    opts.MarkPointItem(type_="min", name="ZD"),
-                ]
-            )
-            """
+            .add_xaxis(zs_x)
+            .add_yaxis(series_name=_ka.freq if aggregation else "ZS", y_axis=zs_y, symbol='none'
             , markline_opts=opts.MarkLineOpts(
                 label_opts=opts.LabelOpts(
                     position="middle", color="blue", font_size=15,
@@ -256,19 +425,24 @@ def to_grid(ka,
             .set_series_opts(
                 markarea_opts=opts.MarkAreaOpts(data=area_data, itemstyle_opts=opts.ItemStyleOpts(color="#dcdcdc",opacity=0.1))
             ))
-            lines.append(line)
-        return lines, scatters
+            line.set_global_opts(xaxis_opts=grid0_xaxis_opts, legend_opts=legend_not_show_opts)
+            charts.append(line)
+
+        for bs_dts, bs_val, name, color in [(b3_dts, b3_val, "B", "red"), (s3_dts, s3_val, "S", "green")]:
+            if not bs_dts:
+                continue
+            chart_b = EffectScatter()
+            chart_b.add_xaxis(bs_dts)
+            chart_b.add_yaxis(series_name=_ka.freq if aggregation else name, y_axis=bs_val, is_selected=False, symbol="circle", symbol_size=8,
+                        itemstyle_opts=opts.ItemStyleOpts(color=color,))
+            chart_b.set_global_opts(xaxis_opts=grid0_xaxis_opts, legend_opts=legend_not_show_opts)
+            charts.append(chart_b)
+        return charts
 
     if with_zs:
-        _areas, _scatters = __draw_zs_area(ka)
-        for _ka in ka.ka_list:
-            _a, _s = __draw_zs_area(_ka)
-            _areas.extend(_a)
-            _scatters.extend(_s)
-        for _area in _areas:
-            chark_k = chart_k.overlap(_area)
-        for _scatter in _scatters:
-            chark_k = chart_k.overlap(_scatter)
+        for _ka in [ka] + ka.ka_list:
+            for _chart in __draw_zs_area(_ka):
+                chart_k = chart_k.overlap(_chart)
 
     # if with_vol:
     # 成交量图
@@ -276,14 +450,12 @@ def to_grid(ka,
     chart_vol = Bar()
     chart_vol.add_xaxis(dts)
     for k, v in agg_dict.items():
-        vol = []
-        for row in v['vol']:
-            if not row:
-                row = {'close': 0, 'open': 0, 'vol': 0}
-            item_style = red_item_style if row['close'] > row['open'] else green_item_style
-            bar = opts.BarItem(name=None, value=row['vol'], itemstyle_opts=item_style, label_opts=label_not_show_opts)
-            vol.append(bar)
-        chart_vol.add_yaxis(series_name=k if aggregation else "Volume", y_axis=vol, bar_width='60%')
+        # 成交量、MACD柱按涨跌拆成两个堆叠的序列，颜色在序列上设置，不必逐根设置样式
+        up = v['close'] > v['open']
+        for vol, item_style in [(np.where(up, v['vol'], np.nan), red_item_style),
+                                (np.where(up, np.nan, v['vol']), green_item_style)]:
+            chart_vol.add_yaxis(series_name=k if aggregation else "Volume", y_axis=_to_list(vol), bar_width='60%',
+                                stack=k, label_opts=label_not_show_opts, itemstyle_opts=item_style)
 
     chart_vol.set_global_opts(
             xaxis_opts=opts.AxisOpts(
@@ -302,15 +474,11 @@ def to_grid(ka,
     chart_macd.add_xaxis(dts)
     
     for k, v in agg_dict.items():
-        macd_bar = []
-        for row in v['macd']:
-            if not row:
-                row = {'macd': 0}
-            item_style = red_item_style if row['macd'] > 0 else green_item_style
-            bar = opts.BarItem(name=None, value=round(row['macd'], 4), itemstyle_opts=item_style, label_opts=label_not_show_opts)
-            macd_bar.append(bar)
-
-        chart_macd.add_yaxis(series_name=k if aggregation else "MACD", y_axis=macd_bar, bar_width='60%')
+        up = v['macd'] > 0
+        for macd, item_style in [(np.where(up, v['macd'], np.nan), red_item_style),
+                                 (np.where(up, np.nan, v['macd']), green_item_style)]:
+            chart_macd.add_yaxis(series_name=k if aggregation else "MACD", y_axis=_to_list(macd, 4), bar_width='60%',
+                                 stack=k, label_opts=label_not_show_opts, itemstyle_opts=item_style)
 
     chart_macd.set_global_opts(
             xaxis_opts=opts.AxisOpts(
@@ -333,9 +501,8 @@ def to_grid(ka,
     line = Line()
     line.add_xaxis(dts)
     for k, v in agg_dict.items():
-        macd = v['macd']
-        diff = [round(x['diff'], 4) if x else None for x in macd]
-        dea = [round(x['dea'], 4) if x else None for x in macd]        
+        diff = _to_list(v['diff'], 4)
+        dea = _to_list(v['dea'], 4)
         line.add_yaxis(series_name=k if aggregation else "DIFF", y_axis=diff, label_opts=label_not_show_opts, is_symbol_show=False
                     , is_connect_nones=True, linestyle_opts=opts.LineStyleOpts(opacity=0.8, width=1.0, color="#EDCB89"))
         line.add_yaxis(series_name=k if aggregation else "DEA", y_axis=dea, label_opts=label_not_show_opts, is_symbol_show=False
@@ -0,0 +1,174 @@
+# coding: utf-8
+"""
+分析器注册表：按 (symbol, freq) 管理大量分析器，常驻内存的分析器总量不超过预算，
+超出时把最久未使用的分析器写成磁盘快照并释放，再次访问时从快照恢复，只补算释放期间收到的K线
+"""
+
+import os
+import pickle
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+_seq_names = ('_kline_raw', '_kline_new', '_ma', '_macd', '_fx_list', '_bi_list', '_xd_list', '_zs_list')
+
+
+def estimate_size(ka):
+    """粗略估计分析器占用的内存（字节）：每个内部序列按最后一个元素的大小乘以长度计算，包含高级别、递归的高级别分析器；
+    不计按需生成的对外序列，它们不写入快照，恢复后重新生成"""
+    size = 0
+    for name in _seq_names:
+        seq = getattr(ka, name)
+        if seq:
+            item = seq[-1]
+            size += len(seq) * (sys.getsizeof(item) + sum(sys.getsizeof(v) for v in item.values()) + 8)
+    return size + sum(estimate_size(x) for x in ka.ka_list + ka.rec_list)
+
+
+def _version(ka):
+    return ka.snapshot.version if ka.snapshot is not None else None
+
+
+class AnalyzerRegistry:
+    def __init__(self, snapshot_dir, factory, max_bytes=512 * 1024 * 1024, fetch=None):
+        """
+        :param snapshot_dir: str
+            快照目录
+        :param factory: callable
+            factory(symbol, freq) -> KlineAnalyze，第一次访问、没有快照时用于创建分析器，一般在其中 reset_kline 载入历史K线
+        :param max_bytes: int
+            常驻内存的分析器总量预算（按 estimate_size 估计），至少保留最近使用的一个
+        :param fetch: callable
+            fetch(symbol, freq, end_dt) -> list of dict，可选，从快照恢复后获取 end_dt 之后的K线补算，
+            适用于K线不经过 update 输入的场景
+        """
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.snapshot_dir = snapshot_dir
+        self.factory = factory
+        self.max_bytes = max_bytes
+        self.fetch = fetch
+
+        self._resident = OrderedDict()      # (symbol, freq) -> KlineAnalyze，按最近使用排序
+        self._sizes = {}                    # (symbol, freq) -> 估计的内存占用
+        self._dirty = set()                 # 快照之后有变化的分析器
+        self._versions = {}                 # (symbol, freq) -> 磁盘上快照中分析器的快照版本，见 KlineAnalyze.snapshot
+        self._pending = {}                  # (symbol, freq) -> 释放期间收到的 [(K线, is_final)]
+        self._callbacks = {}                # (symbol, freq) -> 释放时暂存的 callbacks，不写入快照
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "rehydrations": 0, "evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.snapshot_dir, re.sub(r'[^\w.-]', '_', "{}_{}".format(*key)) + ".pkl")
+
+    @property
+    def memory(self):
+        """常驻分析器的估计内存占用（字节）"""
+        return sum(self._sizes.values())
+
+    def __len__(self):
+        return len(self._resident)
+
+    def __contains__(self, key):
+        return key in self._resident
+
+    def get(self, symbol, freq):
+        """获取分析器，不在内存中时从快照恢复（没有快照时用 factory 创建），并补算期间收到的K线；
+        调用方可以直接对返回的分析器 add_kline 等，释放时按快照版本判断是否需要重新写入
+        :return: KlineAnalyze
+        """
+        key = (symbol, freq)
+        with self._lock:
+            ka = self._resident.get(key)
+            if ka is not None:
+                self.stats['hits'] += 1
+                self._resident.move_to_end(key)
+                return ka
+
+            self.stats['misses'] += 1
+            ka = self.__load(key)
+            self._resident[key] = ka
+            self._sizes[key] = estimate_size(ka)
+            self.__evict()
+            return ka
+
+    def update(self, symbol, freq, k, is_final=None):
+        """输入一根K线，分析器在内存中时直接 add_kline，否则暂存，恢复时再补算
+        :param k: dict
+            K线，见 KlineAnalyze.add_kline
+        :param is_final: bool
+            K线是否已经完成，见 KlineAnalyze.add_kline
+        """
+        key = (symbol, freq)
+        with self._lock:
+            ka = self._resident.get(key)
+            if ka is None:
+                self._pending.setdefault(key, []).append((k, is_final))
+                return
+            ka.add_kline(k, is_final=is_final)
+            self._resident.move_to_end(key)
+            self._dirty.add(key)
+            self._sizes[key] = estimate_size(ka)
+            self.__evict()
+
+    def evict(self, symbol, freq):
+        """把分析器写成快照并从内存中释放"""
+        with self._lock:
+            self.__evict_one((symbol, freq))
+
+    def flush(self):
+        """把内存中有变化的分析器写成快照，不释放"""
+        with self._lock:
+            for key, ka in list(self._resident.items()):
+                if self.__changed(key, ka):
+                    self.__dump(key, ka)
+
+    def __evict(self):
+        while len(self._resident) > 1 and self.memory > self.max_bytes:
+            self.__evict_one(next(iter(self._resident)))
+
+    def __evict_one(self, key):
+        ka = self._resident.pop(key, None)
+        if ka is None:
+            return
+        self._sizes.pop(key)
+        if self.__changed(key, ka) or not os.path.exists(self._path(key)):
+            self.__dump(key, ka)
+        self._callbacks[key] = ka.callbacks
+        self.stats['evictions'] += 1
+
+    def __changed(self, key, ka):
+        """分析器在写入（或读取）快照之后是否有变化，包括调用方对 get 返回的分析器直接 add_kline"""
+        return key in self._dirty or _version(ka) != self._versions.get(key)
+
+    def __dump(self, key, ka):
+        # 写临时文件再替换，避免中途失败留下不完整的快照
+        # 回调不写入快照（见 KlineAnalyze.__getstate__），释放时暂存在 _callbacks 中
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(ka, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        self._dirty.discard(key)
+        self._versions[key] = _version(ka)
+
+    def __load(self, key):
+        pending = self._pending.pop(key, [])
+        path = self._path(key)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                ka = pickle.load(f)
+            self._versions[key] = _version(ka)
+            ka.callbacks = self._callbacks.pop(key, [])
+            self.stats['rehydrations'] += 1
+            # 释放期间收到的K线原样补算；没有时从外部获取快照之后的K线
+            if not pending and self.fetch is not None:
+                pending = [(k, None) for k in self.fetch(key[0], key[1], ka.end_dt)]
+        else:
+            ka = self.factory(*key)
+            # factory 载入的历史K线已经包含的部分不再重复输入
+            pending = [(k, is_final) for k, is_final in pending if k['dt'] > ka.end_dt]
+
+        if pending:
+            ka.add_klines([k for k, _ in pending], is_final=[is_final for _, is_final in pending])
+            self._dirty.add(key)
+        return ka
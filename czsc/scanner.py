@@ -0,0 +1,176 @@
+# coding: utf-8
+"""
+截面扫描器：保存每个标的、每个级别最新的结构摘要，用于在大量标的中快速筛选信号，
+比如“30分钟刚出现三买，同时日线处于向上线段”的标的
+"""
+
+import numpy as np
+import pandas as pd
+
+# 摘要字段及其默认值，时间字段为 int64 纳秒时间戳，0 表示不存在
+_fields = {
+    "symbol": "",
+    "freq": "",
+    "end_dt": 0,
+    "latest_price": np.nan,
+    "fx_mark": "",          # 最后一个分型，g / d
+    "bi_direction": "",     # 最后一笔的方向，up / down
+    "xd_direction": "",     # 最后一个线段的方向，up / down
+    "zs_zg": np.nan,        # 最后一个中枢的 ZG
+    "zs_zd": np.nan,        # 最后一个中枢的 ZD
+    "zs_finished": False,
+    "buy3": False,          # 最后一个中枢是否以三买结束
+    "buy3_dt": 0,
+    "sell3": False,         # 最后一个中枢是否以三卖结束
+    "sell3_dt": 0,
+    "bi_bei_chi": False,    # 最后一笔相对前一个同向笔是否背驰
+}
+
+
+def _tail_len(rows, dt):
+    """rows 按 dt 升序，返回 dt 之后（含）的元素个数"""
+    i = len(rows)
+    while i > 0 and rows[i - 1]['dt'] >= dt:
+        i -= 1
+    return len(rows) - i
+
+
+def _direction(points):
+    """最后一个标记点为顶，则最后一段向上；为底，则向下"""
+    if len(points) < 2:
+        return ""
+    return "up" if points[-1]['fx_mark'] == 'g' else "down"
+
+
+def get_summary(ka, adjust=0.9):
+    """计算分析器的结构摘要，只使用各序列的尾部，不遍历历史
+    :param ka: KlineAnalyze
+    :param adjust: float
+        判断背驰时的力度调整系数，见 KlineAnalyze.is_bei_chi
+    :return: dict
+    """
+    # 直接读取分析器内部的序列，时间为 int64 纳秒时间戳，见 KlineAnalyze._view
+    summary = dict(_fields)
+    summary.update({
+        "symbol": ka.symbol,
+        "freq": ka.freq,
+        "end_dt": ka._kline_raw[-1]['dt'] if ka._kline_raw else 0,
+        "latest_price": ka._kline_raw[-1]['close'] if ka._kline_raw else np.nan,
+        "fx_mark": ka._fx_list[-1]['fx_mark'] if ka._fx_list else "",
+        "bi_direction": _direction(ka._bi_list),
+        "xd_direction": _direction(ka._xd_list),
+    })
+
+    if ka._zs_list:
+        zs = ka._zs_list[-1]
+        summary.update({"zs_zg": zs['ZG'], "zs_zd": zs['ZD'], "zs_finished": zs['zs_finished']})
+        if 'buy3' in zs:
+            summary.update({"buy3": True, "buy3_dt": zs['buy3']['dt']})
+        if 'sell3' in zs:
+            summary.update({"sell3": True, "sell3_dt": zs['sell3']['dt']})
+
+    # 最后一笔与前一个同向笔比较力度
+    if len(ka._bi_list) >= 4:
+        p0, p1, p2, p3 = ka._bi_list[-4:]
+        direction = "up" if p3['fx_mark'] == 'g' else "down"
+        zs1 = {"start_dt": p2['dt'], "end_dt": p3['dt'], "direction": direction}
+        zs2 = {"start_dt": p0['dt'], "end_dt": p1['dt'], "direction": direction}
+        summary["bi_bei_chi"] = ka.is_bei_chi(zs1, zs2, mode="bi", adjust=adjust,
+                                              last_index=_tail_len(ka._macd, p0['dt']))
+    return summary
+
+
+class Scanner:
+    def __init__(self, capacity=1024, adjust=0.9):
+        """
+        :param capacity: int
+            初始容量，即 (symbol, freq) 的数量，不够时自动扩容
+        :param adjust: float
+            判断背驰时的力度调整系数
+        """
+        self.adjust = adjust
+        self._index = {}    # (symbol, freq) -> 行号
+        self._size = 0
+        self._data = {k: self.__empty(v, capacity) for k, v in _fields.items()}
+        self._df = None
+
+    @staticmethod
+    def __empty(default, capacity):
+        if isinstance(default, str):
+            return np.full(capacity, default, dtype=object)
+        return np.full(capacity, default, dtype=np.array(default).dtype)
+
+    def __row(self, symbol, freq):
+        key = (symbol, freq)
+        row = self._index.get(key)
+        if row is None:
+            row = self._size
+            capacity = len(self._data['symbol'])
+            if row >= capacity:
+                for k, v in _fields.items():
+                    self._data[k] = np.concatenate([self._data[k], self.__empty(v, capacity)])
+            self._index[key] = row
+            self._size += 1
+        return row
+
+    def register(self, ka):
+        """登记分析器，之后每次 reset_kline / add_kline 完成时自动更新摘要"""
+        if self.update not in ka.callbacks:
+            ka.callbacks.append(self.update)
+        self.update(ka)
+
+    def update(self, ka):
+        """更新分析器及其高级别分析器的摘要"""
+        for _ka in [ka] + ka.ka_list:
+            row = self.__row(_ka.symbol, _ka.freq)
+            for k, v in get_summary(_ka, self.adjust).items():
+                self._data[k][row] = v
+        self._df = None
+
+    def remove(self, symbol, freq=None):
+        """删除标的的摘要，freq 为 None 时删除所有级别"""
+        keys = [k for k in self._index if k[0] == symbol and (freq is None or k[1] == freq)]
+        if not keys:
+            return
+        drop = np.array([self._index.pop(k) for k in keys])
+        keep = np.setdiff1d(np.arange(self._size), drop)
+        for k in self._data:
+            self._data[k][:len(keep)] = self._data[k][keep]
+        self._index = {k: i for i, k in enumerate(zip(self._data['symbol'][:len(keep)], self._data['freq'][:len(keep)]))}
+        self._size = len(keep)
+        self._df = None
+
+    def to_df(self):
+        """摘要表，每行是一个 (symbol, freq)，时间字段转成 Timestamp"""
+        if self._df is None:
+            df = pd.DataFrame({k: v[:self._size] for k, v in self._data.items()})
+            for col in ("end_dt", "buy3_dt", "sell3_dt"):
+                # 直接按 int64 转换，经过浮点数会丢失纳秒精度
+                df[col] = pd.to_datetime(df[col].astype('int64')).where(df[col] > 0)
+            self._df = df
+        return self._df
+
+    def query(self, expr, freq=None, **local_dict):
+        """按条件筛选摘要表
+        :param expr: str
+            pandas 查询表达式，比如 "buy3 and latest_price > zs_zg"；变量用 @name 引用，通过 local_dict 传入
+        :param freq: str
+            只在某个级别中筛选
+        :return: pd.DataFrame
+        """
+        df = self.to_df()
+        if freq is not None:
+            df = df[df['freq'] == freq]
+        return df.query(expr, local_dict=local_dict)
+
+    def scan(self, conditions, **local_dict):
+        """多级别联合筛选，返回在所有级别上都满足条件的标的
+        :param conditions: dict
+            级别 -> 查询表达式，比如 {'30m': 'buy3 and buy3_dt >= @since', '1d': 'xd_direction == "up"'}
+        :return: list of str
+        """
+        symbols = None
+        for freq, expr in conditions.items():
+            selected = self.query(expr, freq=freq, **local_dict)['symbol']
+            symbols = selected if symbols is None else symbols[symbols.isin(selected)]
+        return [] if symbols is None else symbols.tolist()
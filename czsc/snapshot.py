@@ -0,0 +1,90 @@
+# coding: utf-8
+"""
+分析器的只读快照：每次更新完成后，分析器发布一个带版本号的快照（见 KlineAnalyze.snapshot），
+其他线程读取最新的快照不需要加锁，也不会读到更新到一半的序列。
+快照中的序列按固定大小分块存放在元组中，新版本与上一版本共享没有变化的块，发布的开销与变化的元素数量相当，而不是复制整个序列
+"""
+
+from collections import namedtuple
+from collections.abc import Sequence
+from itertools import chain, islice
+
+Snapshot = namedtuple("Snapshot", ["version", "symbol", "freq", "end_dt", "latest_price",
+                                   "fx_list", "bi_list", "xd_list", "zs_list", "ka_list", "rec_list"])
+Snapshot.__doc__ = """分析器某次更新完成后的只读状态
+    version 从 1 开始，每次发布加 1；fx_list、bi_list、xd_list、zs_list 为 FrozenList，
+    元素与对应的对外序列相同（时间为 pd.Timestamp），只读；ka_list、rec_list 为各高级别分析器的快照
+"""
+
+_chunk_size = 64
+
+
+class FrozenList(Sequence):
+    """只读序列，元素按 _chunk_size 分块存放在元组中，第一块从 start 开始"""
+
+    __slots__ = ('_chunks', '_start', '_len')
+
+    def __init__(self, chunks=(), start=0, length=0):
+        self._chunks = chunks
+        self._start = start
+        self._len = length
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._len))]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("FrozenList index out of range")
+        i += self._start
+        return self._chunks[i // _chunk_size][i % _chunk_size]
+
+    def __iter__(self):
+        return islice(chain.from_iterable(self._chunks), self._start, self._start + self._len)
+
+    def __eq__(self, other):
+        if isinstance(other, (FrozenList, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return "FrozenList({!r})".format(list(self))
+
+    def evolve(self, items):
+        """items 对应的新版本
+        items 与本版本相比只在尾部变化，或者从头部截断，变化的元素都是新对象（见 KlineAnalyze._view）；
+        按对象是否相同找到没有变化的部分，共享其所在的块，只重新分块变化的尾部
+        :param items: list
+        :return: FrozenList
+            没有变化时返回本版本
+        """
+        chunks, start, length = list(self._chunks), self._start, self._len
+        if length and items and self[0] is not items[0]:
+            first = items[0]
+            k = next((i for i, x in enumerate(self) if x is first), length)
+            start, length = start + k, length - k
+            del chunks[:start // _chunk_size]
+            start %= _chunk_size
+
+        n = min(length, len(items))
+        while n > 0 and chunks[(start + n - 1) // _chunk_size][(start + n - 1) % _chunk_size] is not items[n - 1]:
+            n -= 1
+        if n == length == len(items) and n == self._len:
+            return self
+        if n == 0:
+            chunks, start = [], 0
+
+        # 保留没有变化的整块，最后一块不完整时与变化的元素一起重新分块
+        end = start + n
+        keep = end // _chunk_size
+        tail = list(chunks[keep][:end % _chunk_size]) if end % _chunk_size else []
+        del chunks[keep:]
+        tail.extend(items[n:])
+        chunks.extend(tuple(tail[i: i + _chunk_size]) for i in range(0, len(tail), _chunk_size))
+        return FrozenList(tuple(chunks), start, len(items))
+
+
+empty = FrozenList()
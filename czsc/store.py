@@ -0,0 +1,264 @@
+# coding: utf-8
+"""
+全市场K线库：所有标的的K线按列存放在一块连续的共享内存（或内存映射文件）中，
+多进程分析时 worker 只需要接收 (symbol, offset, length)，直接读取共享内存，不再序列化K线。
+K线库保存不复权的原始价格，复权因子表单独保存，读取时按需复权，见 czsc.adjust。
+均线、MACD 可以在分析之前对所有标的一次算好，存放在另一块共享内存中，见 BarStore.compute_indicators
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from czsc import engine as _engine
+from czsc.adjust import adjust_columns, factor_table
+from czsc.utils import dt_to_i8
+
+# 列名及类型，dt 为 int64 纳秒时间戳
+_fields = (("dt", np.int64), ("open", np.double), ("close", np.double),
+           ("high", np.double), ("low", np.double), ("vol", np.double))
+
+
+def _open_buffer(nbytes, name, path, create):
+    """打开或新建一块共享内存（指定 path 时为内存映射文件）
+    :return: (shm, buf, name)
+    """
+    nbytes = max(nbytes, 1)
+    if path:
+        return None, np.memmap(path, dtype=np.uint8, mode="w+" if create else "r", shape=(nbytes,)), path
+    shm = shared_memory.SharedMemory(name=name, create=create, size=nbytes)
+    return shm, shm.buf, shm.name
+
+
+class BarStore:
+    def __init__(self, size, name=None, path=None, create=False):
+        """一般通过 BarStore.from_bars 创建，通过 BarStore.attach 在其他进程中打开
+        :param size: int
+            K线总数
+        :param name: str
+            共享内存名称
+        :param path: str
+            内存映射文件路径，指定后使用文件而不是共享内存
+        :param create: bool
+            是否新建
+        """
+        self.size = size
+        self.path = path
+        self.index = {}     # symbol -> (offset, length)
+        self.factors = {}   # symbol -> 复权因子表，见 czsc.adjust
+        self._shm, self._buf, self.name = _open_buffer(len(_fields) * size * 8, name, path, create)
+        self.columns = {f: np.ndarray((size,), dtype=t, buffer=self._buf, offset=i * size * 8)
+                        for i, (f, t) in enumerate(_fields)}
+
+        # 预先计算的指标，见 compute_indicators
+        self.ta_params = None   # (ma_params, adjust)
+        self.ta_columns = {}
+        self._ta_shm = self._ta_buf = self._ta_name = None
+
+    @classmethod
+    def from_bars(cls, bars, path=None):
+        """把多个标的的K线写入一块连续内存
+        :param bars: dict
+            symbol -> K线，可以是 list of dict 或 pd.DataFrame，包含 dt, open, close, high, low, vol
+        :param path: str
+            内存映射文件路径，默认使用共享内存
+        :return: BarStore
+        """
+        lengths = {symbol: len(kline) for symbol, kline in bars.items()}
+        store = cls(sum(lengths.values()), path=path, create=True)
+        offset = 0
+        for symbol, kline in bars.items():
+            if not isinstance(kline, pd.DataFrame):
+                kline = pd.DataFrame(kline)
+            n = lengths[symbol]
+            store.columns['dt'][offset: offset + n] = dt_to_i8(kline['dt'])
+            for f, _ in _fields[1:]:
+                store.columns[f][offset: offset + n] = kline[f].values
+            store.index[symbol] = (offset, n)
+            offset += n
+        return store
+
+    def set_factors(self, symbol, dts, factors):
+        """设置标的的复权因子表，替换原来的因子表；只在当前进程中生效，之后创建的 handle 会带上
+        :param dts: 因子生效时间
+        :param factors: 后复权因子，见 czsc.adjust
+        :return: tuple
+            原来的复权因子表，没有时为 None，可以用于 czsc.adjust.rescale_pre 缩放已经计算好的分析器
+        """
+        old = self.factors.get(symbol)
+        self.factors[symbol] = factor_table(dts, factors)
+        # 复权后计算的指标已经过时
+        if self.ta_params is not None and self.ta_params[1] is not None:
+            self.__drop_ta()
+        return old
+
+    def __open_ta(self, params, name, create):
+        fields = _engine.ta_fields(params[0])
+        path = self.path + ".ta" if self.path else None
+        self._ta_shm, self._ta_buf, self._ta_name = _open_buffer(len(fields) * self.size * 8, name, path, create)
+        self.ta_columns = {f: np.ndarray((self.size,), dtype=np.double, buffer=self._ta_buf, offset=i * self.size * 8)
+                           for i, f in enumerate(fields)}
+        self.ta_params = params
+
+    def __close_ta(self):
+        self.ta_columns = {}
+        self._ta_buf = None
+        if self._ta_shm is not None:
+            self._ta_shm.close()
+
+    def __unlink_ta(self):
+        if self._ta_shm is not None:
+            self._ta_shm.unlink()
+        elif self._ta_name and os.path.exists(self._ta_name):
+            os.remove(self._ta_name)
+
+    def __drop_ta(self):
+        self.__close_ta()
+        self.__unlink_ta()
+        self.ta_params = None
+        self._ta_shm = self._ta_name = None
+
+    def compute_indicators(self, ma_params=(5, 34, 120), adjust=None):
+        """一次计算所有标的的均线、MACD，结果按列存放在另一块共享内存（或 path + '.ta' 内存映射文件）中，
+        之后创建的 handle 会带上；reset_kline_from_store 的 ma_params、复权方式相同时直接读取，不再逐个标的计算。
+        只应由创建者调用，用不同的参数重新计算时替换原来的结果
+        :param ma_params: tuple of int
+            均线参数，与 KlineAnalyze 的 ma_params 相同
+        :param adjust: str
+            复权方式，见 to_bars
+        :return: self
+        """
+        params = (tuple(ma_params), adjust)
+        if params == self.ta_params:
+            return self
+        if self.ta_params is not None:
+            self.__drop_ta()
+
+        close = self.columns['close']
+        if adjust is not None and self.factors:
+            close = close.copy()
+            for symbol, (offset, length) in self.index.items():
+                if symbol in self.factors:
+                    view = adjust_columns(self.view(offset, length), self.factors[symbol], adjust)
+                    close[offset: offset + length] = view['close']
+        self.__open_ta(params, None, create=True)
+        segments = list(self.index.values())
+        _engine.indicators(close, [o for o, _ in segments], [n for _, n in segments], params[0], out=self.ta_columns)
+        return self
+
+    def ta_view(self, offset, length, ma_params, adjust=None):
+        """某个标的预先计算的指标，dict of np.array，均为共享内存的视图
+        :return: dict or None
+            没有用相同的 ma_params、复权方式计算过时为 None
+        """
+        if self.ta_params != (tuple(ma_params), adjust):
+            return None
+        return {f: v[offset: offset + length] for f, v in self.ta_columns.items()}
+
+    @property
+    def handle(self):
+        """在其他进程中打开K线库所需的参数，可以序列化"""
+        ta = None if self.ta_params is None else (self.ta_params, self._ta_name)
+        return self.size, self.name, self.path, self.factors, ta
+
+    @classmethod
+    def attach(cls, handle):
+        """在其他进程中打开K线库
+        :param handle: tuple
+            BarStore.handle
+        :return: BarStore
+        """
+        size, name, path, factors, ta = handle
+        store = cls(size, name=name, path=path, create=False)
+        store.factors = factors
+        if ta is not None:
+            store.__open_ta(ta[0], ta[1], create=False)
+        return store
+
+    def tasks(self, symbols=None):
+        """生成 worker 任务 (symbol, offset, length)"""
+        symbols = symbols or list(self.index.keys())
+        return [(symbol,) + self.index[symbol] for symbol in symbols]
+
+    def view(self, offset, length):
+        """某个标的的K线，dict of np.array，均为共享内存的视图，不复制"""
+        return {f: v[offset: offset + length] for f, v in self.columns.items()}
+
+    def to_bars(self, symbol, offset, length, i8=False, adjust=None):
+        """某个标的的K线，转成 KlineAnalyze 使用的 list of dict
+        :param i8: bool
+            dt 保留为 int64 纳秒时间戳，默认转成 pd.Timestamp
+        :param adjust: str
+            复权方式，None / pre / post，按 set_factors 设置的复权因子表计算
+        """
+        view = adjust_columns(self.view(offset, length), self.factors.get(symbol), adjust)
+        dts = view['dt'].tolist() if i8 else pd.to_datetime(view['dt'])
+        values = [view[f].tolist() for f, _ in _fields[1:]]
+        return [{"symbol": symbol, "dt": dt, "open": o, "close": c, "high": h, "low": l, "vol": v}
+                for dt, o, c, h, l, v in zip(dts, *values)]
+
+    def close(self):
+        """关闭当前进程中的映射"""
+        self.columns = {}
+        self._buf = None
+        if self._shm is not None:
+            self._shm.close()
+        self.__close_ta()
+
+    def unlink(self):
+        """删除共享内存或内存映射文件，只应由创建者调用"""
+        if self._shm is not None:
+            self._shm.unlink()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.__unlink_ta()
+
+
+_worker_store = None
+
+
+def _init_worker(handle):
+    global _worker_store
+    _worker_store = BarStore.attach(handle)
+
+
+def _analyze_one(args):
+    from czsc.analyze import KlineAnalyze
+    (symbol, offset, length), freq, freqs, func, adjust, kwargs = args
+    ka = KlineAnalyze(symbol, freq, **kwargs)
+    ka.reset_kline_from_store(_worker_store, offset, length, freqs=freqs, adjust=adjust)
+    return func(ka) if func else ka
+
+
+def analyze_universe(store, freq, func=None, symbols=None, freqs=None, max_workers=None, adjust=None, indicators=True,
+                     **kwargs):
+    """多进程分析K线库中的标的，worker 启动时打开一次K线库，之后每个任务只传 (symbol, offset, length)
+    :param store: BarStore
+    :param freq: str
+        K线级别，比如 1m
+    :param func: callable
+        在 worker 中对分析器执行的函数，返回值作为结果，必须可以序列化（模块级函数）；默认返回分析器本身
+    :param symbols: list of str
+        需要分析的标的，默认全部
+    :param freqs: list of str
+        聚合的高级别，见 KlineAnalyze.reset_kline
+    :param max_workers: int
+        进程数，默认为 cpu 核数
+    :param adjust: str
+        复权方式，见 BarStore.to_bars
+    :param indicators: bool
+        是否在启动 worker 之前一次算好所有标的的均线、MACD，见 BarStore.compute_indicators；结果保留在 store 中
+    :param kwargs: 传给 KlineAnalyze 的参数，比如 bi_mode、ma_params
+    :return: dict
+        symbol -> 结果
+    """
+    if indicators:
+        store.compute_indicators(kwargs.get("ma_params", (5, 34, 120)), adjust)
+    tasks = store.tasks(symbols)
+    args = [(task, freq, freqs, func, adjust, kwargs) for task in tasks]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(store.handle,)) as executor:
+        results = list(executor.map(_analyze_one, args))
+    return {task[0]: res for task, res in zip(tasks, results)}
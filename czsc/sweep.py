@@ -0,0 +1,198 @@
+# coding: utf-8
+"""
+参数扫描：同一组K线在多组参数下计算并比较结果。各步骤只依赖部分参数，按参数缓存各步骤的结果：
+去除包含关系只计算一次，分型按 min_gap、笔和线段按 (min_gap, bi_mode)、中枢按 (min_gap, bi_mode, zs_mode)、
+指标按 ma_params 各计算一次，分段力度按 (min_gap, bi_mode) 计算一次，adjust 只在最后比较力度时使用。
+总耗时取决于不同的步骤输入的数量，而不是参数组数
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from czsc.analyze import KlineAnalyze
+from czsc.utils import dt_to_i8
+
+# 可以扫描的参数及其默认值
+defaults = {
+    "min_gap": 0.002,
+    "bi_mode": "new",
+    "zs_mode": "xd",
+    "ma_params": (5, 34, 120),
+    "adjust": 0.9,
+}
+
+_seq_names = ('_kline_raw', '_kline_new', '_ma', '_macd', '_fx_list', '_bi_list', '_xd_list', '_zs_list')
+
+# 子进程中共享的步骤结果，见 _init_worker
+_shared = None
+
+
+def expand_grid(grid):
+    """把 {参数: 可选值列表} 展开成参数组列表
+    :param grid: dict
+        比如 {"bi_mode": ["new", "old"], "min_gap": [0.001, 0.002]}
+    :return: list of dict
+    """
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def _normalize(config):
+    unknown = set(config) - set(defaults)
+    if unknown:
+        raise ValueError("不支持扫描的参数：{}".format(sorted(unknown)))
+    config = dict(defaults, **config)
+    config['ma_params'] = tuple(config['ma_params'])
+    return config
+
+
+def _derive(ka, **params):
+    """以 ka 已经计算的步骤为起点，创建参数不同的分析器，继续计算之后的步骤
+    各序列复制列表、共享元素：计算时只替换元素，不修改元素，见 KlineAnalyze._view
+    """
+    kwargs = dict(bi_mode=ka.bi_mode, zs_mode=ka.zs_mode, ma_params=ka.ma_params, min_gap=ka.min_gap,
+                  max_xd_len=ka.max_xd_len)
+    kwargs.update(params)
+    new = KlineAnalyze(ka.symbol, ka.freq, **kwargs)
+    for name in _seq_names:
+        setattr(new, name, list(getattr(ka, name)))
+    new._bi_removed = ka._bi_removed
+    new.start_dt, new.end_dt, new.latest_price = ka.start_dt, ka.end_dt, ka.latest_price
+    return new
+
+
+def _bei_chi_count(macd_power, adjust):
+    """与前一个同向分段相比背驰的分段数量，与 KlineAnalyze.get_fd_bei_chi 的 bei_chi 列一致"""
+    return int((macd_power[2:] < macd_power[:-2] * adjust).sum())
+
+
+def _summary(ka, adjust, powers):
+    """每组参数的比较指标
+    :param powers: dict
+        分段类型 -> 各分段的 MACD 力度，见 KlineAnalyze.get_fd_bei_chi
+    """
+    return {
+        "fx_count": len(ka._fx_list),
+        "bi_count": len(ka._bi_list),
+        "xd_count": len(ka._xd_list),
+        "zs_count": len(ka._zs_list),
+        "buy3_count": sum('buy3' in zs for zs in ka._zs_list),
+        "sell3_count": sum('sell3' in zs for zs in ka._zs_list),
+        "bi_bei_chi": _bei_chi_count(powers['bi'], adjust),
+        "xd_bei_chi": _bei_chi_count(powers['xd'], adjust),
+    }
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+
+def _run_branch(args):
+    """计算一个 (min_gap, bi_mode) 分支：笔、线段各一次，中枢每个 zs_mode 一次，再组装该分支下的各组参数
+    :return: list of (参数组序号, 结果)
+    """
+    (min_gap, bi_mode), items, func = args
+    kn_dirty, macd, fx_stage, ma_stage = _shared
+    ka_fx, fx_dirty = fx_stage[min_gap]
+
+    ka_bi = _derive(ka_fx, bi_mode=bi_mode)
+    ka_bi._macd = macd
+    bi_dirty, bi_moved = ka_bi._update_bi_list(fx_dirty, kn_dirty)
+    xd_dirty = ka_bi._update_xd_list(bi_dirty, bi_moved)
+    # 分段力度与中枢、均线参数无关，adjust 只影响最后的比较
+    powers = {mode: ka_bi.get_fd_bei_chi(mode=mode)['macd_power'].values for mode in ('bi', 'xd')}
+
+    zs_stage = {}
+    rows = []
+    for i, config in items:
+        ka_zs = zs_stage.get(config['zs_mode'])
+        if ka_zs is None:
+            ka_zs = zs_stage[config['zs_mode']] = _derive(ka_bi, zs_mode=config['zs_mode'])
+            ka_zs._update_zs_list(xd_dirty if ka_zs.zs_mode == 'xd' else bi_dirty)
+
+        ka = _derive(ka_zs, ma_params=config['ma_params'])
+        ka._ma, ka._macd = list(ma_stage[config['ma_params']]), list(macd)
+        row = _summary(ka, config['adjust'], powers)
+        if func is not None:
+            row.update(func(ka, config))
+        rows.append((i, row))
+    return rows
+
+
+def sweep(kline, configs, symbol="sweep", freq="1m", func=None, max_workers=None):
+    """在多组参数下计算同一组K线，结果与每组参数分别 reset_kline 相同
+    去除包含关系、分型、指标在当前进程中按参数计算一次；笔、线段、中枢、分段力度按 (min_gap, bi_mode) 分支在多进程中计算
+    :param kline: list of dict or pd.DataFrame
+        归一化后的K线，见 KlineAnalyze.reset_kline
+    :param configs: list of dict or dict
+        参数组列表，或者 {参数: 可选值列表} 的网格（见 expand_grid）。
+        可以扫描的参数见 defaults：min_gap, bi_mode, zs_mode, ma_params 为 KlineAnalyze 的参数，
+        adjust 为判断背驰的力度调整系数，见 KlineAnalyze.get_fd_bei_chi；没有给出的参数使用默认值
+    :param symbol: str
+    :param freq: str
+    :param func: callable
+        func(ka, config) -> dict，对每组参数的分析器计算其他比较指标，作为结果中的列；
+        多进程时必须可以序列化（模块级函数）
+    :param max_workers: int
+        进程数，默认为 cpu 核数与分支数中较小的一个；为 1 时在当前进程中执行
+    :return: pd.DataFrame
+        每组参数一行，列为参数及比较指标；attrs['stage_runs'] 为各步骤的实际计算次数
+    """
+    if isinstance(configs, dict):
+        configs = expand_grid(configs)
+    configs = [_normalize(c) for c in configs]
+    if isinstance(kline, pd.DataFrame):
+        kline = kline.to_dict("records")
+
+    base = KlineAnalyze(symbol, freq)
+    dts = dt_to_i8([x['dt'] for x in kline]).tolist()
+    base._kline_raw = [dict(x, dt=dt) for x, dt in zip(kline, dts)]
+    base.start_dt = pd.Timestamp(base._kline_raw[0]['dt'])
+    base.end_dt = pd.Timestamp(base._kline_raw[-1]['dt'])
+    base.latest_price = base._kline_raw[-1]['close']
+    kn_dirty = base._update_kline_new()
+
+    fx_stage = {}
+    for min_gap in dict.fromkeys(c['min_gap'] for c in configs):
+        ka_fx = _derive(base, min_gap=min_gap)
+        fx_stage[min_gap] = (ka_fx, ka_fx._update_fx_list(kn_dirty))
+
+    # MACD 与均线参数无关，各组参数共用
+    ma_stage, macd = {}, []
+    for ma_params in dict.fromkeys(c['ma_params'] for c in configs):
+        ka_ta = _derive(base, ma_params=ma_params)
+        ka_ta._update_ta()
+        ma_stage[ma_params], macd = ka_ta._ma, ka_ta._macd
+
+    branches = {}
+    for i, config in enumerate(configs):
+        branches.setdefault((config['min_gap'], config['bi_mode']), []).append((i, config))
+    tasks = [(key, items, func) for key, items in branches.items()]
+
+    shared = (kn_dirty, macd, fx_stage, ma_stage)
+    max_workers = max(min(max_workers or os.cpu_count() or 1, len(tasks)), 1)
+    if max_workers == 1:
+        _init_worker(shared)
+        try:
+            results = [_run_branch(t) for t in tasks]
+        finally:
+            _init_worker(None)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(shared,)) as executor:
+            results = list(executor.map(_run_branch, tasks))
+
+    rows = dict(row for res in results for row in res)
+    df = pd.DataFrame([dict(config, **rows[i]) for i, config in enumerate(configs)])
+    df.attrs['stage_runs'] = {
+        "kline_new": 1,
+        "fx": len(fx_stage),
+        "bi": len(branches),
+        "xd": len(branches),
+        "zs": len({(c['min_gap'], c['bi_mode'], c['zs_mode']) for c in configs}),
+        "ta": len(ma_stage),
+    }
+    return df
@@ -3,26 +3,35 @@
 工具类，比如线数据归一化处理等
 """
 
+import re
+
+import numpy as np
 import pandas as pd
 
 ######################## compare method ###############################
+# 标量比较不走 numpy，容差与 np.isclose 的默认值一致：|a - b| <= atol + rtol * |b|
+_rtol = 1e-05
+_atol = 1e-08
+
+def is_close(a, b):
+    return a == b or abs(a - b) <= _atol + _rtol * abs(b)
 
 def float_less(a, b):
-    return a < b and not np.isclose(a, b)
+    return a < b and not is_close(a, b)
 
 def float_more(a, b):
-    return a > b and not np.isclose(a, b)
+    return a > b and not is_close(a, b)
 
 def float_less_equal(a, b):
-    return a < b or np.isclose(a, b)
+    return a < b or is_close(a, b)
 
 def float_more_equal(a, b):
-    return a > b or np.isclose(a, b)
+    return a > b or is_close(a, b)
 
 def is_in_range(a, b, n):
     """判断数字n是否在区间[a, b]内"""
     assert float_less(a, b)
-    return a < n < b3
+    return float_less_equal(a, n) and float_less_equal(n, b)
 
 def is_overlap(a, b):
     """
@@ -36,6 +45,63 @@ def is_overlap(a, b):
     """
     return max(a[0], b[0]) <= min(a[1], b[1])
 
+def is_in_range_array(a, b, n, tolerance=True):
+    """is_in_range 的向量版本，a, b, n 为数组或数字，按元素判断n是否在区间[a, b]内
+    :param tolerance: bool
+        True 时端点按 float_less_equal 的容差比较，与 is_in_range 一致；False 时按闭区间精确比较
+    """
+    a, b, n = np.asarray(a), np.asarray(b), np.asarray(n)
+    if not tolerance:
+        return (a <= n) & (n <= b)
+    return ((a < n) | np.isclose(a, n, _rtol, _atol)) & ((n < b) | np.isclose(n, b, _rtol, _atol))
+
+def is_overlap_array(a_low, a_high, b_low, b_high, closed=True):
+    """is_overlap 的向量版本，按元素判断区间[a_low, a_high]与[b_low, b_high]是否重叠
+    :param closed: bool
+        True 时端点相接也算重叠，与 is_overlap 一致；False 时要求重叠部分的长度大于 0
+    """
+    low, high = np.maximum(a_low, b_low), np.minimum(a_high, b_high)
+    return low <= high if closed else low < high
+
+def has_gap_array(high1, low1, high2, low2, min_gap=0.002):
+    """analyze.has_gap 的向量版本，按元素判断前后两根K线之间是否有缺口
+    参数
+    :param high1, low1 前一根K线的最高价、最低价
+    :param high2, low2 后一根K线的最高价、最低价
+    """
+    high1, low1, high2, low2 = map(np.asarray, (high1, low1, high2, low2))
+    return (high1 < low2 * (1 - min_gap)) | (high2 < low1 * (1 - min_gap))
+
+######################## time method ###############################
+
+def dt_to_i8(dts):
+    """时间序列转成 int64 纳秒时间戳；不接受带时区的时间，见 check_naive"""
+    index = pd.DatetimeIndex(dts)
+    check_naive(index)
+    return index.values.astype('datetime64[ns]').view(np.int64)
+
+def check_naive(dt):
+    """分析器内部的时间是不带时区的本地时间（见 analyze 中的 _dt_i8），带时区的时间转换后会变成 UTC，
+    各级别聚合、查询和对外序列的时间都会错位，直接报错
+    参数
+    :param dt pd.Timestamp 或 pd.DatetimeIndex
+    """
+    if dt.tz is not None:
+        raise ValueError("不支持带时区的时间（{}），请先转换为本地时间，比如 dt.tz_localize(None)".format(dt.tz))
+
+def align_index(dts, target_dts):
+    """在升序的时间戳序列中查找目标时间戳的位置
+    参数
+    :param dts np.array of int64，升序
+    :param target_dts np.array of int64
+    返回
+    (位置, 是否找到)，位置只在找到时有效
+    """
+    pos = np.searchsorted(dts, target_dts)
+    matched = pos < len(dts)
+    matched[matched] = dts[pos[matched]] == target_dts[matched]
+    return pos, matched
+
 def __symbol_2_jq(symbol):
     """
     将标的代码格式化成聚宽代码格式，目前只支持A股
@@ -82,7 +148,7 @@ def __bars_from_jq(symbol, df_klines):
     df_klines.loc[:, "dt"] = pd.to_datetime(df_klines['dt'])
     return df_klines
 
-def __bars_from_ts(self, symbol, df_klines):
+def __bars_from_ts(symbol, df_klines):
     """
     将tushare的pro_bar数据归一化成本程序标准
     参数
@@ -155,22 +221,15 @@ def get_kbars(kline_raw, cur_freq, nxt_freq):
         raise ValueError
     interval = (int)(nxt_freq_val / cur_freq_val)
 
+    # 每 interval 根合并成一根，不修改输入的K线；dt 等其他字段取最后一根
     kbars_new = []
-    start_index=0
-    for index in range(interval, len(kline_raw), interval):
-        cur_index = index - 1
-        kline = kline_raw[cur_index]
-        kline['high'] = max([x['high'] for x in kline_raw[start_index:cur_index]])
-        kline['low'] = min([x['low'] for x in kline_raw[start_index:cur_index]])
-        kline['vol'] = sum([x['vol'] for x in kline_raw[start_index:cur_index]])
-        kbars_new.append(kline)
-        start_index=index
-    
-    if start_index < len(kline_raw):
-        kline = kline_raw[-1]
-        kline['high'] = max([x['high'] for x in kline_raw[start_index:len(kline_raw)]])
-        kline['low'] = min([x['low'] for x in kline_raw[start_index:len(kline_raw)]])
-        kline['vol'] = sum([x['vol'] for x in kline_raw[start_index:len(kline_raw)]])
+    for start_index in range(0, len(kline_raw), interval):
+        bars = kline_raw[start_index: start_index + interval]
+        kline = dict(bars[-1])
+        kline['open'] = bars[0]['open']
+        kline['high'] = max([x['high'] for x in bars])
+        kline['low'] = min([x['low'] for x in bars])
+        kline['vol'] = sum([x['vol'] for x in bars])
         kbars_new.append(kline)
     # print('kbars new：{}'.format(kbars_new))
     return kbars_new
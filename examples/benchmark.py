@@ -0,0 +1,114 @@
+# coding: utf-8
+"""
+分析器性能基准：用随机游走生成的1分钟K线，分别计时 reset_kline（参考实现与数组内核）、数组内核的
+去除包含关系 + 分型 + 笔（engine.build）、逐根 add_kline、批量 add_klines、常用查询
+以及 utils 中的比较函数（标量版本逐个调用与数组版本）
+
+    python examples/benchmark.py [K线数量]
+"""
+import gc
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from czsc import KlineAnalyze, engine
+from czsc.analyze import has_gap
+from czsc.utils import (float_less, float_less_equal, has_gap_array, is_in_range, is_in_range_array, is_overlap,
+                        is_overlap_array)
+
+
+def random_bars(n, seed=1, symbol="SH600000"):
+    rng = np.random.default_rng(seed)
+    close = np.round(np.abs(10 + np.cumsum(rng.normal(0, 0.05, n))) + 1, 2)
+    open_ = np.round(np.r_[close[0], close[:-1]] + rng.normal(0, 0.01, n), 2)
+    high = np.round(np.maximum(open_, close) + np.abs(rng.normal(0, 0.03, n)), 2)
+    low = np.round(np.minimum(open_, close) - np.abs(rng.normal(0, 0.03, n)), 2)
+    vol = rng.integers(1000, 100000, n).astype(float)
+    dts = pd.date_range("2020-01-02 09:31", periods=n, freq="1min")
+    return [{"symbol": symbol, "dt": dt, "open": o, "close": c, "high": h, "low": l, "vol": v}
+            for dt, o, c, h, l, v in zip(dts, open_.tolist(), close.tolist(), high.tolist(), low.tolist(), vol.tolist())]
+
+
+def timeit(func, repeat=3):
+    """多次执行取最短耗时，每次执行前回收上一次的对象"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def bench_utils(bars):
+    """utils 中的比较函数：标量版本逐个调用，数组版本一次计算相邻K线之间的缺口、区间重叠和收盘价是否在前一根K线的区间内"""
+    high = np.array([x['high'] for x in bars])
+    low = np.array([x['low'] for x in bars])
+    close = [x['close'] for x in bars]
+    n = len(bars) - 1
+    results = {}
+    results["float_less x%i" % n] = timeit(lambda: [float_less(a, b) for a, b in zip(close[:-1], close[1:])])
+    results["float_less_equal x%i" % n] = timeit(
+        lambda: [float_less_equal(a, b) for a, b in zip(close[:-1], close[1:])])
+    results["has_gap x%i" % n] = timeit(lambda: [has_gap(k1, k2) for k1, k2 in zip(bars[:-1], bars[1:])])
+    results["has_gap_array x%i" % n] = timeit(lambda: has_gap_array(high[:-1], low[:-1], high[1:], low[1:]))
+    results["is_overlap x%i" % n] = timeit(
+        lambda: [is_overlap(a, b) for a, b in zip(zip(low[:-1].tolist(), high[:-1].tolist()),
+                                                   zip(low[1:].tolist(), high[1:].tolist()))])
+    results["is_overlap_array x%i" % n] = timeit(lambda: is_overlap_array(low[:-1], high[:-1], low[1:], high[1:]))
+    results["is_in_range x%i" % n] = timeit(
+        lambda: [is_in_range(a, b, c) for a, b, c in zip(low[:-1].tolist(), high[:-1].tolist(), close[1:])
+                 if a < b])
+    results["is_in_range_array x%i" % n] = timeit(lambda: is_in_range_array(low[:-1], high[:-1], close[1:]))
+    return results
+
+
+def main(n=50000):
+    bars = random_bars(n)
+    split = n - min(n // 10, 5000)
+    results = {}
+
+    results["reset_kline"] = timeit(lambda: KlineAnalyze("SH600000", "1m", max_xd_len=10 ** 9).reset_kline(
+        None, bars, is_normalized=True))
+    results["reset_kline array"] = timeit(lambda: KlineAnalyze(
+        "SH600000", "1m", max_xd_len=10 ** 9, engine="array").reset_kline(None, bars, is_normalized=True))
+    results["engine.build"] = timeit(lambda: engine.build(bars))
+
+    def __add():
+        ka = KlineAnalyze("SH600000", "1m", max_xd_len=10 ** 9).reset_kline(None, bars[:split], is_normalized=True)
+        gc.collect()
+        start = time.perf_counter()
+        for k in bars[split:]:
+            ka.add_kline(k)
+        return time.perf_counter() - start
+    results["add_kline x%i" % (n - split)] = min(__add() for _ in range(3))
+
+    def __add_bulk():
+        ka = KlineAnalyze("SH600000", "1m", max_xd_len=10 ** 9).reset_kline(None, bars[:split], is_normalized=True)
+        gc.collect()
+        start = time.perf_counter()
+        ka.add_klines(bars[split:])
+        return time.perf_counter() - start
+    results["add_klines x%i" % (n - split)] = min(__add_bulk() for _ in range(3))
+
+    ka = KlineAnalyze("SH600000", "1m", max_xd_len=10 ** 9).reset_kline(None, bars, is_normalized=True)
+    bi = ka.bi_list
+
+    def __query():
+        for i in range(5, len(bi) - 1, max(len(bi) // 200, 1)):
+            ka.get_sub_section(bi[i - 5]['dt'], bi[i]['dt'], mode="kn", is_last=False)
+            ka.calculate_macd_power(bi[i - 1]['dt'], bi[i]['dt'])
+            ka.is_bei_chi({"start_dt": bi[i - 1]['dt'], "end_dt": bi[i]['dt'], "direction": "up"},
+                          {"start_dt": bi[i - 3]['dt'], "end_dt": bi[i - 2]['dt'], "direction": "up"})
+    results["queries"] = timeit(__query)
+    results.update(bench_utils(bars))
+
+    for name, cost in results.items():
+        print("{:<24}{:>12.6f}s".format(name, cost))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
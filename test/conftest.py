@@ -0,0 +1,8 @@
+# coding: utf-8
+import os
+import sys
+
+# 测试直接使用源码目录中的 czsc，随机K线见 examples/benchmark.py
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_root, "examples"))
+sys.path.insert(0, _root)
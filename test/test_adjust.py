@@ -0,0 +1,89 @@
+# coding: utf-8
+"""复权：按因子表计算价格；已经计算好的分析器按比例缩放，与用缩放后的K线重新计算的结果相同"""
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import random_bars
+from czsc import BarStore, KlineAnalyze, rescale_pre
+from czsc.adjust import adjust_columns, factor_table
+
+_names = ('_kline_raw', '_kline_new', '_fx_list', '_bi_list', '_xd_list', '_zs_list', '_bi_removed')
+
+
+def _close(a, b):
+    """嵌套的 dict、list 逐个比较，浮点数允许缩放带来的舍入误差"""
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(_close(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) or hasattr(a, 'peek'):
+        return len(a) == len(b) and all(_close(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float):
+        return (math.isnan(a) and math.isnan(b)) or abs(a - b) <= 1e-9 * max(1, abs(a))
+    return a == b
+
+
+def _reset(bars, **kwargs):
+    return KlineAnalyze("A", "1m", max_xd_len=10 ** 9, **kwargs).reset_kline(None, bars, is_normalized=True,
+                                                                             freqs=["5m"])
+
+
+def test_adjust_columns():
+    """前复权以最新因子为基准，最新的K线价格不变；后复权为原始价格乘以因子"""
+    dts = pd.date_range("2020-01-01", periods=6, freq="D")
+    columns = {"dt": dts.values.astype("datetime64[ns]").view(np.int64), "close": np.arange(1.0, 7.0),
+               "open": np.ones(6), "high": np.ones(6), "low": np.ones(6), "vol": np.ones(6)}
+    table = factor_table([dts[4], dts[2]], [1.5, 1.2])
+    assert np.allclose(adjust_columns(columns, table, "post")['close'], columns['close'] * [1, 1, 1.2, 1.2, 1.5, 1.5])
+    assert np.allclose(adjust_columns(columns, table, "pre")['close'],
+                       columns['close'] * np.array([1, 1, 1.2, 1.2, 1.5, 1.5]) / 1.5)
+    assert adjust_columns(columns, None, "pre") is columns and adjust_columns(columns, table, None) is columns
+    assert adjust_columns(columns, table, "pre")['vol'] is columns['vol']
+    with pytest.raises(ValueError):
+        adjust_columns(columns, table, "back")
+    with pytest.raises(ValueError):
+        factor_table([dts[0]], [0.0])
+
+
+@pytest.mark.parametrize("bi_mode", ["new", "old"])
+@pytest.mark.parametrize("cut", [None, 2500, 4990])
+def test_rescale(bi_mode, cut):
+    """全部缩放时各序列（包括指标、高级别）与重新计算相同；部分缩放时之后的结构回退重新计算"""
+    bars = random_bars(5000, seed=2)
+    r = 0.9137
+    n = len(bars) if cut is None else cut
+    scaled = [dict(x, **{k: x[k] * r for k in ('open', 'close', 'high', 'low')}) if i < n else x
+              for i, x in enumerate(bars)]
+    ka = _reset(bars, bi_mode=bi_mode).rescale(r, None if cut is None else bars[cut]['dt'])
+    ref = _reset(scaled, bi_mode=bi_mode)
+    names = _names + (('_ma', '_macd') if cut is None else ())
+    assert [x for x in names if not _close(getattr(ka, x), getattr(ref, x))] == []
+    assert _close(ka.ka_list[0]._kline_raw, ref.ka_list[0]._kline_raw)
+    assert ka.bi_list[-1]['bi'] == ka._bi_list[-1]['bi']
+    with pytest.raises(ValueError):
+        ka.rescale(0)
+
+
+def test_rescale_pre():
+    """新的除权除息在已有K线之后、修正已有K线之间的因子，缩放之后与按新因子表前复权重新计算的结构相同"""
+    bars = random_bars(6000, seed=7)
+    store = BarStore.from_bars({"A": bars})
+    try:
+        offset, length = store.index["A"]
+        dts = [bars[1000]['dt'], bars[3000]['dt']]
+        store.set_factors("A", dts, [1.1, 1.25])
+        ka = KlineAnalyze("A", "1m", max_xd_len=10 ** 9).reset_kline_from_store(store, offset, length, adjust="pre")
+
+        later = bars[-1]['dt'] + pd.Timedelta(minutes=5)
+        old = store.set_factors("A", dts + [later], [1.1, 1.25, 1.4])
+        rescale_pre(ka, old, store.factors["A"])
+        ref = KlineAnalyze("A", "1m", max_xd_len=10 ** 9).reset_kline_from_store(store, offset, length, adjust="pre")
+        assert [x for x in _names + ('_ma', '_macd') if not _close(getattr(ka, x), getattr(ref, x))] == []
+
+        old = store.set_factors("A", [bars[1000]['dt'], bars[4000]['dt'], later], [1.1, 1.3, 1.4])
+        rescale_pre(ka, old, store.factors["A"])
+        ref = KlineAnalyze("A", "1m", max_xd_len=10 ** 9).reset_kline_from_store(store, offset, length, adjust="pre")
+        assert [x for x in _names if not _close(getattr(ka, x), getattr(ref, x))] == []
+    finally:
+        store.close()
+        store.unlink()
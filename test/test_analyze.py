@@ -0,0 +1,44 @@
+# coding: utf-8
+"""对外序列（kline_raw、bi_list 等）的读取与赋值"""
+import pandas as pd
+from benchmark import random_bars
+from czsc import KlineAnalyze
+
+
+def _analyze(bars):
+    return KlineAnalyze("SH600000", "1m", max_xd_len=10 ** 9).reset_kline(None, bars, is_normalized=True)
+
+
+def _equal(a, b):
+    """逐个元素比较，nan 视为相等（整体计算的均线、MACD 开头为 nan）"""
+    return pd.DataFrame(list(a)).equals(pd.DataFrame(list(b)))
+
+
+def test_read_has_no_side_effect():
+    """读取对外序列不修改分析器的状态，修改读到的元素不影响分析器"""
+    ka = _analyze(random_bars(3000))
+    views = {k: (list(v[0]), list(v[1])) for k, v in ka._views.items()}
+    ma_rows = list(ka._ma._rows)
+    for name in ('kline_raw', 'kline_new', 'ma', 'macd', 'fx_list', 'bi_list', 'xd_list', 'zs_list'):
+        seq = getattr(ka, name)
+        last = seq[-1]['start_point'] if name == 'zs_list' else seq[-1]
+        assert isinstance(last['dt'], pd.Timestamp) and list(seq)[-1] == seq[-1]
+        last['dt'] = None
+        assert getattr(ka, name)[-1] == list(seq)[-1]
+    assert ka._ma._rows == ma_rows      # 整体计算的均线按列存放，读取时不生成、不缓存内部元素
+    assert {k: (list(v[0]), list(v[1])) for k, v in ka._views.items()} == views
+    assert ka.bi_list == list(ka.snapshot.bi_list) and ka.zs_list == ka.snapshot.zs_list
+
+
+def test_assign_writes_through():
+    """对外序列赋值后写回内部序列，时间字段转回 int64 纳秒时间戳"""
+    bars = random_bars(3000)
+    ka, kb = _analyze(bars), _analyze(bars[:2000])
+    for name in ('kline_raw', 'kline_new', 'ma', 'macd', 'fx_list', 'bi_list', 'xd_list', 'zs_list'):
+        setattr(kb, name, getattr(ka, name))
+        assert _equal(getattr(kb, '_' + name), getattr(ka, '_' + name))
+        assert _equal(getattr(kb, name), getattr(ka, name))
+
+    bi_list = ka.bi_list[:-3]
+    ka.bi_list = bi_list
+    assert ka.bi_list == bi_list and isinstance(ka._bi_list[-1]['dt'], int)
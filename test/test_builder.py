@@ -0,0 +1,64 @@
+# coding: utf-8
+"""K线合成器：批量输入与逐笔输入合成的K线相同，带时区的时间直接报错"""
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import random_bars
+from czsc import BarBuilder, KlineAnalyze
+
+
+def _ticks(n, seed=1):
+    """两个交易日、两个标的交错的成交，包含开盘前、午休和收盘后的成交"""
+    rng = np.random.default_rng(seed)
+    days = np.array([pd.Timestamp("2020-01-06").value, pd.Timestamp("2020-01-07").value])
+    tods = rng.integers(pd.Timedelta("09:20:00").value, pd.Timedelta("15:10:00").value, n)
+    dts = np.sort(days[rng.integers(0, 2, n)] + tods)
+    symbols = np.where(rng.random(n) < 0.6, "A", "B").astype(object)
+    prices = np.round(10 + np.cumsum(rng.normal(0, 0.01, n)), 2)
+    vols = rng.integers(1, 100, n).astype(float)
+    return symbols, dts, prices, vols
+
+
+def _builder(history):
+    finals = []
+    builder = BarBuilder(freqs=("1m", "5m", "30m", "1d"), on_bar=lambda k, is_final: is_final and finals.append(k))
+    ka = KlineAnalyze("A", "5m").reset_kline(None, history, is_normalized=True)
+    builder.register(ka)
+    return builder, ka, finals
+
+
+@pytest.mark.parametrize("chunk", [1, 37, 5000])
+def test_update_batch_matches_update(chunk):
+    """任意分批输入，完成的K线、当前K线和分析器的结果都与逐笔输入相同；成交量为整数，求和的顺序不影响结果"""
+    symbols, dts, prices, vols = _ticks(5000)
+    history = random_bars(1000, seed=2, symbol="A")
+    b1, ka1, finals1 = _builder(history)
+    b2, ka2, finals2 = _builder(history)
+    for s, t, p, v in zip(symbols, dts.tolist(), prices.tolist(), vols.tolist()):
+        b1.update(s, t, p, v)
+    for i in range(0, len(dts), chunk):
+        b2.update_batch(symbols[i: i + chunk], pd.DatetimeIndex(dts[i: i + chunk]), prices[i: i + chunk],
+                        vols[i: i + chunk])
+    assert b1.bars == b2.bars
+    b1.flush()
+    b2.flush()
+    # 批量输入时按标的、级别依次推送，只比较推送的K线集合
+    key = lambda k: (k['symbol'], k['dt'], k['vol'], k['high'], k['low'])
+    assert sorted(finals1, key=key) == sorted(finals2, key=key) and len(finals1) > 0
+    assert ka1.kline_raw == ka2.kline_raw and ka1.bi_list == ka2.bi_list
+
+
+def test_reject_tz_aware():
+    """按天切分K线要求本地时间，带时区的成交时间直接报错，不会按 UTC 归入错误的K线"""
+    builder = BarBuilder()
+    dt = pd.Timestamp("2020-01-06 09:35", tz="Asia/Shanghai")
+    with pytest.raises(ValueError):
+        builder.update("A", dt, 10.0)
+    with pytest.raises(ValueError):
+        builder.update_batch(["A"], pd.DatetimeIndex([dt]), [10.0])
+    with pytest.raises(ValueError):
+        builder.flush(dt)
+    assert builder.bars == {}
+
+    builder.update_batch(["A"], pd.DatetimeIndex([dt.tz_localize(None)]), [10.0])
+    assert builder.bars[("A", "1m")][0] == pd.Timestamp("2020-01-06 09:35").value
@@ -0,0 +1,21 @@
+# coding: utf-8
+"""数组内核（engine="array"）与参考实现的结果一致"""
+import pytest
+from benchmark import random_bars
+from czsc import engine
+
+
+@pytest.mark.parametrize("bi_mode", ["new", "old"])
+@pytest.mark.parametrize("seed", [1, 2, 3, 5, 8])
+def test_parity(seed, bi_mode):
+    assert engine.check_parity(random_bars(3000, seed=seed), bi_mode=bi_mode) == []
+
+
+@pytest.mark.parametrize("bi_mode", ["new", "old"])
+def test_parity_without_numba(monkeypatch, bi_mode):
+    """没有安装 numba 时内核按纯 Python 执行"""
+    monkeypatch.setattr(engine, "has_numba", False)
+    for name in ("merge_inclusion", "find_fx", "build_bi"):
+        func = getattr(engine, name)
+        monkeypatch.setattr(engine, name, getattr(func, "py_func", func))
+    assert engine.check_parity(random_bars(3000, seed=4), bi_mode=bi_mode) == []
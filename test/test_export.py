@@ -0,0 +1,45 @@
+# coding: utf-8
+"""批量导出图表：离线 html 的 js 依赖、带回调的分析器在进程池中导出"""
+import os
+import pickle
+
+import pytest
+from benchmark import random_bars
+from czsc import KlineAnalyze, SignalJournal, batch_export, render_html
+
+pytest.importorskip("pyecharts")
+
+
+@pytest.fixture
+def ka():
+    return KlineAnalyze("SH600000", "1m").reset_kline(None, random_bars(1500), is_normalized=True)
+
+
+def test_offline_html_requires_js_dir(ka, tmp_path):
+    """离线 html 必须指定本地 js 依赖目录，依赖全部内联，不留外部引用"""
+    with pytest.raises(ValueError, match="js_dir"):
+        render_html(ka, str(tmp_path / "a.html"), offline=True)
+    with pytest.raises(ValueError, match="js_dir"):
+        batch_export([ka], str(tmp_path), offline=True, max_workers=1)
+
+    js_dir = tmp_path / "js"
+    js_dir.mkdir()
+    with pytest.raises(FileNotFoundError):
+        render_html(ka, str(tmp_path / "a.html"), js_dir=str(js_dir), offline=True)
+    (js_dir / "echarts.min.js").write_text("var echarts = {};", encoding="utf-8")
+    path = render_html(ka, str(tmp_path / "a.html"), js_dir=str(js_dir), offline=True)
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    assert "var echarts = {};" in html and " src=" not in html
+
+
+def test_batch_export_with_callbacks(ka, tmp_path):
+    """分析器登记了信号日志（持有线程和队列）时仍然可以序列化，传给子进程导出；回调不随分析器序列化"""
+    journal = SignalJournal(str(tmp_path / "signals.db"))
+    try:
+        journal.register(ka)
+        assert pickle.loads(pickle.dumps(ka)).callbacks == [] and ka.callbacks == [journal.update]
+        res = batch_export([ka], str(tmp_path / "out"), fmt="svg", max_workers=2, max_points=500)
+        assert res['count'] == 1 and os.path.getsize(res['files'][0]) > 0
+    finally:
+        journal.close()
@@ -0,0 +1,90 @@
+# coding: utf-8
+"""信号日志：同一信号只记录一次，重启后不重复写入；队列已满时丢弃并计数，多线程记录时计数准确"""
+import threading
+
+import pandas as pd
+import pytest
+from benchmark import random_bars
+from czsc import KlineAnalyze, SignalJournal
+from czsc.journal import get_signals
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "signals.db")
+
+
+def _ka(bars):
+    return KlineAnalyze("SH600000", "1m").reset_kline(None, bars, freqs=["5m"], is_normalized=True)
+
+
+def test_register_and_restart(path):
+    """登记时记录当前的三买、三卖；重新打开日志、用同样的K线登记，不重复写入"""
+    bars = random_bars(6000, seed=2)
+    ka = _ka(bars)
+    journal = SignalJournal(path)
+    journal.register(ka)
+    assert journal.flush(10)
+    df = journal.query(kind=["buy3", "sell3"])
+    expected = [(pd.Timestamp(dt), kind) for x in [ka] + ka.ka_list
+                for dt, kind, _, _ in get_signals(x) if kind in ("buy3", "sell3")]
+    assert sorted(zip(df['dt'], df['kind'])) == sorted(expected) and len(expected) > 0
+    total = len(journal.query())
+    journal.close()
+
+    journal = SignalJournal(path)
+    try:
+        journal.register(_ka(bars))
+        assert journal.flush(10) and journal.stats['written'] == total
+        assert len(journal.query()) == total
+        assert journal.query(freq="5m", limit=2)['freq'].tolist() == ["5m", "5m"]
+    finally:
+        journal.close()
+
+
+def test_record_dedup(path):
+    """同一 (symbol, freq, kind, dt) 只保留第一次记录"""
+    journal = SignalJournal(path)
+    try:
+        dt = pd.Timestamp("2020-01-02 10:00")
+        journal.record("A", "1m", dt, "custom", 1.0, note="first")
+        journal.record("A", "1m", dt.value, "custom", 2.0, note="second")
+        journal.record("A", "5m", dt, "custom", 3.0)
+        assert journal.flush(10)
+        df = journal.query(symbol="A", kind="custom")
+        assert df['price'].tolist() == [1.0, 3.0] and df['info'].tolist() == [{"note": "first"}, {}]
+        assert journal.stats == {"queued": 3, "written": 3, "dropped": 0}
+    finally:
+        journal.close()
+
+
+def test_dropped(path):
+    """队列已满时丢弃新的信号，不阻塞记录的线程"""
+    journal = SignalJournal(path, max_queue=2)
+    journal.close()     # 停止写入线程，队列不再被消费
+    for i in range(5):
+        journal.record("A", "1m", i, "custom")
+    assert journal.stats == {"queued": 2, "written": 0, "dropped": 3}
+
+
+def test_concurrent_stats(path):
+    """多个线程同时记录、后台线程同时写入，计数不丢失"""
+    journal = SignalJournal(path, batch_size=50, flush_interval=0.01, max_queue=100)
+    n = 2000
+
+    def produce(j):
+        for i in range(n):
+            journal.record("S%i" % j, "1m", i, "custom")
+
+    threads = [threading.Thread(target=produce, args=(j,)) for j in range(4)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert journal.flush(10)
+        stats = journal.stats
+        assert stats['queued'] + stats['dropped'] == 4 * n and stats['written'] == stats['queued']
+        assert len(journal.query(kind="custom")) == stats['queued']
+    finally:
+        journal.close()
@@ -0,0 +1,72 @@
+# coding: utf-8
+from benchmark import random_bars
+from czsc import AnalyzerRegistry, KlineAnalyze
+
+
+def test_evict_keeps_bars_added_through_get(tmp_path):
+    """对 get 返回的分析器直接 add_kline，释放之后恢复的分析器包含这些K线"""
+    bars = random_bars(1200)
+    registry = AnalyzerRegistry(str(tmp_path), lambda symbol, freq: KlineAnalyze(symbol, freq).reset_kline(
+        None, bars[:1000], is_normalized=True))
+    registry.evict("SH600000", "1m")    # 没有载入过时什么也不做
+    ka = registry.get("SH600000", "1m")
+    registry.evict("SH600000", "1m")    # 写入第一份快照
+
+    ka = registry.get("SH600000", "1m")
+    for k in bars[1000:]:
+        ka.add_kline(k)
+    end_dt = ka.end_dt
+    registry.evict("SH600000", "1m")
+    assert ("SH600000", "1m") not in registry
+    assert registry.get("SH600000", "1m").end_dt == end_dt
+
+
+def _factory(bars):
+    return lambda symbol, freq: KlineAnalyze(symbol, freq).reset_kline(None, bars, is_normalized=True)
+
+
+def test_budget_and_pending(tmp_path):
+    """超出预算时释放最久未使用的分析器；释放期间收到的K线在恢复时补算，与一直在内存中的结果相同"""
+    bars = random_bars(1500)
+    registry = AnalyzerRegistry(str(tmp_path), _factory(bars[:1000]), max_bytes=1)
+    for symbol in ("A", "B", "C"):
+        registry.get(symbol, "1m")
+    assert len(registry) == 1 and ("C", "1m") in registry
+    assert registry.stats == {"hits": 0, "misses": 3, "rehydrations": 0, "evictions": 2}
+
+    for k in bars[1000:1200]:
+        registry.update("A", "1m", k, is_final=True)      # A 已经释放，暂存
+    registry.update("A", "1m", bars[1200], is_final=False)
+    ka = registry.get("A", "1m")
+    ref = KlineAnalyze("A", "1m").reset_kline(None, bars[:1000], is_normalized=True)
+    ref.add_klines(bars[1000:1201], is_final=[True] * 200 + [False])
+    assert ka.kline_raw == ref.kline_raw and ka.bi_list == ref.bi_list and ka.xd_list == ref.xd_list
+    assert registry.stats['rehydrations'] == 1 and ("C", "1m") not in registry
+
+    # factory 载入的历史K线已经包含的暂存K线不再重复输入
+    for k in bars[990:1010]:
+        registry.update("D", "1m", k, is_final=True)
+    assert registry.get("D", "1m").kline_raw == bars[:1010]
+
+
+def test_callbacks_and_fetch(tmp_path):
+    """回调不写入快照，恢复后仍然登记在分析器上；没有暂存的K线时用 fetch 获取快照之后的K线"""
+    bars = random_bars(1200)
+    fetched = []
+
+    def fetch(symbol, freq, end_dt):
+        fetched.append(end_dt)
+        return [k for k in bars if k['dt'] > end_dt]
+
+    registry = AnalyzerRegistry(str(tmp_path), _factory(bars[:1000]), fetch=fetch)
+    calls = []
+    ka = registry.get("A", "1m")
+    ka.callbacks.append(calls.append)
+    registry.evict("A", "1m")
+    assert not fetched
+
+    ka = registry.get("A", "1m")
+    ref = KlineAnalyze("A", "1m").reset_kline(None, bars[:1000], is_normalized=True)
+    ref.add_klines(bars[1000:])
+    assert fetched == [bars[999]['dt']] and ka.kline_raw == ref.kline_raw and ka.bi_list == ref.bi_list
+    assert ka.callbacks == [calls.append] and calls == [ka]
@@ -0,0 +1,56 @@
+# coding: utf-8
+"""截面扫描器：摘要表与分析器一致，按条件筛选、多级别联合筛选，时间字段保留纳秒精度"""
+import pandas as pd
+from benchmark import random_bars
+from czsc import KlineAnalyze, Scanner
+
+
+def _ka(symbol, freq, seed, n=1500):
+    bars = random_bars(n, seed=seed, symbol=symbol)
+    return KlineAnalyze(symbol, freq).reset_kline(None, bars, is_normalized=True)
+
+
+def _direction(ka):
+    return "up" if ka.bi_list[-1]['fx_mark'] == 'g' else "down"
+
+
+def test_query_and_scan():
+    """query 的结果与各分析器的最后一笔方向一致，scan 取各级别筛选结果的交集"""
+    scanner = Scanner(capacity=2)
+    kas = {(s, f): _ka(s, f, seed) for seed, (s, f) in enumerate(
+        [(s, f) for s in ("A", "B", "C", "D") for f in ("1m", "5m")], start=1)}
+    for ka in kas.values():
+        scanner.register(ka)
+    assert len(scanner.to_df()) == len(kas)
+
+    up = {k for k, ka in kas.items() if _direction(ka) == "up"}
+    for freq in ("1m", "5m"):
+        expected = sorted(s for s, f in up if f == freq)
+        assert sorted(scanner.query('bi_direction == "up"', freq=freq)['symbol']) == expected
+
+    expected = sorted(s for s, f in up if f == "1m" and (s, "5m") in up)
+    assert sorted(scanner.scan({"1m": 'bi_direction == "up"', "5m": 'bi_direction == "up"'})) == expected
+
+    price = kas[("A", "1m")].latest_price
+    assert scanner.query("latest_price == @price", freq="1m", price=price)['symbol'].tolist() == ["A"]
+
+    scanner.remove("A")
+    assert "A" not in scanner.to_df()['symbol'].tolist() and len(scanner.to_df()) == len(kas) - 2
+
+
+def test_update_through_callback():
+    """登记之后 add_kline 自动刷新摘要表；时间字段按 int64 转换，不经过浮点数丢失纳秒精度"""
+    bars = random_bars(1500, seed=3)
+    for x in bars:
+        x['dt'] += pd.Timedelta(nanoseconds=1)
+    ka = KlineAnalyze("A", "1m").reset_kline(None, bars[:-1], is_normalized=True)
+    scanner = Scanner()
+    scanner.register(ka)
+    scanner.register(KlineAnalyze("B", "1m"))   # 没有K线，时间字段为 NaT
+    df = scanner.to_df()
+    assert df['end_dt'].iloc[0] == bars[-2]['dt'] and pd.isna(df['end_dt'].iloc[1])
+
+    ka.add_kline(bars[-1], is_final=True)
+    df = scanner.to_df()
+    assert df['end_dt'].iloc[0] == bars[-1]['dt'] and df['latest_price'].iloc[0] == bars[-1]['close']
+    assert df['buy3_dt'].isna().iloc[0] != bool(df['buy3'].iloc[0])
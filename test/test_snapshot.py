@@ -0,0 +1,86 @@
+# coding: utf-8
+"""只读快照：FrozenList 与对应的列表一致、共享没有变化的块；旧快照不随更新变化，读取线程看到的快照前后一致"""
+import copy
+import pickle
+import random
+import threading
+
+from benchmark import random_bars
+from czsc import KlineAnalyze
+from czsc.snapshot import FrozenList, _chunk_size
+
+_names = ('fx_list', 'bi_list', 'xd_list', 'zs_list')
+
+
+def test_evolve():
+    """尾部追加、替换、从头部截断之后，新版本与列表一致，元素为同一对象，没有变化的整块共享"""
+    rng = random.Random(1)
+    items, fl = [], FrozenList()
+    for _ in range(3000):
+        op = rng.random()
+        if op < 0.6:
+            items = items + [object() for _ in range(rng.randint(0, 3))]
+        elif op < 0.8 and items:
+            items = items[:-rng.randint(1, min(5, len(items)))] + [object()]
+        elif op < 0.9 and items:
+            items = items[rng.randint(0, min(70, len(items))):]
+        prev, fl = fl, fl.evolve(items)
+        assert len(fl) == len(items) and all(fl[i] is x for i, x in enumerate(items))
+        assert list(fl) == items and fl[1:5] == items[1:5] and (not items or fl[-1] is items[-1])
+        same = next((i for i, (a, b) in enumerate(zip(prev, items)) if a is not b), min(len(prev), len(items)))
+        if prev._start == fl._start and prev._start + same >= _chunk_size:
+            # 追加、替换尾部时，没有变化的整块为同一个元组
+            assert prev._chunks[0] is fl._chunks[0]
+    assert fl.evolve(items) is fl and fl.evolve(list(items)) is fl
+
+
+def test_snapshots_share_unchanged_prefix():
+    """逐根 add_kline，每次发布新版本；旧快照不变，新快照与旧快照共享没有变化的元素和块"""
+    bars = random_bars(3000, seed=1)
+    ka = KlineAnalyze("SH600000", "1m").reset_kline(None, bars[:2000], freqs=["5m"], is_normalized=True)
+    s0 = ka.snapshot
+    saved = {name: copy.deepcopy(list(getattr(s0, name))) for name in _names}
+    prev = s0
+    for k in bars[2000:]:
+        ka.add_kline(k)
+        s = ka.snapshot
+        assert s.version == prev.version + 1 and s.ka_list[0] is ka.ka_list[0].snapshot
+        for name in _names:
+            old, new = getattr(prev, name), getattr(s, name)
+            if new._start == old._start and len(old) >= 3 * _chunk_size:
+                # 只有最后一两块内的元素变化，之前的块共享
+                assert new._chunks[0] is old._chunks[0] and all(new[i] is old[i] for i in range(_chunk_size)), name
+        prev = s
+    assert {name: list(getattr(s0, name)) for name in _names} == saved
+    assert all(getattr(ka.snapshot, name) == getattr(ka, name) for name in _names)
+
+    s = pickle.loads(pickle.dumps(ka)).snapshot
+    assert s.version == ka.snapshot.version and all(getattr(s, name) == getattr(ka, name) for name in _names)
+
+
+def test_concurrent_reader():
+    """读取线程不加锁读取快照：版本号单调递增，同一快照中的线段标记都是同一快照中的笔标记"""
+    bars = random_bars(3000, seed=2)
+    ka = KlineAnalyze("SH600000", "1m").reset_kline(None, bars[:1000], is_normalized=True)
+    errors, stop = [], threading.Event()
+
+    def reader():
+        last = 0
+        while not stop.is_set():
+            s = ka.snapshot
+            if s.version < last:
+                errors.append("version")
+            last = s.version
+            dts = {x['dt'] for x in s.bi_list}
+            if any(x['dt'] not in dts for x in s.xd_list):
+                errors.append("torn")
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for k in bars[1000:]:
+            ka.add_kline(k)
+    finally:
+        stop.set()
+        thread.join()
+    assert errors == []
@@ -0,0 +1,114 @@
+# coding: utf-8
+"""全市场K线库：预先计算的指标、从K线库重新计算的分析器与逐个标的计算的结果一致"""
+import numpy as np
+import pandas as pd
+import pytest
+import talib as ta
+from benchmark import random_bars
+from czsc import BarStore, KlineAnalyze, analyze_universe, engine
+from czsc.scanner import get_summary
+
+
+@pytest.fixture
+def store():
+    bars = {"A": random_bars(3000, seed=1), "B": random_bars(30, seed=2), "C": random_bars(1500, seed=3)}
+    store = BarStore.from_bars(bars)
+    store.set_factors("A", [bars["A"][1000]['dt']], [1.2])
+    yield store
+    store.close()
+    store.unlink()
+
+
+@pytest.fixture(params=["shm", "mmap"])
+def shared(request, tmp_path):
+    bars = {"A": random_bars(1200, seed=1), "B": random_bars(800, seed=2)}
+    path = str(tmp_path / "bars.dat") if request.param == "mmap" else None
+    store = BarStore.from_bars(bars, path=path)
+    yield store
+    store.close()
+    store.unlink()
+
+
+def _frame(rows):
+    return pd.DataFrame(list(rows))
+
+
+@pytest.mark.parametrize("numba", [True, False])
+def test_indicators_match_talib(monkeypatch, numba):
+    """一次遍历首尾相接的收盘价，各段与单独调用 TA-Lib 的结果相同（信号线只允许末位的差别）"""
+    monkeypatch.setattr(engine, "has_numba", numba and engine.has_numba)
+    lengths = [0, 1, 25, 33, 34, 35, 120, 121, 800, 2000]
+    close = np.cumsum(np.random.default_rng(1).normal(0, 1, sum(lengths))) + 100
+    offsets = np.cumsum([0] + lengths[:-1]).tolist()
+    out = engine.indicators(close, offsets, lengths, (5, 34, 120))
+    for o, n in zip(offsets, lengths):
+        x = close[o: o + n]
+        for p in (5, 34, 120):
+            assert np.array_equal(out['ma%i' % p][o: o + n], ta.SMA(x, p), equal_nan=True)
+        diff, dea, macd = ta.MACD(x, 12, 26, 9)
+        assert np.array_equal(out['diff'][o: o + n], diff, equal_nan=True)
+        assert np.allclose(out['dea'][o: o + n], dea, rtol=0, atol=1e-12, equal_nan=True)
+        assert np.allclose(out['macd'][o: o + n], macd, rtol=0, atol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize("adjust", [None, "pre"])
+@pytest.mark.parametrize("precompute", [False, True])
+def test_reset_from_store(store, adjust, precompute):
+    """从K线库按列读取原始K线、指标，与用 to_bars 的结果调用 reset_kline 相同"""
+    if precompute:
+        store.compute_indicators((5, 34, 120), adjust)
+    for symbol, (offset, length) in store.index.items():
+        ka = KlineAnalyze(symbol, "1m").reset_kline_from_store(store, offset, length, adjust=adjust)
+        ref = KlineAnalyze(symbol, "1m").reset_kline(
+            None, store.to_bars(symbol, offset, length, i8=True, adjust=adjust), is_normalized=True)
+        for name in ('_kline_raw', '_kline_new', '_ma', '_macd', '_fx_list', '_bi_list', '_xd_list', '_zs_list'):
+            assert _frame(getattr(ka, name)).equals(_frame(getattr(ref, name))), name
+
+
+def test_store_rows_after_update(store):
+    """按列存放的原始K线在增量更新时转成普通列表，K线库关闭之后分析器仍然可用"""
+    store.compute_indicators()
+    offset, length = store.index["A"]
+    ka = KlineAnalyze("A", "1m").reset_kline_from_store(store, offset, length - 1)
+    last = store.to_bars("A", offset, length)[-1]
+    store.close()
+    ka.add_kline(last, is_final=True)
+    assert isinstance(ka._kline_raw, list) and ka.kline_raw[-1] == last
+    assert len(ka.ma) == length and len(ka.macd) == length
+
+
+def test_attach(shared):
+    """attach 打开同一块内存：K线、复权因子表、预先计算的指标都与创建者相同，写入对双方可见"""
+    shared.set_factors("A", [shared.to_bars("A", *shared.index["A"])[600]['dt']], [1.5])
+    shared.compute_indicators(adjust="pre")
+    other = BarStore.attach(shared.handle)
+    try:
+        for f, v in shared.columns.items():
+            assert np.array_equal(other.columns[f], v)
+        for f, v in shared.ta_columns.items():
+            assert np.array_equal(other.ta_columns[f], v, equal_nan=True)
+        assert other.ta_params == shared.ta_params and other.factors.keys() == shared.factors.keys()
+        other.index = dict(shared.index)
+        offset, length = shared.index["A"]
+        assert other.to_bars("A", offset, length, adjust="pre") == shared.to_bars("A", offset, length, adjust="pre")
+
+        shared.columns['vol'][0] = -1.0
+        assert other.columns['vol'][0] == -1.0
+    finally:
+        other.close()
+
+
+@pytest.mark.parametrize("indicators", [True, False])
+def test_analyze_universe(shared, indicators):
+    """多进程分析与在当前进程中逐个标的调用 reset_kline 的结果相同，func 的返回值作为结果"""
+    kwargs = dict(freqs=["5m"], bi_mode="old")
+    res = analyze_universe(shared, "1m", get_summary, max_workers=2, indicators=indicators, **kwargs)
+    assert res.keys() == shared.index.keys()
+    for symbol, (offset, length) in shared.index.items():
+        ka = KlineAnalyze(symbol, "1m", bi_mode="old").reset_kline(
+            None, shared.to_bars(symbol, offset, length), is_normalized=True, freqs=["5m"])
+        assert pd.Series(res[symbol]).equals(pd.Series(get_summary(ka)))
+
+    res = analyze_universe(shared, "1m", symbols=["B"], max_workers=1)
+    offset, length = shared.index["B"]
+    assert list(res) == ["B"] and res["B"].kline_raw == shared.to_bars("B", offset, length)
@@ -0,0 +1,67 @@
+# coding: utf-8
+"""参数扫描：每组参数的结果与分别 reset_kline 相同，各步骤按参数只计算一次；min_gap 传给高级别"""
+import pandas as pd
+import pytest
+from benchmark import random_bars
+from czsc import KlineAnalyze, expand_grid, sweep
+
+bars = random_bars(3000, seed=3)
+grid = {"min_gap": [0.001, 0.005], "bi_mode": ["new", "old"], "zs_mode": ["xd", "bi"],
+        "ma_params": [(5, 20), (5, 34, 120)], "adjust": [0.8, 1.0]}
+
+
+def _params(config):
+    return {k: v for k, v in config.items() if k != 'adjust'}
+
+
+def _same_as_reset(ka, config):
+    """组装出的分析器内部序列与 reset_kline 完全相同"""
+    ref = KlineAnalyze("sweep", "1m", **_params(config)).reset_kline(None, bars, is_normalized=True)
+    names = ('_kline_raw', '_kline_new', '_ma', '_macd', '_fx_list', '_bi_list', '_xd_list', '_zs_list')
+    return {"same": all(pd.DataFrame(list(getattr(ka, n))).equals(pd.DataFrame(list(getattr(ref, n))))
+                        for n in names)}
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_sweep_matches_reset(max_workers):
+    """比较指标与分别 reset_kline 之后计算的相同"""
+    df = sweep(bars, grid, max_workers=max_workers)
+    configs = expand_grid(grid)
+    assert len(df) == len(configs)
+    kas = {}
+    for config, (_, row) in zip(configs, df.iterrows()):
+        key = tuple(_params(config).items())
+        if key not in kas:
+            kas[key] = KlineAnalyze("sweep", "1m", **_params(config)).reset_kline(None, bars, is_normalized=True)
+        ka = kas[key]
+        expected = dict(config, fx_count=len(ka.fx_list), bi_count=len(ka.bi_list), xd_count=len(ka.xd_list),
+                        zs_count=len(ka.zs_list), buy3_count=sum('buy3' in zs for zs in ka.zs_list),
+                        sell3_count=sum('sell3' in zs for zs in ka.zs_list),
+                        bi_bei_chi=int(ka.get_fd_bei_chi('bi', config['adjust'])['bei_chi'].sum()),
+                        xd_bei_chi=int(ka.get_fd_bei_chi('xd', config['adjust'])['bei_chi'].sum()))
+        assert {k: row[k] for k in expected} == expected
+    assert df.attrs['stage_runs'] == {"kline_new": 1, "fx": 2, "bi": 4, "xd": 4, "zs": 8, "ta": 2}
+
+
+def test_sweep_func():
+    """func 的结果作为列；组装出的分析器与 reset_kline 的内部序列相同"""
+    df = sweep(pd.DataFrame(bars), [c for c in expand_grid(grid) if c['adjust'] == 1.0], func=_same_as_reset,
+               max_workers=1)
+    assert df['same'].all()
+    with pytest.raises(ValueError):
+        sweep(bars, [{"max_xd_len": 10}])
+
+
+@pytest.mark.parametrize("parallel", ["thread", "process"])
+def test_parallel_levels(parallel):
+    """并行计算高级别时与依次计算的结果相同，min_gap 等参数传给高级别；
+    子进程从K线库读取高级别K线，K线的 symbol 为分析器的 symbol"""
+    kwargs = dict(min_gap=0.005, bi_mode="old", zs_mode="bi")
+    ref = KlineAnalyze("SH600000", "1m", **kwargs).reset_kline(None, bars, freqs=["5m", "30m"], is_normalized=True)
+    ka = KlineAnalyze("SH600000", "1m", **kwargs).reset_kline(None, bars, freqs=["5m", "30m"], is_normalized=True,
+                                                       parallel=parallel)
+    assert [x.freq for x in ka.ka_list] == ["5m", "30m"]
+    for x, y in zip([ka] + ka.ka_list, [ref] + ref.ka_list):
+        assert x.min_gap == 0.005 and x.bi_mode == "old" and x.zs_mode == "bi"
+        assert x.kline_raw == y.kline_raw and x.fx_list == y.fx_list and x.bi_list == y.bi_list
+        assert x.xd_list == y.xd_list and x.zs_list == y.zs_list
@@ -0,0 +1,116 @@
+# coding: utf-8
+"""增量更新（add_kline、upsert_kline）的结果与整体计算（reset_kline）一致"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import random_bars
+from czsc import KlineAnalyze
+
+_names = ('kline_new', 'fx_list', 'bi_list', 'xd_list', 'zs_list')
+
+
+def _reset(bars, **kwargs):
+    return KlineAnalyze("SH600000", "1m", max_xd_len=10 ** 9, **kwargs).reset_kline(None, bars, is_normalized=True)
+
+
+def _modify(bars, rng):
+    """随机修改一根历史K线的最高价、最低价，返回修改后的K线"""
+    j = rng.randrange(50, len(bars))
+    d = rng.choice([0.05, -0.05, 0.1, -0.1])
+    k = dict(bars[j])
+    k['high'] = max(k['high'] + d, k['open'], k['close'])
+    k['low'] = min(k['low'] + d, k['open'], k['close'])
+    bars[j] = k
+    return k
+
+
+def _diff(ka, kb):
+    """对外序列、快照中与整体计算不一致的序列名称"""
+    res = [name for name in _names if getattr(ka, name) != getattr(kb, name)]
+    return res + ["snapshot." + name for name in _names[1:] if list(getattr(ka.snapshot, name)) != getattr(kb, name)]
+
+
+def test_feature_seq_cache_after_upsert():
+    """更正历史K线之后，缓存的标准特征序列不能保留变化之后的笔标记"""
+    bars = random_bars(3000, seed=2)
+    rng = random.Random(2)
+    ka = _reset(bars, bi_mode='old')
+    for _ in range(12):
+        ka.upsert_kline(_modify(bars, rng))
+        assert _diff(ka, _reset(bars, bi_mode='old')) == []
+
+
+@pytest.mark.parametrize("seed", [2, 5, 7])
+@pytest.mark.parametrize("bi_mode", ["new", "old"])
+def test_upsert_matches_reset(seed, bi_mode):
+    """补入迟到的K线、更正历史K线之后与整体计算一致"""
+    bars = random_bars(3000, seed=seed)
+    rng = random.Random(seed)
+    missing = sorted(rng.sample(range(100, 2990), 3))
+    ka = _reset([x for j, x in enumerate(bars) if j not in missing], bi_mode=bi_mode)
+    for j in missing:
+        ka.upsert_kline(bars[j])
+    assert _diff(ka, _reset(bars, bi_mode=bi_mode)) == []
+
+    for _ in range(12):
+        ka.upsert_kline(_modify(bars, rng))
+        assert _diff(ka, _reset(bars, bi_mode=bi_mode)) == []
+
+
+@pytest.mark.parametrize("bi_mode", ["new", "old"])
+def test_backfill_in_any_order(bi_mode):
+    """一段连续缺失的K线和倒数第二根K线乱序补入，结果与整体计算一致"""
+    bars = random_bars(2500, seed=11)
+    missing = list(range(1200, 1220)) + [2498]
+    ka = _reset([x for j, x in enumerate(bars) if j not in missing], bi_mode=bi_mode)
+    random.Random(11).shuffle(missing)
+    for j in missing:
+        ka.upsert_kline(bars[j])
+    assert ka.kline_raw == _reset(bars).kline_raw
+    assert _diff(ka, _reset(bars, bi_mode=bi_mode)) == []
+
+
+def test_upsert_indicators():
+    """补入K线之后，之前的指标不变，均线与整体计算一致；MACD 只重新计算窗口内的部分，时间与原始K线一一对应"""
+    bars = random_bars(2000, seed=3)
+    j = 1500
+    ka = _reset(bars[:j] + bars[j + 1:])
+    ka.upsert_kline(bars[j])
+    ref = _reset(bars)
+    dts = [x['dt'] for x in ka._kline_raw]
+    assert [x['dt'] for x in ka._ma] == dts and [x['dt'] for x in ka._macd] == dts
+    for name in ('_ma', '_macd'):
+        assert pd.DataFrame(getattr(ka, name)[:j]).equals(pd.DataFrame(getattr(ref, name)[:j])), name
+    for p in ka.ma_params:
+        key = 'ma%i' % p
+        assert np.allclose([x[key] for x in ka._ma], [x[key] for x in ref._ma], equal_nan=True)
+
+
+def test_upsert_edges():
+    """晚于最后一根K线时等同于 add_kline(k, is_final=True)；更正未完成的最后一根K线；早于第一根K线时报错"""
+    bars = random_bars(1500, seed=4)
+    ka, kb = _reset(bars[:-1]), _reset(bars[:-1])
+    ka.upsert_kline(bars[-1])
+    kb.add_kline(bars[-1], is_final=True)
+    assert _diff(ka, kb) == [] and ka.kline_raw == kb.kline_raw
+
+    ka = _reset(bars[:-1])
+    ka.add_kline(dict(bars[-1], high=bars[-1]['high'] + 0.5), is_final=False)
+    ka.upsert_kline(bars[-1])
+    assert _diff(ka, _reset(bars)) == [] and not ka._last_unfinished
+
+    with pytest.raises(ValueError):
+        ka.upsert_kline(dict(bars[0], dt=bars[0]['dt'] - pd.Timedelta(minutes=1)))
+
+
+def test_reject_tz_aware():
+    bars = random_bars(500, seed=3)
+    tz_bars = [dict(x, dt=pd.Timestamp(x['dt']).tz_localize("Asia/Shanghai")) for x in bars]
+    with pytest.raises(ValueError):
+        _reset(tz_bars)
+
+    ka = _reset(bars[:-1])
+    with pytest.raises(ValueError):
+        ka.get_sub_section(tz_bars[100]['dt'], tz_bars[200]['dt'])
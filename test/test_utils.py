@@ -0,0 +1,73 @@
+# coding: utf-8
+import numpy as np
+import pytest
+from benchmark import random_bars
+from czsc import KlineAnalyze
+from czsc.utils import is_in_range, is_in_range_array, is_overlap, is_overlap_array
+
+
+def test_is_in_range_array():
+    """与 is_in_range 逐个比较，包括闭区间端点以及容差范围内外的点"""
+    a, b = 1.0, 2.0
+    n = np.array([0.9, 1.0 - 1e-9, 1.0, 1.0 + 1e-9, 1.5, 2.0 - 1e-9, 2.0, 2.0 + 1e-9, 2.0 + 1e-4, 2.1])
+    expected = [is_in_range(a, b, x) for x in n.tolist()]
+    assert is_in_range_array(a, b, n).tolist() == expected
+    assert expected[1:8] == [True] * 7 and not expected[0] and not expected[-1] and not expected[-2]
+
+    # 不考虑容差时按闭区间精确比较
+    assert is_in_range_array(a, b, n, tolerance=False).tolist() == \
+        [False, False, True, True, True, True, True, False, False, False]
+
+    rng = np.random.default_rng(1)
+    low = rng.uniform(0, 10, 1000)
+    high = low + rng.uniform(0.01, 5, 1000)
+    x = np.where(rng.random(1000) < 0.2, np.where(rng.random(1000) < 0.5, low, high), rng.uniform(0, 15, 1000))
+    assert is_in_range_array(low, high, x).tolist() == [is_in_range(*v) for v in zip(low, high, x)]
+    assert is_in_range_array(low, high, x, tolerance=False).tolist() == [l <= v <= h for l, h, v in zip(low, high, x)]
+
+
+def test_is_overlap_array():
+    """与 is_overlap 逐个比较，端点相接时闭区间算重叠"""
+    rng = np.random.default_rng(2)
+    a_low = rng.integers(0, 10, 1000).astype(float)
+    a_high = a_low + rng.integers(0, 5, 1000)
+    b_low = rng.integers(0, 10, 1000).astype(float)
+    b_high = b_low + rng.integers(0, 5, 1000)
+    expected = [is_overlap([al, ah], [bl, bh]) for al, ah, bl, bh in zip(a_low, a_high, b_low, b_high)]
+    assert is_overlap_array(a_low, a_high, b_low, b_high).tolist() == expected
+    assert is_overlap_array(a_low, a_high, b_low, b_high, closed=False).tolist() == \
+        [max(al, bl) < min(ah, bh) for al, ah, bl, bh in zip(a_low, a_high, b_low, b_high)]
+    assert is_overlap_array(1.0, 2.0, 2.0, 3.0) and not is_overlap_array(1.0, 2.0, 2.0, 3.0, closed=False)
+
+
+def _zs_reference(points):
+    """逐个标记点判断的中枢识别，返回 [(开始时间, 结束时间, ZD, ZG, 三买或三卖的时间), ...]"""
+    res, zs_xd = [], []
+    zs_d = zs_g = None
+    for p in points:
+        if len(zs_xd) < 4:
+            zs_xd.append(p)
+            continue
+        zs_d = max(x['xd'] for x in zs_xd[:4] if x['fx_mark'] == 'd')
+        zs_g = min(x['xd'] for x in zs_xd[:4] if x['fx_mark'] == 'g')
+        if zs_g <= zs_d:
+            zs_xd = zs_xd[1:] + [p]
+        elif (p['fx_mark'] == 'd' and p['xd'] > zs_g) or (p['fx_mark'] == 'g' and p['xd'] < zs_d):
+            res.append((zs_xd[0]['dt'], zs_xd[-1]['dt'], zs_d, zs_g, p['dt']))
+            zs_xd = []
+        else:
+            zs_xd.append(p)
+    if len(zs_xd) >= 5:
+        res.append((zs_xd[0]['dt'], None, zs_d, zs_g, None))
+    return res
+
+
+@pytest.mark.parametrize("zs_mode", ["xd", "bi"])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_zs_list(seed, zs_mode):
+    ka = KlineAnalyze("SH600000", "1m", zs_mode=zs_mode, max_xd_len=10 ** 9).reset_kline(
+        None, random_bars(5000, seed=seed), is_normalized=True)
+    points = ka.xd_list if zs_mode == 'xd' else ka.bi_list
+    res = [(zs['start_point']['dt'], zs['end_point']['dt'] if zs['zs_finished'] else None, zs['ZD'], zs['ZG'],
+            zs['buy3']['dt'] if 'buy3' in zs else zs['sell3']['dt'] if 'sell3' in zs else None) for zs in ka.zs_list]
+    assert ka.zs_list and res == _zs_reference(points)